@@ -0,0 +1,179 @@
+"""
+Async read views for DRF.
+
+DRF's views are synchronous, so under an ASGI server (see ``asgi.py``) Django runs
+each request for them in a worker thread and the event loop just waits. The mixins
+here let a view answer GET and HEAD on the event loop instead, with Django's async
+ORM, while everything else about it - serializers, filters, permissions, error
+responses, headers - stays the view's own, so both versions send the same bytes:
+
+* ``AsyncViewMixin`` goes first in the bases. Its ``as_view()`` returns an async
+  view that runs GET/HEAD through ``adispatch()`` (DRF's ``dispatch()`` with async
+  authentication) and hands any other method, and the browsable API, to the
+  regular synchronous view in a thread.
+* ``AsyncListModelMixin`` / ``AsyncRetrieveModelMixin`` go last and provide the
+  final ``aget()``, like ListModelMixin and RetrieveModelMixin do for ``get()``.
+  Mixins in between (conditional GETs, the response cache) add their own ``aget()``.
+
+Which routes use their async view is up to the ``ASYNC_VIEWS`` setting (see
+``select_view``). It only pays off under ASGI: under WSGI Django has to start an
+event loop for every request to an async view.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+def select_view(name, view_class, async_view_class, **initkwargs):
+    """The view for a route: the async one if ``name`` is listed in ASYNC_VIEWS."""
+    if name in getattr(settings, 'ASYNC_VIEWS', ()):
+        return async_view_class.as_view(**initkwargs)
+    return view_class.as_view(**initkwargs)
+
+
+class AsyncViewMixin:
+    """Serve GET and HEAD on the event loop; see the module docstring."""
+
+    async_methods = ('get', 'head')
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        sync_view = sync_to_async(super().as_view(**initkwargs))
+
+        async def view(request, *args, **kwargs):
+            if request.method.lower() not in cls.async_methods:
+                return await sync_view(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            self.sync_view = sync_view
+            return await self.adispatch(request, *args, **kwargs)
+
+        view.view_class = view.cls = cls
+        view.view_initkwargs = view.initkwargs = initkwargs
+        # Token auth doesn't need CSRF, same as any other DRF view
+        return csrf_exempt(view)
+
+    @classmethod
+    def get_sync_view_class(cls):
+        return next(base for base in cls.__mro__[1:]
+                    if issubclass(base, APIView) and not issubclass(base, AsyncViewMixin))
+
+    # The browsable API and OPTIONS describe the view this one stands in for
+    def get_view_name(self):
+        return super().get_view_name().removeprefix('Async ')
+
+    def get_view_description(self, html=False):
+        if getattr(self, 'description', None) is None:
+            self.description = self.get_sync_view_class().__doc__ or ''
+        return super().get_view_description(html)
+
+    def renders_async(self, renderer):
+        # The browsable API builds its forms while rendering, and they query the database
+        return not isinstance(renderer, BrowsableAPIRenderer)
+
+    async def adispatch(self, request, *args, **kwargs):
+        """APIView.dispatch(), awaiting the steps that can touch the database."""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            self.format_kwarg = self.get_format_suffix(**kwargs)
+            request.accepted_renderer, request.accepted_media_type = self.perform_content_negotiation(request)
+            if not self.renders_async(request.accepted_renderer):
+                return await self.sync_view(request._request, *args, **kwargs)
+            request.version, request.versioning_scheme = self.determine_version(request, *args, **kwargs)
+            await self.aperform_authentication(request)
+            self.check_permissions(request)
+            self.check_throttles(request)
+            response = await self.aget(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        response = self.finalize_response(request, response, *args, **kwargs)
+        response.render()
+        # Django's handler would render a template response (again) in a worker thread;
+        # it's rendered already, so pass it on as a plain response and stay on the loop
+        return HttpResponse(response.content, status=response.status_code, headers=response.headers)
+
+    async def aperform_authentication(self, request):
+        """Request._authenticate(), with each authenticator's aauthenticate() if it has one."""
+        for authenticator in request.authenticators:
+            authenticate = getattr(authenticator, 'aauthenticate', None)
+            try:
+                if authenticate is not None:
+                    user_auth_tuple = await authenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+    async def aget_queryset(self):
+        """Override when building the queryset needs a query of its own."""
+        return self.get_queryset()
+
+    async def afilter_queryset(self, queryset):
+        # Filter backends with an afilter_queryset() do their lookups asynchronously
+        for backend in list(self.filter_backends):
+            backend = backend()
+            if hasattr(backend, 'afilter_queryset'):
+                queryset = await backend.afilter_queryset(self.request, queryset, self)
+            else:
+                queryset = backend.filter_queryset(self.request, queryset, self)
+        return queryset
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+    async def aget_object(self):
+        queryset = await self.afilter_queryset(await self.aget_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        obj = await aget_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+class AsyncListModelMixin:
+    """ListModelMixin.list(), with the queries awaited."""
+
+    async def aget(self, request, *args, **kwargs):
+        return await self.alist(request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset(await self.aget_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer([obj async for obj in queryset], many=True)
+        return Response(serializer.data)
+
+
+class AsyncRetrieveModelMixin:
+    """RetrieveModelMixin.retrieve(), with the lookup awaited."""
+
+    async def aget(self, request, *args, **kwargs):
+        return await self.aretrieve(request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
@@ -0,0 +1,19 @@
+"""
+Cache helpers shared by the apps.
+
+Kept apart from async_views.py: the authentication classes use them, and DRF
+imports those while rest_framework.views is still loading.
+"""
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+async def cache_call(cache, method, *args, **kwargs):
+    """
+    Call a cache method from async code. Django's async cache API runs the sync
+    method in a thread for every backend; local memory never blocks, so those
+    are called directly rather than paying for the thread.
+    """
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        return getattr(cache, method)(*args, **kwargs)
+    return await getattr(cache, f'a{method}')(*args, **kwargs)
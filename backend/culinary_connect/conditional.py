@@ -0,0 +1,128 @@
+"""
+Conditional requests (ETag / Last-Modified) for API views.
+
+A client that already has a resource sends back the ETag (If-None-Match) or date
+(If-Modified-Since) it got last time, and if nothing changed we answer
+``304 Not Modified`` with no body - before the view has serialized anything.
+For writes, a client can send If-Match with the ETag it based its edit on, and we
+refuse with ``412 Precondition Failed`` if somebody changed the resource in the
+meantime, which gives optimistic concurrency without an extra GET.
+
+Views opt in by mixing in ``ConditionalGetMixin`` and implementing
+``get_validators(request)``, which should be cheap: a single indexed query or
+data the view already has in hand. Async views (culinary_connect/async_views.py)
+go through ``aget()`` and ``aget_validators()`` instead.
+"""
+import hashlib
+from calendar import timegm
+
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    """A strong ETag from whatever uniquely identifies a representation."""
+    return quote_etag(hashlib.sha256(repr(parts).encode()).hexdigest()[:40])
+
+
+def _timestamp(value):
+    return timegm(value.utctimetuple()) if value is not None else None
+
+
+def _opaque(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def etag_matches(etag, header, weak=False):
+    """
+    Does the header list ``etag``? If-Match compares strongly; If-None-Match weakly
+    (RFC 9110 13.1.2), so a tag a proxy marked W/ - after compressing the body, say -
+    still gets its 304.
+    """
+    if not header or etag is None:
+        return False
+    etags = parse_etags(header)
+    if '*' in etags:
+        return True
+    if weak:
+        return _opaque(etag) in {_opaque(tag) for tag in etags}
+    return not etag.startswith('W/') and etag in etags
+
+
+def is_not_modified(request, etag, last_modified):
+    """
+    Would the client's cached copy still do? If-None-Match wins over
+    If-Modified-Since when both are sent, as RFC 9110 says.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        return etag_matches(etag, if_none_match, weak=True)
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since is not None and last_modified is not None:
+        return _timestamp(last_modified) <= if_modified_since
+    return False
+
+
+def precondition_failed(request, etag, last_modified):
+    """Does an If-Match / If-Unmodified-Since header rule this write out?"""
+    if_match = request.META.get('HTTP_IF_MATCH')
+    if if_match:
+        return not etag_matches(etag, if_match)
+    if_unmodified_since = parse_http_date_safe(request.META.get('HTTP_IF_UNMODIFIED_SINCE', ''))
+    if if_unmodified_since is not None and last_modified is not None:
+        return _timestamp(last_modified) > if_unmodified_since
+    return False
+
+
+def set_validators(response, etag, last_modified):
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(_timestamp(last_modified))
+    return response
+
+
+class ConditionalGetMixin:
+    """Answers GET/HEAD with 304 when the client's copy is still current."""
+
+    def get_validators(self, request):
+        """Return (etag, last_modified) for the current request; either may be None."""
+        return None, None
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        if is_not_modified(request, etag, last_modified):
+            return set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            set_validators(response, etag, last_modified)
+        return response
+
+    async def aget_validators(self, request):
+        """get_validators() for async views; override it if the validators need a query."""
+        return self.get_validators(request)
+
+    async def aget(self, request, *args, **kwargs):
+        etag, last_modified = await self.aget_validators(request)
+        if is_not_modified(request, etag, last_modified):
+            return set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+
+        response = await super().aget(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            set_validators(response, etag, last_modified)
+        return response
+
+    def check_write_preconditions(self, request, etag, last_modified):
+        """
+        Call from update/destroy once the object is loaded. Returns a 412 response
+        to send back if the client's If-Match no longer holds, otherwise None.
+        """
+        if not precondition_failed(request, etag, last_modified):
+            return None
+        return set_validators(Response({
+            "status": "error",
+            "code": "PRECONDITION_FAILED",
+            "message": "The resource has changed since you last fetched it."
+        }, status=status.HTTP_412_PRECONDITION_FAILED), etag, last_modified)
@@ -0,0 +1,51 @@
+"""
+A faster JSON renderer.
+
+DRF's JSONRenderer goes through the standard library's ``json`` module, which spends
+more time than anything else on a big response walking dicts in pure Python.
+``ORJSONRenderer`` hands the same data to orjson instead and sends the same bytes:
+compact separators, UTF-8 rather than \\u escapes, \\u2028/\\u2029 escaped, and
+anything orjson can't write itself (dates, decimals, lazy strings...) turned into
+JSON by DRF's own encoder. Floats are the one exception: Python writes 1e-05 and
+1e+16 where orjson writes 0.00001 and 1e16 (the same numbers), and orjson writes
+NaN as null where a strict JSONRenderer refuses. None of our responses have those.
+
+Whenever orjson can't give the same answer - it isn't installed, the client asked
+for indented JSON, UNICODE_JSON or COMPACT_JSON are off, or the data has something
+orjson won't take, like an integer past 64 bits - JSONRenderer does the work as usual.
+"""
+from rest_framework.renderers import JSONRenderer
+
+from monitoring.instrumentation import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer's output, serialized by orjson."""
+
+    def get_options(self):
+        # Dates go to DRF's encoder, which formats them its own way (times to the millisecond)
+        return orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def uses_orjson(self, accepted_media_type, renderer_context):
+        return (
+            orjson is not None and self.compact and not self.ensure_ascii
+            and self.get_indent(accepted_media_type, renderer_context or {}) is None
+        )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return self.render_json(data, accepted_media_type, renderer_context)
+
+    def render_json(self, data, accepted_media_type, renderer_context):
+        if data is None or not self.uses_orjson(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.get_options())
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
@@ -0,0 +1,166 @@
+"""
+Read replicas.
+
+With DATABASE_REPLICA_URLS set (see settings.py), the GET and HEAD requests - the
+recipe lists, detail pages and profiles that make up nearly all of the traffic -
+read from a replica, picked at random for each request. Everything else stays on
+the primary: every write, anything that runs outside a request (management
+commands, the image workers), and the reads of POST/PUT/PATCH/DELETE requests
+too, so validating and saving a recipe sees the latest rows.
+
+A replica runs a little behind the primary, so right after changing something a
+client could read the old version back. To avoid that, a successful write pins
+the client to the primary for REPLICA_PIN_SECONDS (default 10): it gets a cookie
+saying so, and its credentials (the Authorization header, or else the session
+cookie) are remembered in the default cache, since API clients on another origin
+don't send cookies back. Logging in pins the new token the same way.
+
+Other clients can still read an old version for as long as the replica lags; a
+response cached from one (recipes/response_cache.py) is kept until the next change
+or RECIPE_CACHE_TIMEOUT, so keep the lag well under that.
+
+Tests point every replica at the test database (TEST['MIRROR']), so they read what
+they wrote.
+"""
+import contextvars
+import hashlib
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+
+PIN_COOKIE = 'db_pin'
+PIN_PREFIX = 'replicas:pin'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# The replica this request reads from, or None for the primary
+_replica = contextvars.ContextVar('replica', default=None)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def get_pin_seconds():
+    return getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+
+def credentials_key(credentials):
+    # Hashed, so the cache never holds a usable token
+    return f"{PIN_PREFIX}:{hashlib.sha256(credentials.encode()).hexdigest()}"
+
+
+def request_credentials(request):
+    return request.headers.get('Authorization') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+
+
+def pin(credentials):
+    """Send the reads of requests made with ``credentials`` to the primary for a while."""
+    if get_replicas() and credentials:
+        cache.set(credentials_key(credentials), True, timeout=get_pin_seconds())
+
+
+async def apin(credentials):
+    if get_replicas() and credentials:
+        await cache.aset(credentials_key(credentials), True, timeout=get_pin_seconds())
+
+
+def pin_token(token):
+    pin(f'Token {token.key}')
+
+
+def is_pinned(request):
+    if PIN_COOKIE in request.COOKIES:
+        return True
+    credentials = request_credentials(request)
+    return bool(credentials) and cache.get(credentials_key(credentials), False)
+
+
+async def ais_pinned(request):
+    if PIN_COOKIE in request.COOKIES:
+        return True
+    credentials = request_credentials(request)
+    return bool(credentials) and await cache.aget(credentials_key(credentials), False)
+
+
+def choose_replica(request):
+    """The replica for this request to read from, or None if it should read from the primary."""
+    replicas = get_replicas()
+    if not replicas or request.method not in SAFE_METHODS or is_pinned(request):
+        return None
+    return random.choice(replicas)
+
+
+async def achoose_replica(request):
+    replicas = get_replicas()
+    if not replicas or request.method not in SAFE_METHODS or await ais_pinned(request):
+        return None
+    return random.choice(replicas)
+
+
+def pins_client(request, response):
+    return request.method not in SAFE_METHODS and response.status_code < 400 and bool(get_replicas())
+
+
+def set_pin_cookie(response):
+    response.set_cookie(PIN_COOKIE, '1', max_age=get_pin_seconds(), httponly=True, samesite='Lax')
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Picks the database the request reads from, and pins clients after they write.
+
+    Sync and async both, so under ASGI it doesn't push the async views
+    (culinary_connect/async_views.py) back onto a thread. The database chosen is
+    in a context variable, which the sync parts of an async request inherit.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _replica.set(choose_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica.reset(token)
+        if pins_client(request, response):
+            pin(request_credentials(request))
+            set_pin_cookie(response)
+        return response
+
+    async def __acall__(self, request):
+        token = _replica.set(await achoose_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _replica.reset(token)
+        if pins_client(request, response):
+            await apin(request_credentials(request))
+            set_pin_cookie(response)
+        return response
+
+
+class ReplicaRouter:
+    """Reads go wherever ReplicaRoutingMiddleware decided; writes always go to the primary."""
+
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        databases = {'default', *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -14,9 +14,13 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from users.views import CustomObtainAuthToken
+from monitoring.views import metrics_view
+from recipes.media import serve_media
 from django.conf import settings
 from django.conf.urls.static import static
 
@@ -36,12 +40,20 @@ urlpatterns = [
     # User-related URLs. Again, we're keeping things tidy by putting these in their own file.
     # It's where all the user profile magic happens!
     path('api/users/', include('users.urls')),
+
+    # The background job queue's status, for staff (see jobs/queue.py)
+    path('api/jobs/', include('jobs.urls')),
+
+    # Request metrics for Prometheus to scrape (see monitoring/middleware.py for what's measured)
+    path('metrics', metrics_view, name='metrics'),
 ]
 
-# This is a neat trick for serving media files during development.
-# It's like setting up a temporary art gallery for all our food photos.
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Our food photos, in development and production alike: only to those allowed to see
+# them, with ranges and long-lived caching (see recipes/media.py for MEDIA_SERVE).
+if settings.MEDIA_URL.startswith('/'):
+    urlpatterns += [
+        re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.+)$', serve_media, name='media'),
+    ]
 
 # Don't forget to add this line to serve static files as well!
 # It's like setting up the basic decor of our restaurant before the guests arrive.
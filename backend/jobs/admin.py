@@ -0,0 +1,42 @@
+from django.contrib import admin, messages
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """
+    Background jobs (jobs/queue.py): what's queued, what's running where, and the
+    tracebacks of the ones that failed, which can be queued again from here once
+    whatever broke them is fixed.
+    """
+    list_display = ('id', 'task', 'status', 'priority', 'attempts', 'max_attempts', 'run_at', 'worker', 'key', 'created_at')
+    list_filter = ('status', 'task')
+    search_fields = ('task', 'key')
+    readonly_fields = [field.name for field in Job._meta.fields]
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.action(description="Queue the selected failed jobs again", permissions=['view'])
+    def retry(self, request, queryset):
+        retried = skipped = 0
+        for job in queryset.filter(status=Job.FAILED):
+            try:
+                with transaction.atomic():
+                    Job.objects.filter(pk=job.pk).update(
+                        status=Job.QUEUED, attempts=0, run_at=timezone.now(), finished_at=None,
+                    )
+                retried += 1
+            except IntegrityError:
+                # Another job with the same key is pending already, and does the same work
+                skipped += 1
+        self.message_user(request, f"Queued {retried} jobs again.", messages.SUCCESS)
+        if skipped:
+            self.message_user(request, f"Skipped {skipped} whose key another pending job has.", messages.WARNING)
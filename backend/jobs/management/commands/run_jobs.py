@@ -0,0 +1,76 @@
+import multiprocessing
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from jobs import queue
+
+
+def stop_on_signals():
+    """An event that SIGTERM and SIGINT (Ctrl-C) set."""
+    # A threading.Event: a multiprocessing one can't be set from a signal handler
+    # while the same thread is waiting on it
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stopping.set())
+    return stopping
+
+
+def work():
+    """One worker process, running jobs until it's told to stop."""
+    queue.Worker(stopping=stop_on_signals()).run()
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the queued background jobs (jobs/queue.py) in --processes worker processes "
+        "(default JOBS_WORKER_PROCESSES), until stopped with SIGTERM or Ctrl-C; a job that's "
+        "running then is finished first. --burst runs the jobs that are due and exits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, help="Worker processes to run (default: JOBS_WORKER_PROCESSES).")
+        parser.add_argument('--burst', action='store_true', help="Run the jobs that are due in this process, then exit.")
+
+    def handle(self, *args, **options):
+        if options['burst']:
+            self.stdout.write(f"Ran {queue.run_pending()} jobs.")
+            return
+        processes = options['processes'] or getattr(settings, 'JOBS_WORKER_PROCESSES', 2)
+        if processes < 1:
+            raise CommandError("--processes must be at least 1.")
+        self.stdout.write(f"Running jobs in {processes} worker processes.")
+        if processes == 1:
+            work()
+        else:
+            self.supervise(processes)
+        self.stdout.write("Stopped.")
+
+    def supervise(self, processes):
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            raise CommandError("Several worker processes need fork(); run with --processes 1 here.")
+        stopping = stop_on_signals()
+        children = {}
+        while not stopping.is_set():
+            for index in range(processes):
+                child = children.get(index)
+                if child is not None and child.is_alive():
+                    continue
+                if child is not None:
+                    self.stderr.write(f"Worker {index} exited with {child.exitcode}, starting another.")
+                # A forked child must not share the parent's database connections
+                connections.close_all()
+                children[index] = context.Process(target=work, name=f'run_jobs-{index}')
+                children[index].start()
+            stopping.wait(1)
+        # Each worker finishes the job it's running, then exits
+        for child in children.values():
+            if child.is_alive():
+                child.terminate()
+        for child in children.values():
+            child.join()
@@ -0,0 +1,52 @@
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+
+# One piece of side work for the job workers (jobs/queue.py): which task to run, with
+# what, and how it's gone so far. Rows are written in the transaction of whatever asked
+# for the work, so a job exists if and only if the change that needed it was committed.
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    PENDING = (QUEUED, RUNNING)
+
+    task = models.CharField(max_length=200, help_text="Dotted name of the task function")
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    # Higher goes first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    key = models.CharField(
+        max_length=255, null=True, blank=True,
+        help_text="Idempotency key: while a job with this key is pending, queueing it again does nothing"
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now, help_text="Not before this")
+    worker = models.CharField(max_length=100, blank=True, help_text="The worker running it, or that ran it last")
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=Q(status__in=['queued', 'running']), name='unique_pending_job_key'),
+        ]
+        indexes = [
+            # What the workers ask for: the queued jobs, most urgent first
+            models.Index(fields=['status', '-priority', 'run_at'], name='job_pick_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
@@ -0,0 +1,258 @@
+"""
+A job queue in the database, for the side work a request shouldn't have to wait for.
+
+Deleting files from storage, resizing photos, revoking tokens: none of it has to be
+done before the response goes out, and some of it is slow. So views queue a job
+instead - a Job row, written in the same transaction as the change that needs it, so
+the work is done if and only if the change was committed - and ``manage.py run_jobs``
+does it, in JOBS_WORKER_PROCESSES processes. There's no broker to run: the queue is
+the database the app already has.
+
+Tasks are plain functions decorated with ``@task``, and ``some_task.enqueue(*args,
+**kwargs)`` queues a call of one (the arguments have to be JSON). Three keyword
+arguments are the job's rather than the task's:
+
+* ``key``: an idempotency key. While a job with the same key is queued or running,
+  queueing another does nothing, so a retried request or a burst of edits makes one job.
+* ``priority``: higher goes first (the task's own priority if not given, 0 by default).
+* ``delay``: seconds to wait before running it.
+
+A job that raises is tried again later: JOBS_RETRY_BASE_SECONDS after the first
+failure, twice as long after each one after that (at most JOBS_RETRY_MAX_SECONDS, plus
+a little jitter so jobs that failed together don't come back together), until it has
+been tried ``max_attempts`` times (JOBS_MAX_ATTEMPTS) and is marked failed, traceback
+and all, for somebody to look at in the admin. A job whose worker died is run again
+once it has been running for JOBS_TIMEOUT_SECONDS. So a job can run more than once,
+and tasks have to be safe to repeat.
+
+A worker claims a job by switching it from queued to running with a conditional
+UPDATE, so no two workers ever run the same one. On PostgreSQL they also skip the rows
+other workers are busy claiming (SKIP LOCKED) instead of waiting for them.
+"""
+import functools
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# How many of the queued jobs a worker tries, when it has no row locks to go by
+CLAIM_BATCH = 10
+# How often an idle worker looks for stale and old jobs
+HOUSEKEEPING_SECONDS = 60
+
+_registry = {}
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Task:
+    """A function the workers can run. Calling it runs it right here."""
+
+    def __init__(self, func, name, priority, max_attempts):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, *args, key=None, priority=None, delay=None, **kwargs):
+        """Queue a call of this task, in the current transaction."""
+        job = Job(
+            task=self.name, args=list(args), kwargs=kwargs, key=key,
+            priority=self.priority if priority is None else priority,
+            max_attempts=self.max_attempts or get_setting('JOBS_MAX_ATTEMPTS', 5),
+            run_at=timezone.now() + timedelta(seconds=delay or 0),
+        )
+        # The unique index on the keys of pending jobs turns a duplicate into a no-op
+        Job.objects.bulk_create([job], ignore_conflicts=key is not None)
+
+
+def task(func=None, *, priority=0, max_attempts=None):
+    """Register a function as a task: ``@task``, or ``@task(priority=10, max_attempts=3)``."""
+    def register(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        _registry[name] = Task(func, name, priority, max_attempts)
+        return _registry[name]
+    return register(func) if func is not None else register
+
+
+def get_task(name):
+    if name not in _registry:
+        # Tasks register as their module is imported, which a worker may not have done yet
+        try:
+            import_module(name.rpartition('.')[0])
+        except ImportError:
+            pass
+    return _registry.get(name)
+
+
+def backoff(attempts):
+    """Seconds to wait before trying again, after ``attempts`` failed tries."""
+    base = get_setting('JOBS_RETRY_BASE_SECONDS', 10)
+    delay = min(get_setting('JOBS_RETRY_MAX_SECONDS', 3600), base * 2 ** (attempts - 1))
+    return delay * random.uniform(1, 1.25)
+
+
+# --- Running ---------------------------------------------------------------------------
+
+def claim(worker):
+    """Take the most urgent job that's due, for ``worker``. None if there isn't one."""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('-priority', 'run_at', 'pk')
+    take = {'status': Job.RUNNING, 'worker': worker, 'locked_at': now, 'attempts': F('attempts') + 1}
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pk = due.select_for_update(skip_locked=True).values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            Job.objects.filter(pk=pk).update(**take)
+    else:
+        # No row locks (SQLite): whoever switches a job to running first has it, and the
+        # others try the next one down
+        for pk in due.values_list('pk', flat=True)[:CLAIM_BATCH]:
+            if Job.objects.filter(pk=pk, status=Job.QUEUED).update(**take):
+                break
+        else:
+            return None
+    return Job.objects.get(pk=pk)
+
+
+def run(job):
+    """Run a claimed job and write down how it went. Returns whether it succeeded."""
+    task = get_task(job.task)
+    # If the job was given up on as stale and claimed again meanwhile, it's not ours to update
+    mine = Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker)
+    try:
+        if task is None:
+            raise LookupError(f"No task called {job.task!r}")
+        task.func(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if task is None or job.attempts >= job.max_attempts:
+            logger.error("Job %s (%s) failed, attempt %d of %d: giving up", job.pk, job.task, job.attempts, job.max_attempts)
+            mine.update(status=Job.FAILED, last_error=error, finished_at=timezone.now())
+        else:
+            logger.warning("Job %s (%s) failed, attempt %d of %d", job.pk, job.task, job.attempts, job.max_attempts)
+            mine.update(
+                status=Job.QUEUED, last_error=error,
+                run_at=timezone.now() + timedelta(seconds=backoff(job.attempts)),
+            )
+        return False
+    mine.update(status=Job.DONE, finished_at=timezone.now())
+    return True
+
+
+def requeue_stale(now=None):
+    """Jobs that have been running for JOBS_TIMEOUT_SECONDS lost their worker: queue them again."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=get_setting('JOBS_TIMEOUT_SECONDS', 600))
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=cutoff)
+    error = f"Timed out: still running after {get_setting('JOBS_TIMEOUT_SECONDS', 600)}s"
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(status=Job.FAILED, last_error=error, finished_at=now)
+    requeued = stale.update(status=Job.QUEUED, last_error=error, run_at=now)
+    if failed or requeued:
+        logger.warning("%d stale jobs queued again, %d given up on", requeued, failed)
+    return requeued + failed
+
+
+def prune(now=None):
+    """Forget the jobs that finished more than JOBS_KEEP_SECONDS ago. Failed ones stay."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=get_setting('JOBS_KEEP_SECONDS', 7 * 24 * 3600))
+    deleted, _ = Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def worker_name(suffix=''):
+    return f'{socket.gethostname()}:{os.getpid()}{suffix}'
+
+
+class Worker:
+    """Claims and runs jobs one at a time until ``stopping`` is set."""
+
+    def __init__(self, name=None, stopping=None, poll=None):
+        self.name = name or worker_name()
+        self.stopping = stopping or threading.Event()
+        self.poll = get_setting('JOBS_POLL_SECONDS', 1) if poll is None else poll
+        self.housekept_at = None
+
+    def run(self, burst=False):
+        """
+        Run jobs until stopped, or with ``burst`` until none are due. Returns how many ran.
+        A job that's running when the worker is stopped is finished first.
+        """
+        ran = 0
+        while not self.stopping.is_set():
+            try:
+                job = claim(self.name)
+                if job is not None:
+                    run(job)
+                    ran += 1
+                elif not burst:
+                    self.housekeeping()
+            except Exception:
+                # Most likely the database going away; the job (if any) is picked up
+                # again when it's found stale
+                logger.exception("Job worker %s failed", self.name)
+                job = None
+            if burst:
+                if job is None:
+                    break
+                continue
+            # Connections go stale between jobs, like they would between requests
+            close_old_connections()
+            if job is None:
+                self.stopping.wait(self.poll)
+        return ran
+
+    def housekeeping(self):
+        now = timezone.now()
+        if self.housekept_at is None or (now - self.housekept_at).total_seconds() >= HOUSEKEEPING_SECONDS:
+            self.housekept_at = now
+            requeue_stale(now)
+            prune(now)
+
+
+def run_pending():
+    """Run every job that's due, here and now (the tests and the benchmark use this)."""
+    return Worker(name=worker_name(':inline')).run(burst=True)
+
+
+# --- Status ----------------------------------------------------------------------------
+
+def status():
+    """How many jobs there are of each status and task, and how late the queue is running."""
+    counts = dict.fromkeys(dict(Job.STATUS_CHOICES), 0)
+    tasks = {}
+    rows = Job.objects.order_by().values_list('task', 'status').annotate(count=Count('pk'))
+    for task_name, job_status, count in rows:
+        counts[job_status] += count
+        tasks.setdefault(task_name, dict.fromkeys(dict(Job.STATUS_CHOICES), 0))[job_status] = count
+    oldest = Job.objects.filter(status=Job.QUEUED, run_at__lte=timezone.now()).aggregate(
+        oldest=Min('run_at'), retrying=Count('pk', filter=Q(attempts__gt=0)),
+    )
+    return {
+        'counts': counts,
+        'tasks': tasks,
+        # How long the job that has waited longest has been due: the workers' backlog
+        'lag_seconds': (timezone.now() - oldest['oldest']).total_seconds() if oldest['oldest'] else 0.0,
+        'retrying': oldest['retrying'],
+    }
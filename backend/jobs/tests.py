@@ -0,0 +1,155 @@
+import io
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import queue
+from .models import Job
+
+User = get_user_model()
+
+ran = []
+
+
+@queue.task
+def remember(value):
+    ran.append(value)
+
+
+@queue.task(priority=5)
+def remember_first(value):
+    ran.append(value)
+
+
+@queue.task(max_attempts=2)
+def explode():
+    raise RuntimeError("Out of eggs")
+
+
+@override_settings(JOBS_RETRY_BASE_SECONDS=10, JOBS_TIMEOUT_SECONDS=600)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        ran.clear()
+
+    def test_jobs_run_most_urgent_first(self):
+        remember.enqueue('later', delay=60)
+        remember.enqueue('second')
+        remember_first.enqueue('first')
+        remember.enqueue('urgent', priority=10)
+        self.assertEqual(queue.run_pending(), 3)
+        self.assertEqual(ran, ['urgent', 'first', 'second'])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 3)
+        self.assertEqual(Job.objects.get(status=Job.QUEUED).args, ['later'])
+        # Calling a task runs it right away
+        remember('now')
+        self.assertEqual(ran[-1], 'now')
+
+    def test_a_pending_key_is_queued_once(self):
+        for value in ('one', 'two'):
+            with self.assertNumQueries(1):
+                remember.enqueue(value, key='tidy-up')
+        queue.run_pending()
+        self.assertEqual(ran, ['one'])
+        # Once it has run, the same key queues a new job
+        remember.enqueue('three', key='tidy-up')
+        queue.run_pending()
+        self.assertEqual(ran, ['one', 'three'])
+
+    def test_failures_are_retried_with_backoff_then_given_up_on(self):
+        explode.enqueue()
+        started = timezone.now()
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            self.assertEqual(queue.run_pending(), 1)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn("Out of eggs", job.last_error)
+        self.assertGreaterEqual(job.run_at, started + timedelta(seconds=10))
+        self.assertLess(job.run_at, started + timedelta(seconds=15))
+
+        # Not due yet
+        self.assertEqual(queue.run_pending(), 0)
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            queue.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_backoff_doubles_up_to_the_limit(self):
+        with override_settings(JOBS_RETRY_MAX_SECONDS=60):
+            delays = [queue.backoff(attempts) for attempts in (1, 2, 3, 4, 5)]
+        for delay, expected in zip(delays, (10, 20, 40, 60, 60)):
+            self.assertTrue(expected <= delay <= expected * 1.25, (delay, expected))
+
+    def test_unknown_tasks_fail_right_away(self):
+        Job.objects.create(task='jobs.tests.no_such_task')
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            queue.run_pending()
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+        self.assertIn("No task called", job.last_error)
+
+    def test_jobs_of_dead_workers_are_run_again(self):
+        remember.enqueue('orphan')
+        job = queue.claim('gone:1')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(seconds=601))
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            self.assertEqual(queue.requeue_stale(), 1)
+        queue.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 2))
+        # The dead worker coming back can't overwrite what the new one wrote down
+        queue.run(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+
+    @override_settings(JOBS_KEEP_SECONDS=60)
+    def test_old_finished_jobs_are_pruned(self):
+        remember.enqueue('old')
+        explode.enqueue(delay=3600)
+        queue.run_pending()
+        Job.objects.filter(status=Job.DONE).update(finished_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(queue.prune(), 1)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_burst_command(self):
+        remember.enqueue('from the command')
+        out = io.StringIO()
+        call_command('run_jobs', '--burst', stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Ran 1 jobs.")
+        self.assertEqual(ran, ['from the command'])
+
+
+class JobStatusTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_staff_see_the_queue(self):
+        remember.enqueue('waiting')
+        explode.enqueue()
+        Job.objects.filter(task=explode.name).update(status=Job.FAILED)
+        url = reverse('job-status')
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+        self.client.force_authenticate(User.objects.create_user(username='ops', password='secret-pass-123', is_staff=True))
+        data = self.client.get(url).data
+        self.assertEqual(data['counts'], {'queued': 1, 'running': 0, 'done': 0, 'failed': 1})
+        self.assertEqual(data['tasks'][explode.name]['failed'], 1)
+        self.assertGreaterEqual(data['lag_seconds'], 0)
+
+    def test_admin_retries_failed_jobs(self):
+        admin = User.objects.create_user(username='boss', password='secret-pass-123', is_staff=True, is_superuser=True)
+        explode.enqueue(key='boom')
+        Job.objects.update(status=Job.FAILED, attempts=2)
+        self.client.force_login(admin)
+        self.assertEqual(self.client.get(reverse('admin:jobs_job_changelist')).status_code, 200)
+        self.client.post(reverse('admin:jobs_job_changelist'), {
+            'action': 'retry', '_selected_action': list(Job.objects.values_list('pk', flat=True)),
+        })
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 0))
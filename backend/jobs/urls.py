@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .views import JobStatusView
+
+urlpatterns = [
+    # Queue health for staff: job counts and how late the workers are running
+    path('status/', JobStatusView.as_view(), name='job-status'),
+]
@@ -0,0 +1,14 @@
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import queue
+
+
+# How the background jobs are doing, for staff and for whatever watches the workers:
+# counts by status and task, and how far behind the queue is (see jobs/queue.py).
+class JobStatusView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(queue.status())
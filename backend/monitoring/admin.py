@@ -0,0 +1,43 @@
+from django.contrib import admin
+from django.http import FileResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+
+from .models import RequestProfile
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """
+    Profiled requests (monitoring/profiling.py). Staff can read the top functions here
+    and download the whole profile: collapsed stacks for flamegraph.pl or speedscope,
+    or a pstats file.
+    """
+    list_display = ('created_at', 'method', 'path', 'view', 'status_code', 'duration_ms', 'mode', 'trigger', 'user', 'download')
+    list_filter = ('mode', 'trigger', 'view')
+    search_fields = ('path', 'view')
+    readonly_fields = [field.name for field in RequestProfile._meta.fields] + ['download']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Profile')
+    def download(self, obj):
+        url = reverse('admin:monitoring_requestprofile_download', args=[obj.pk])
+        return format_html('<a href="{}">Download</a>', url)
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view),
+                 name='monitoring_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download_view(self, request, pk):
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        if not self.has_view_permission(request, profile):
+            return self.admin_site.login(request)
+        return FileResponse(profile.file.open('rb'), as_attachment=True, filename=profile.file.name.rsplit('/', 1)[-1])
@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+class MonitoringConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'monitoring'
+
+    def ready(self):
+        # Every connection, on every alias and in every thread, reports its queries
+        from .instrumentation import install_query_timer
+        connection_created.connect(install_query_timer, dispatch_uid='monitoring.install_query_timer')
@@ -0,0 +1,112 @@
+"""
+What a request costs: wall time, time in the database, how many queries it ran and
+how many of those repeated one it had already run, time spent serializing and
+rendering the response, and how big the response was.
+
+``RequestMetricsMiddleware`` (monitoring/middleware.py) starts a ``RequestStats``
+for each sampled request and keeps it in a context variable; the query wrapper,
+which is installed on every database connection as it's opened (see apps.py),
+and ``timed()`` add to whichever one is current. Outside a sampled request they
+cost a context variable lookup.
+"""
+import contextvars
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from rest_framework import serializers
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.timings = Counter()
+
+    @property
+    def duplicate_queries(self):
+        """Queries that ran the same SQL with the same parameters as an earlier one."""
+        return sum(count - 1 for count in self.statements.values())
+
+    def repeated_sql(self, threshold):
+        """SQL run ``threshold`` times or more, whatever the parameters (an N+1 looks like this)."""
+        shapes = Counter()
+        for (alias, sql, params), count in self.statements.items():
+            shapes[sql] += count
+        return [(sql, count) for sql, count in shapes.most_common() if count >= threshold]
+
+
+def current():
+    """The stats of the request being handled, if it's being measured."""
+    return _current.get()
+
+
+def start():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def _params_key(params):
+    try:
+        hash(params)
+        return params
+    except TypeError:
+        return repr(params)
+
+
+def query_timer(alias):
+    """An execute wrapper (see connection.execute_wrapper) for the connection ``alias``."""
+    def wrapper(execute, sql, params, many, context):
+        stats = _current.get()
+        if stats is None:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stats.db_time += time.perf_counter() - started
+            stats.queries += 1
+            stats.statements[alias, sql, _params_key(params)] += 1
+    return wrapper
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """connection_created receiver: time the queries of every new connection."""
+    connection.execute_wrappers.append(query_timer(connection.alias))
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's ``name`` timing."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.timings[name] += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """
+    Counts the time a serializer spends producing ``.data`` as the request's
+    'serialize' timing. For many=True too, with TimedListSerializer as the Meta's
+    list_serializer_class.
+    """
+    @property
+    def data(self):
+        with timed('serialize'):
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
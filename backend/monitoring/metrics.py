@@ -0,0 +1,127 @@
+"""
+A small metrics registry, exported in Prometheus' text format.
+
+Just counters and histograms with labels, kept in this process. Every worker
+process has its own numbers: scrape each one (they're told apart by the
+``instance`` label Prometheus adds), or sum them up in the query.
+"""
+import math
+import threading
+
+_lock = threading.Lock()
+_metrics = {}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def clear(self):
+        with _lock:
+            self.values.clear()
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with _lock:
+            items = sorted(self.values.items())
+            lines.extend(line for key, value in items for line in self.sample_lines(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    def sample_lines(self, key, value):
+        yield f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with _lock:
+            counts, total = self.values.get(key) or ([0] * len(self.buckets), 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def get(self, **labels):
+        """(observations, sum) for these labels."""
+        counts, total = self.values.get(self.key(labels)) or ((), 0)
+        return sum(counts), total
+
+    def sample_lines(self, key, value):
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            yield f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', _format_value(bound))])} {cumulative}"
+        yield f'{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}'
+        yield f'{self.name}_count{_format_labels(self.label_names, key)} {cumulative}'
+
+
+def register(metric):
+    """Add a metric to the registry (or get the one already there under its name)."""
+    with _lock:
+        return _metrics.setdefault(metric.name, metric)
+
+
+def counter(name, documentation, labels=()):
+    return register(Counter(name, documentation, labels))
+
+
+def histogram(name, documentation, labels=(), buckets=()):
+    return register(Histogram(name, documentation, labels, buckets))
+
+
+def clear():
+    """Reset every metric (for tests)."""
+    for metric in list(_metrics.values()):
+        metric.clear()
+
+
+def exposition():
+    """Everything in the registry, in Prometheus' text format (version 0.0.4)."""
+    with _lock:
+        metrics = sorted(_metrics.values(), key=lambda metric: metric.name)
+    return '\n'.join(line for metric in metrics for line in metric.expose()) + '\n'
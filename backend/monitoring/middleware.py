@@ -0,0 +1,166 @@
+import json
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import instrumentation, metrics
+
+logger = logging.getLogger('monitoring.requests')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+# Every request
+requests_total = metrics.counter(
+    'http_requests_total', 'Requests handled, by view, method and status code.', ('view', 'method', 'status'))
+request_duration = metrics.histogram(
+    'http_request_duration_seconds', 'Time to produce the response.', ('view', 'method'), DURATION_BUCKETS)
+response_size = metrics.histogram(
+    'http_response_size_bytes', 'Size of the response body (streamed responses left out).', ('view',), SIZE_BUCKETS)
+
+# Sampled requests only (MONITORING_SAMPLE_RATE)
+sampled_total = metrics.counter(
+    'http_requests_sampled_total', 'Requests measured in detail, by view.', ('view',))
+db_duration = metrics.histogram(
+    'http_request_db_seconds', 'Time spent in database queries per request.', ('view',), DURATION_BUCKETS)
+query_count = metrics.histogram(
+    'http_request_queries', 'Database queries per request.', ('view',), QUERY_BUCKETS)
+duplicate_queries = metrics.counter(
+    'http_request_duplicate_queries_total', 'Queries repeating an earlier query of the same request exactly.', ('view',))
+phase_duration = metrics.histogram(
+    'http_request_phase_seconds', 'Time spent serializing and rendering responses.', ('view', 'phase'), DURATION_BUCKETS)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.url_name or 'unnamed'
+
+
+def body_size(response):
+    if response.streaming:
+        return None
+    return len(response.content)
+
+
+class RequestMetricsMiddleware:
+    """
+    Measures requests (see monitoring/instrumentation.py), tagged by URL name.
+
+    Every request is counted and timed. A sample of them, MONITORING_SAMPLE_RATE
+    (0 to 1), is also measured in detail - database time and queries, serializing and
+    rendering - and those get a Server-Timing header (MONITORING_SERVER_TIMING) and
+    a structured log line on the 'monitoring.requests' logger: at WARNING when it
+    was slower than MONITORING_SLOW_REQUEST_MS or ran one SQL statement
+    MONITORING_REPEATED_QUERY_THRESHOLD times or more, at INFO otherwise. All of it
+    adds up in the metrics served at /metrics (monitoring/views.py).
+
+    Sync and async both: it comes first, so a sync-only middleware here would turn
+    every request under ASGI into a sync one. The stats live in a context variable,
+    which the queries an async view runs through sync_to_async still see.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not get_setting('MONITORING_ENABLED', True):
+            return self.get_response(request)
+
+        stats, token = self.start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started
+            if token is not None:
+                instrumentation.stop(token)
+        return self.finish(request, response, elapsed, stats)
+
+    async def __acall__(self, request):
+        if not get_setting('MONITORING_ENABLED', True):
+            return await self.get_response(request)
+
+        stats, token = self.start()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started
+            if token is not None:
+                instrumentation.stop(token)
+        return self.finish(request, response, elapsed, stats)
+
+    def start(self):
+        if random.random() < get_setting('MONITORING_SAMPLE_RATE', 1.0):
+            return instrumentation.start()
+        return None, None
+
+    def finish(self, request, response, elapsed, stats):
+        view = view_name(request)
+        method = request.method if request.method in METHODS else 'other'
+        size = body_size(response)
+        requests_total.inc(view=view, method=method, status=response.status_code)
+        request_duration.observe(elapsed, view=view, method=method)
+        if size is not None:
+            response_size.observe(size, view=view)
+        if stats is not None:
+            self.record(request, response, view, elapsed, size, stats)
+        return response
+
+    def record(self, request, response, view, elapsed, size, stats):
+        sampled_total.inc(view=view)
+        db_duration.observe(stats.db_time, view=view)
+        query_count.observe(stats.queries, view=view)
+        if stats.duplicate_queries:
+            duplicate_queries.inc(stats.duplicate_queries, view=view)
+        for phase, seconds in stats.timings.items():
+            phase_duration.observe(seconds, view=view, phase=phase)
+
+        if get_setting('MONITORING_SERVER_TIMING', True):
+            response['Server-Timing'] = self.server_timing(elapsed, stats)
+
+        repeated = stats.repeated_sql(get_setting('MONITORING_REPEATED_QUERY_THRESHOLD', 5))
+        slow = elapsed * 1000 >= get_setting('MONITORING_SLOW_REQUEST_MS', 500)
+        level = logging.WARNING if slow or repeated else logging.INFO
+        if logger.isEnabledFor(level):
+            entry = {
+                'view': view,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 2),
+                'db_ms': round(stats.db_time * 1000, 2),
+                'queries': stats.queries,
+                'duplicate_queries': stats.duplicate_queries,
+                **{f'{phase}_ms': round(seconds * 1000, 2) for phase, seconds in stats.timings.items()},
+                'response_bytes': size,
+            }
+            if repeated:
+                entry['repeated_sql'] = [{'sql': sql, 'count': count} for sql, count in repeated[:3]]
+            logger.log(level, json.dumps(entry), extra={'request_metrics': entry})
+
+    def server_timing(self, elapsed, stats):
+        description = f'{stats.queries} queries'
+        if stats.duplicate_queries:
+            description += f', {stats.duplicate_queries} duplicate'
+        entries = [f'db;dur={stats.db_time * 1000:.2f};desc="{description}"']
+        entries.extend(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in stats.timings.items())
+        entries.append(f'total;dur={elapsed * 1000:.2f}')
+        return ', '.join(entries)
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.utils.functional import cached_property
+
+
+class ProfileStorage(FileSystemStorage):
+    """
+    Files under PROFILING_ROOT. Not MEDIA_ROOT: profiles show code paths and timings,
+    and are only for staff (see admin.py). The setting is read when the storage is
+    first used, and again whenever it changes (override_settings), rather than once
+    when the model class is built.
+    """
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location, getattr(settings, 'PROFILING_ROOT', settings.BASE_DIR / 'profiles'))
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'PROFILING_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+
+
+_storage = ProfileStorage()
+
+
+def profile_storage():
+    return _storage
+
+
+# One profiled request (monitoring/profiling.py): what it was, how long it took, the
+# functions it spent its time in, and the whole profile as a file to download.
+class RequestProfile(models.Model):
+    MODE_CHOICES = [
+        ('sample', 'Stack samples (collapsed stacks)'),
+        ('cprofile', 'cProfile (pstats)'),
+    ]
+    TRIGGER_CHOICES = [
+        ('requested', 'Requested'),
+        ('sampled', 'Sampled'),
+    ]
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=2000)
+    view = models.CharField(max_length=200, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES)
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    summary = models.TextField(blank=True, help_text="The functions the request spent the most time in")
+    file = models.FileField(upload_to='%Y/%m/%d/', storage=profile_storage)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+    @classmethod
+    def record(cls, request, response, mode, trigger, user, duration, summary, content):
+        """Save a profile, and forget the oldest beyond PROFILING_MAX_PROFILES."""
+        match = getattr(request, 'resolver_match', None)
+        profile = cls(
+            method=request.method, path=request.get_full_path()[:2000], view=(match.view_name if match else '') or '',
+            status_code=response.status_code, duration_ms=duration * 1000, mode=mode, trigger=trigger,
+            user=user, summary=summary,
+        )
+        profile.file.save(content.name, content, save=False)
+        profile.save()
+        keep = getattr(settings, 'PROFILING_MAX_PROFILES', 200)
+        for old in cls.objects.order_by('-created_at', '-pk')[keep:]:
+            old.delete()
+        return profile
+
+    def delete(self, *args, **kwargs):
+        self.file.delete(save=False)
+        return super().delete(*args, **kwargs)
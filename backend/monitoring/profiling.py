@@ -0,0 +1,173 @@
+"""
+Profiling single requests in production.
+
+A staff member adds ``X-Profile: 1`` (or ``?profile=1``) to a request that's slow;
+PROFILING_SAMPLE_RATE profiles a share of everybody's requests on top of that (0
+by default). The profile covers everything below ProfilingMiddleware - the view,
+its filter backends, the serializer and the renderer - and is saved as a
+RequestProfile, listed in the admin with its top functions and a download link.
+The response says which one in its X-Profile-Id header.
+
+Two kinds of profile:
+
+* ``sample`` (the default): a background thread looks at the request's stack
+  every PROFILING_INTERVAL_MS and counts what it sees. Cheap enough for
+  production, and saved as collapsed stacks ("a;b;c 12" lines), which
+  flamegraph.pl and speedscope turn into a flame graph. Python only hands the
+  thread its turn every few milliseconds (sys.getswitchinterval()), so short
+  requests get few samples.
+* ``cprofile`` (``X-Profile: cprofile``): every function call, timed by cProfile,
+  and saved in pstats format (``python -m pstats``, snakeviz). Slows the request
+  down noticeably while it runs.
+
+Both follow the one thread that handles the request, and an async request under
+ASGI hops between the event loop and sync_to_async's threads, so requests served
+over ASGI aren't profiled at all: profile them under WSGI (runserver) instead.
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from users.authentication import request_user
+from .models import RequestProfile
+
+HEADER = 'X-Profile'
+PARAM = 'profile'
+MODES = ('sample', 'cprofile')
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def frame_label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """Counts the stacks a thread is seen in, below the frame running ``root``."""
+
+    def __init__(self, thread_id, root, interval):
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not self.root:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit=20):
+        """Where the samples ended up: the innermost function of each, with its share."""
+        total = sum(self.stacks.values())
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return '\n'.join(
+            f'{count / total:6.1%}  {count:>6}  {function}' for function, count in leaves.most_common(limit)
+        )
+
+
+def cprofile_summary(profiler, limit=20):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+def requested_mode(request):
+    """The mode a request asks to be profiled in, or None."""
+    value = request.headers.get(HEADER) or request.GET.get(PARAM)
+    if not value or value.lower() in ('0', 'false', 'off'):
+        return None
+    return value.lower() if value.lower() in MODES else 'sample'
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests that ask for it (staff only), and a sample of the rest.
+
+    Async-capable so it doesn't put a sync hop in front of the async views, which it
+    passes straight through (see above).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        if not get_setting('PROFILING_ENABLED', True):
+            return self.get_response(request)
+        mode, trigger, user = requested_mode(request), None, None
+        if mode is not None:
+            user = request_user(request)
+            trigger = 'requested' if user is not None and user.is_staff else None
+        if trigger is None and random.random() < get_setting('PROFILING_SAMPLE_RATE', 0):
+            mode, trigger = 'sample', 'sampled'
+        if trigger is None:
+            return self.get_response(request)
+        return self.profile(request, mode, trigger, user if trigger == 'requested' else None)
+
+    def profile(self, request, mode, trigger, user):
+        started = time.perf_counter()
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            response = profiler.runcall(self.get_response, request)
+            elapsed = time.perf_counter() - started
+            profiler.create_stats()
+            content, summary, extension = self.dump_stats(profiler), cprofile_summary(profiler), 'prof'
+        else:
+            sampler = StackSampler(
+                threading.get_ident(), sys._getframe().f_code, get_setting('PROFILING_INTERVAL_MS', 5) / 1000
+            )
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                elapsed = time.perf_counter() - started
+                sampler.stop()
+            content, summary, extension = sampler.collapsed().encode(), sampler.top_functions(), 'folded'
+
+        profile = RequestProfile.record(
+            request, response, mode=mode, trigger=trigger, user=user, duration=elapsed, summary=summary,
+            content=ContentFile(content, name=f'{time.strftime("%Y%m%d-%H%M%S")}.{extension}'),
+        )
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
+
+    def dump_stats(self, profiler):
+        # pstats' own format (a marshalled dict), as Stats.dump_stats() would write it
+        return marshal.dumps(profiler.stats)
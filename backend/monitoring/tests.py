@@ -0,0 +1,216 @@
+import json
+import marshal
+import os
+import shutil
+import tempfile
+import time
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIHandler
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import include, path, reverse
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Recipe
+from users import authentication
+from . import metrics
+from .middleware import db_duration, duplicate_queries, phase_duration, requests_total
+from .models import RequestProfile
+from .profiling import ProfilingMiddleware
+
+User = get_user_model()
+
+
+def repeat_queries(request):
+    # The classic N+1: the same lookup once per item
+    for _ in range(6):
+        list(Recipe.objects.filter(pk=1))
+    return HttpResponse('ok')
+
+
+def slow_view(request):
+    busy_until = time.perf_counter() + 0.05
+    while time.perf_counter() < busy_until:
+        pass
+    return HttpResponse('ok')
+
+
+urlpatterns = [
+    path('', include('culinary_connect.urls')),
+    path('repeat/', repeat_queries, name='repeat-queries'),
+    path('slow/', slow_view, name='slow'),
+]
+
+
+@override_settings(MONITORING_SAMPLE_RATE=1.0, MONITORING_SERVER_TIMING=True, RECIPE_RESPONSE_CACHE_ENABLED=False)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        metrics.clear()
+        for cache in caches.all():
+            cache.clear()
+        author = User.objects.create_user(username='chef', password='secret-pass-123')
+        for index in range(3):
+            Recipe.objects.create(
+                title=f'Recipe {index}', description='Tasty', ingredients='eggs', instructions='Cook',
+                preparation_time=5, cooking_time=10, servings=2, difficulty='easy', category='Dinner',
+                cuisine='Thai', author=author,
+            )
+
+    def test_sampled_request_is_measured(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn(f'desc="{len(queries)} queries"', timing)
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('render;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+        self.assertEqual(requests_total.get(view='recipe-list-create', method='GET', status=200), 1)
+        self.assertEqual(db_duration.get(view='recipe-list-create')[0], 1)
+        self.assertEqual(phase_duration.get(view='recipe-list-create', phase='serialize')[0], 1)
+
+    async def test_async_requests_are_measured(self):
+        response = await self.async_client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[0-9.]+;desc="[1-9][0-9]* queries"')
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        self.assertEqual(requests_total.get(view='recipe-list-create', method='GET', status=200), 1)
+
+    def test_middleware_chain_stays_async_under_asgi(self):
+        # Django logs (with DEBUG on) every middleware it has to wrap to fit the mode
+        with self.settings(DEBUG=True), self.assertNoLogs('django.request', 'DEBUG'):
+            handler = ASGIHandler()
+        # Each link is convert_exception_to_response(middleware), down to the view handler
+        link, middleware = handler._middleware_chain, []
+        while link is not None:
+            self.assertTrue(iscoroutinefunction(link), link)
+            wrapped = getattr(link, '__wrapped__', None)
+            link = getattr(wrapped, 'get_response', None)
+            if link is not None:
+                middleware.append(f'{type(wrapped).__module__}.{type(wrapped).__name__}')
+        self.assertEqual(middleware, settings.MIDDLEWARE)
+
+    @override_settings(ROOT_URLCONF=__name__)
+    def test_repeated_queries_are_flagged(self):
+        with self.assertLogs('monitoring.requests', 'WARNING') as logs:
+            response = self.client.get('/repeat/')
+        self.assertIn('desc="6 queries, 5 duplicate"', response['Server-Timing'])
+        self.assertEqual(duplicate_queries.get(view='repeat-queries'), 5)
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['view'], 'repeat-queries')
+        self.assertEqual(entry['repeated_sql'][0]['count'], 6)
+
+    @override_settings(MONITORING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_only_counted(self):
+        response = self.client.get('/api/recipes/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(requests_total.get(view='recipe-list-create', method='GET', status=200), 1)
+        self.assertEqual(db_duration.get(view='recipe-list-create'), (0, 0))
+
+    @override_settings(MONITORING_METRICS_TOKEN='scrape-me')
+    def test_metrics_endpoint(self):
+        self.client.get('/api/recipes/')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_requests_total{view="recipe-list-create",method="GET",status="200"} 1', body)
+        self.assertIn('http_request_queries_bucket{view="recipe-list-create",le="+Inf"} 1', body)
+
+    @override_settings(MONITORING_METRICS_TOKEN=None, DEBUG=True)
+    def test_metrics_are_for_staff_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(User.objects.create_user(username='ops', password='secret-pass-123', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class MetricsRegistryTests(TestCase):
+    def test_histogram_exposition(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', ('view',), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 3):
+            histogram.observe(value, view='a"b')
+        self.assertEqual(histogram.expose(), [
+            '# HELP test_seconds Test.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{view="a\\"b",le="0.1"} 1',
+            'test_seconds_bucket{view="a\\"b",le="1"} 3',
+            'test_seconds_bucket{view="a\\"b",le="+Inf"} 4',
+            'test_seconds_sum{view="a\\"b"} 4.05',
+            'test_seconds_count{view="a\\"b"} 4',
+        ])
+
+
+PROFILING_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(ROOT_URLCONF=__name__, PROFILING_ROOT=PROFILING_ROOT, PROFILING_SAMPLE_RATE=0, PROFILING_INTERVAL_MS=1)
+class ProfilingTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(PROFILING_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        authentication.clear()
+        self.staff = User.objects.create_user(username='ops', password='secret-pass-123', is_staff=True, is_superuser=True)
+        self.cook = User.objects.create_user(username='cook', password='secret-pass-123')
+
+    def test_staff_can_ask_for_a_sampled_profile(self):
+        token = Token.objects.create(user=self.staff)
+        response = self.client.get('/slow/', HTTP_X_PROFILE='1', HTTP_AUTHORIZATION=f'Token {token.key}')
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((profile.mode, profile.trigger, profile.view, profile.user), ('sample', 'requested', 'slow', self.staff))
+        stacks = profile.file.read().decode().splitlines()
+        self.assertTrue(stacks)
+        # Collapsed stacks, from the middleware down into the view
+        self.assertTrue(any('slow_view (tests.py:' in stack.rsplit(' ', 1)[0] for stack in stacks))
+        self.assertIn('slow_view', profile.summary)
+        self.assertTrue(profile.file.path.startswith(PROFILING_ROOT + os.sep), profile.file.path)
+
+    def test_cprofile_and_download(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/slow/?profile=cprofile')
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual(profile.mode, 'cprofile')
+        self.assertIn('slow_view', profile.summary)
+
+        response = self.client.get(reverse('admin:monitoring_requestprofile_download', args=[profile.pk]))
+        self.assertEqual(response.status_code, 200)
+        stats = marshal.loads(b''.join(response.streaming_content))
+        self.assertTrue(any(function[2] == 'slow_view' for function in stats))
+        self.assertEqual(self.client.get(reverse('admin:monitoring_requestprofile_changelist')).status_code, 200)
+
+    def test_only_staff_can_ask(self):
+        token = Token.objects.create(user=self.cook)
+        response = self.client.get('/slow/?profile=1', HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertNotIn('X-Profile-Id', response)
+        self.client.force_login(self.cook)
+        self.assertEqual(self.client.get(reverse('admin:monitoring_requestprofile_download', args=[1])).status_code, 302)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_MAX_PROFILES=2)
+    def test_sampling_keeps_the_newest(self):
+        for _ in range(3):
+            self.client.get('/slow/')
+        self.assertEqual(list(RequestProfile.objects.values_list('trigger', flat=True)), ['sampled', 'sampled'])
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_async_requests_pass_through(self):
+        async def view(request):
+            return HttpResponse('ok')
+        middleware = ProfilingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/slow/', HTTP_X_PROFILE='1'))
+        self.assertEqual(response.content, b'ok')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
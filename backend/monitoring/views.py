@@ -0,0 +1,31 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_safe
+
+from . import metrics
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def allowed(request):
+    """
+    Prometheus sends MONITORING_METRICS_TOKEN as a bearer token; staff can look in a
+    browser. Nobody else, DEBUG or not: the numbers give away every URL's traffic.
+    """
+    token = getattr(settings, 'MONITORING_METRICS_TOKEN', None)
+    if token:
+        sent = request.headers.get('Authorization', '')
+        if hmac.compare_digest(sent.encode(), f'Bearer {token}'.encode()):
+            return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_staff)
+
+
+@require_safe
+def metrics_view(request):
+    """The request metrics (monitoring/middleware.py) in Prometheus' text format."""
+    if not allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.exposition(), content_type=CONTENT_TYPE)
@@ -1,6 +1,6 @@
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
+from users.authentication import get_token_for_user
 
 class CustomAuthToken(ObtainAuthToken):
     """
@@ -18,7 +18,8 @@ class CustomAuthToken(ObtainAuthToken):
         user = serializer.validated_data['user']
         
         # Now, let's get you a VIP pass (token). If you already have one, we'll just reuse it
-        token, created = Token.objects.get_or_create(user=user)
+        # (and if we've seen it recently, we don't even have to look in the database)
+        token = get_token_for_user(user)
         
         # Here's your welcome package: your VIP pass (token), your unique identifier (user_id),
         # and a way to contact you (email)
@@ -0,0 +1,672 @@
+"""
+A reproducible benchmark for the REST API.
+
+``seed_dataset`` fills the database with a synthetic cookbook - users, recipes with
+realistic ingredient lists, and a handful of photos - generated from a fixed random
+seed, so two runs at the same scale see the same data. ``run_benchmark`` then drives
+a set of scenarios (the recipe list, search, filtering, facet counts, detail pages,
+the home feed, login, image upload) through one of three drivers:
+
+* ``client`` - Django's test client, in process. Sequential, and the only driver
+  that also counts the queries each request runs.
+* ``asgi``   - Django's ASGI handler called like an ASGI server would, with many
+  requests in flight at once. Run it with and without ``ASYNC_VIEWS`` set to see
+  what the async read views (culinary_connect/async_views.py) are worth.
+* ``wsgi``   - a real threaded HTTP server (wsgiref) on a local port, hit over
+  sockets by ``concurrency`` client threads. The server reports each request's
+  query count in a response header.
+
+``db_latency`` adds a delay to every query, for a database across the network rather
+than a file next to the code; that's where requests spend their time waiting, and
+where serving many of them at once pays off. Better still, measure the real thing:
+point DATABASE_URL at PostgreSQL (``docker compose up -d db``, see the README) and
+the same run goes through it, with whatever pooling is configured; ``database`` in
+the results says which it was.
+
+Results come out as a dict (p50/p95/p99 latency, throughput, queries per request
+for every scenario) that ``compare_results`` can check against an earlier run.
+
+``serializer_benchmark`` is a microbenchmark for the part of a list request that
+isn't I/O: what it costs per recipe to load it, serialize it and render it to JSON,
+with RecipeSerializer and JSONRenderer against RecipeRowSerializer and ORJSONRenderer.
+
+``similar_benchmark`` asks the similar-recipes index (recipes/similar.py) for the
+nearest neighbours of random recipes and checks them against an exact, unhashed
+TF-IDF cosine search: how long a query takes, and how many of the answers are
+ones the exact search would have given too.
+
+Everything is driven by ``python manage.py benchmark``.
+"""
+import asyncio
+import math
+import platform
+import random
+import subprocess
+import threading
+import time
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from io import BytesIO
+from socketserver import ThreadingMixIn
+from urllib.parse import urlencode
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.test import Client
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory
+
+from culinary_connect.renderers import ORJSONRenderer
+
+from . import facets, images, ingredients, response_cache, search, similar, timelines
+from .models import ImageBlob, Recipe
+from .serializers import RecipeRowSerializer, RecipeSerializer
+
+User = get_user_model()
+
+BENCH_PASSWORD = 'bench-password-123'
+QUERY_COUNT_HEADER = 'X-Bench-Queries'
+
+DISHES = ['soup', 'stew', 'curry', 'salad', 'pasta', 'risotto', 'pie', 'tacos', 'stir fry', 'bake',
+          'burger', 'noodles', 'omelette', 'casserole', 'flatbread', 'chowder', 'tart', 'skewers']
+STYLES = ['Spicy', 'Creamy', 'Smoky', 'Roasted', 'Lemony', 'Garlicky', 'Herby', 'Crispy',
+          'Slow-cooked', 'Quick', 'Rustic', 'Sticky', 'Charred', 'Golden']
+INGREDIENT_POOL = [
+    'chicken breast', 'beef chuck', 'pork shoulder', 'salmon', 'shrimp', 'tofu', 'chickpeas',
+    'lentils', 'rice', 'pasta', 'potatoes', 'onion', 'garlic', 'ginger', 'tomatoes', 'carrots',
+    'celery', 'spinach', 'mushrooms', 'bell pepper', 'zucchini', 'eggplant', 'lemon', 'lime',
+    'coconut milk', 'heavy cream', 'butter', 'olive oil', 'parmesan', 'cheddar', 'eggs', 'flour',
+    'cumin', 'paprika', 'basil', 'cilantro', 'thyme', 'soy sauce', 'honey', 'chili flakes',
+]
+UNITS = ['cup', 'cups', 'tbsp', 'tsp', 'g', 'oz', 'cloves', '']
+CATEGORIES = ['Dinner', 'Lunch', 'Breakfast', 'Dessert', 'Soup', 'Salad', 'Snack']
+CUISINES = ['Italian', 'Mexican', 'Indian', 'Thai', 'French', 'Japanese', 'American', 'Greek']
+DIFFICULTIES = ['easy', 'medium', 'hard']
+
+Dataset = namedtuple('Dataset', ['usernames', 'recipe_ids', 'public_recipe_ids', 'own_recipe_ids', 'token', 'terms'])
+RequestSpec = namedtuple('RequestSpec', ['method', 'path', 'data', 'authenticated'])
+Scenario = namedtuple('Scenario', ['name', 'build', 'share'])
+Sample = namedtuple('Sample', ['status', 'seconds', 'queries'])
+
+
+# --- Seeding -------------------------------------------------------------------------
+
+def _recipe(rng, author, index):
+    chosen = rng.sample(INGREDIENT_POOL, rng.randint(4, 10))
+    lines = [f"{rng.randint(1, 4)} {rng.choice(UNITS)} {name}".replace('  ', ' ') for name in chosen]
+    dish = rng.choice(DISHES)
+    return Recipe(
+        title=f"{rng.choice(STYLES)} {chosen[0]} {dish} #{index}",
+        description=f"A {rng.choice(STYLES).lower()} {dish} with {chosen[1]} and {chosen[2]}.",
+        ingredients=', '.join(lines),
+        instructions="Prep everything. Cook it through. Season and serve.",
+        preparation_time=rng.randint(5, 45),
+        cooking_time=rng.randint(10, 180),
+        servings=rng.randint(1, 8),
+        difficulty=rng.choice(DIFFICULTIES),
+        category=rng.choice(CATEGORIES),
+        cuisine=rng.choice(CUISINES),
+        is_public=rng.random() < 0.9,
+        author=author,
+    )
+
+
+def make_photo(rng, size=(640, 480), name='photo.jpg'):
+    color = tuple(rng.randint(0, 255) for _ in range(3))
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='JPEG', quality=85)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+def seed_dataset(users=20, recipes=1000, photos=10, seed=1, batch_size=500):
+    """
+    Create a synthetic dataset. Every user gets the same password (hashed once,
+    hashing is slow on purpose) and the first user gets an API token.
+    """
+    rng = random.Random(seed)
+    password = make_password(BENCH_PASSWORD)
+    User.objects.bulk_create([
+        User(username=f'bench-user-{index}', email=f'bench{index}@example.com', password=password)
+        for index in range(users)
+    ])
+    authors = list(User.objects.filter(username__startswith='bench-user-').order_by('pk'))
+    token, _ = Token.objects.get_or_create(user=authors[0])
+
+    batch = []
+    for index in range(recipes):
+        batch.append(_recipe(rng, authors[index % len(authors)], index))
+        if len(batch) >= batch_size or index == recipes - 1:
+            Recipe.objects.bulk_create(batch)
+            search.index_recipes(batch)
+            ingredients.sync_recipes(batch)
+            facets.add_recipes(batch)
+            batch = []
+
+    recipe_ids = list(Recipe.objects.filter(author__in=authors).values_list('pk', flat=True))
+    for index in range(photos):
+        blob = images.store_upload(make_photo(rng, name=f'seed-{index}.jpg'))
+        owners = rng.sample(recipe_ids, min(len(recipe_ids), rng.randint(1, 5)))
+        Recipe.objects.filter(pk__in=owners).update(image=blob.name)
+        ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + len(owners) - 1)
+        images.generate_variants(owners[0], blob.name)
+    response_cache.invalidate('all')
+    similar.rebuild()
+    # The first user follows everybody else, for the home feed
+    for author in authors[1:]:
+        timelines.follow(authors[0], author)
+
+    return Dataset(
+        usernames=[author.username for author in authors],
+        recipe_ids=recipe_ids,
+        # What anonymous visitors click through to: the lists, search and cookbooks they
+        # come from only show public recipes, so the detail and similar scenarios stick to those
+        public_recipe_ids=list(Recipe.objects.filter(pk__in=recipe_ids, is_public=True).values_list('pk', flat=True)),
+        own_recipe_ids=list(Recipe.objects.filter(author=authors[0]).values_list('pk', flat=True)),
+        token=token.key,
+        terms=[name.split()[0] for name in INGREDIENT_POOL] + [dish.split()[0] for dish in DISHES],
+    )
+
+
+# --- Scenarios -----------------------------------------------------------------------
+
+def _query(path, params):
+    return f"{path}?{urlencode(params)}" if params else path
+
+
+def _pages(data, most=5):
+    # Only pages that exist: small datasets don't have five of them
+    page_size = api_settings.PAGE_SIZE or 1
+    return max(1, min(most, -(-len(data.public_recipe_ids) // page_size)))
+
+
+def default_scenarios():
+    """
+    The request mix. ``share`` scales the number of requests: logins hash a password
+    and uploads decode a photo, so they get fewer samples than the cheap reads.
+    """
+    return [
+        Scenario('list', lambda rng, data: RequestSpec(
+            'GET', _query('/api/recipes/', {'page': rng.randint(1, _pages(data))}), None, False), 1.0),
+        Scenario('list_cursor', lambda rng, data: RequestSpec(
+            'GET', _query('/api/recipes/', {'pagination': 'cursor'}), None, False), 1.0),
+        Scenario('search', lambda rng, data: RequestSpec(
+            'GET', _query('/api/recipes/', {'search': ' '.join(rng.sample(data.terms, 2))}), None, False), 1.0),
+        Scenario('filter', lambda rng, data: RequestSpec(
+            'GET', _query('/api/recipes/', {
+                'category': rng.choice(CATEGORIES), 'cuisine': rng.choice(CUISINES), 'ordering': '-updated_at'
+            }), None, False), 1.0),
+        Scenario('facets', lambda rng, data: RequestSpec(
+            'GET', _query('/api/recipes/facets/', {'category': rng.choice(CATEGORIES)}), None, False), 1.0),
+        Scenario('similar', lambda rng, data: RequestSpec(
+            'GET', f"/api/recipes/{rng.choice(data.public_recipe_ids)}/similar/", None, False), 1.0),
+        Scenario('detail', lambda rng, data: RequestSpec(
+            'GET', f"/api/recipes/{rng.choice(data.public_recipe_ids)}/", None, False), 1.0),
+        Scenario('public_user', lambda rng, data: RequestSpec(
+            'GET', f"/api/users/{rng.choice(data.usernames)}/public-recipes/", None, False), 1.0),
+        Scenario('home_feed', lambda rng, data: RequestSpec(
+            'GET', '/api/feed/', None, True), 1.0),
+        Scenario('my_recipes', lambda rng, data: RequestSpec(
+            'GET', '/api/my-recipes/', None, True), 1.0),
+        Scenario('profile', lambda rng, data: RequestSpec(
+            'GET', '/api/users/profile/', None, True), 1.0),
+        Scenario('login', lambda rng, data: RequestSpec(
+            'POST', '/api/login/', {'username': rng.choice(data.usernames), 'password': BENCH_PASSWORD}, False), 0.1),
+        Scenario('upload', lambda rng, data: RequestSpec(
+            'POST', f"/api/recipes/{rng.choice(data.own_recipe_ids)}/upload-image/",
+            {'image': make_photo(rng, name='upload.jpg')}, True), 0.2),
+    ]
+
+
+# --- Drivers -------------------------------------------------------------------------
+
+class ClientDriver:
+    """Django's test client, one request at a time, with query counts."""
+    name = 'client'
+    counts_queries = True
+
+    def __init__(self, dataset):
+        self.anonymous = Client()
+        self.authenticated = Client(headers={'Authorization': f'Token {dataset.token}'})
+
+    def run(self, specs, concurrency):
+        samples = []
+        for spec in specs:
+            client = self.authenticated if spec.authenticated else self.anonymous
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                if spec.method == 'GET':
+                    response = client.get(spec.path)
+                else:
+                    response = client.post(spec.path, spec.data)
+                elapsed = time.perf_counter() - started
+            samples.append(Sample(response.status_code, elapsed, len(queries)))
+        return samples
+
+    def close(self):
+        pass
+
+
+class ASGIDriver:
+    """
+    Django's ASGI handler, called the way an ASGI server (uvicorn, daphne) calls it,
+    with ``concurrency`` requests in flight on one event loop. Like under a real
+    server, each request gets its own thread for sync code; the async test client
+    would run all of it on a single one.
+    """
+    name = 'asgi'
+    counts_queries = False
+
+    def __init__(self, dataset):
+        self.token = dataset.token
+        self.application = ASGIHandler()
+
+    def run(self, specs, concurrency):
+        return asyncio.run(self._run(specs, concurrency))
+
+    async def _run(self, specs, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(spec):
+            async with semaphore:
+                return await self._request(spec)
+
+        return await asyncio.gather(*(one(spec) for spec in specs))
+
+    async def _request(self, spec):
+        path, _, query = spec.path.partition('?')
+        headers = [(b'host', b'testserver')]
+        if spec.authenticated:
+            headers.append((b'authorization', f'Token {self.token}'.encode()))
+        body = b''
+        if spec.method != 'GET':
+            body = encode_multipart(BOUNDARY, spec.data or {})
+            headers += [(b'content-type', MULTIPART_CONTENT.encode()), (b'content-length', str(len(body)).encode())]
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': spec.method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': query.encode(), 'root_path': '', 'headers': headers,
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        finished = asyncio.Event()
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # Django listens for the client going away while the view runs
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        started = time.perf_counter()
+        await self.application(scope, receive, send)
+        elapsed = time.perf_counter() - started
+        finished.set()
+        return Sample(status[0], elapsed, None)
+
+    def close(self):
+        pass
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections under load, and the retried SYN
+    # shows up as a one second stall in the p99
+    request_queue_size = 256
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def counting_application(application):
+    """Wrap a WSGI app so every response says how many queries it ran."""
+    def app(environ, start_response):
+        count = [0]
+
+        def counter(execute, sql, params, many, context):
+            count[0] += 1
+            return execute(sql, params, many, context)
+
+        def counting_start_response(status, headers, exc_info=None):
+            return start_response(status, headers + [(QUERY_COUNT_HEADER, str(count[0]))], exc_info)
+
+        with connection.execute_wrapper(counter):
+            return application(environ, counting_start_response)
+    return app
+
+
+class WSGIServerDriver:
+    """A real HTTP server on localhost, hit from ``concurrency`` client threads."""
+    name = 'wsgi'
+    counts_queries = True
+
+    def __init__(self, dataset):
+        self.token = dataset.token
+        self.server = make_server(
+            '127.0.0.1', 0, counting_application(WSGIHandler()),
+            server_class=_ThreadingWSGIServer, handler_class=_QuietHandler
+        )
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def _request(self, spec):
+        headers = {'Host': '127.0.0.1'}
+        if spec.authenticated:
+            headers['Authorization'] = f'Token {self.token}'
+        body = None
+        if spec.method != 'GET':
+            body = encode_multipart(BOUNDARY, spec.data or {})
+            headers['Content-Type'] = MULTIPART_CONTENT
+        conn = HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            started = time.perf_counter()
+            conn.request(spec.method, spec.path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            elapsed = time.perf_counter() - started
+        finally:
+            conn.close()
+        queries = response.getheader(QUERY_COUNT_HEADER)
+        return Sample(response.status, elapsed, int(queries) if queries is not None else None)
+
+    def run(self, specs, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(self._request, specs))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+DRIVERS = {driver.name: driver for driver in (ClientDriver, ASGIDriver, WSGIServerDriver)}
+
+
+# --- Running and reporting -----------------------------------------------------------
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+def summarize(samples, wall_seconds):
+    latencies = sorted(sample.seconds * 1000 for sample in samples)
+    queries = [sample.queries for sample in samples if sample.queries is not None]
+    statuses = Counter(str(sample.status) for sample in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if sample.status >= 400),
+        'status_codes': dict(sorted(statuses.items())),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 3),
+            'p95': round(percentile(latencies, 0.95), 3),
+            'p99': round(percentile(latencies, 0.99), 3),
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'max': round(latencies[-1], 3),
+        },
+        'throughput_rps': round(len(samples) / wall_seconds, 2) if wall_seconds else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+@contextmanager
+def simulated_db_latency(seconds):
+    """Sleep ``seconds`` before every query, on every connection opened meanwhile."""
+    if not seconds:
+        yield
+        return
+
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def add_delay(sender, connection, **kwargs):
+        connection.execute_wrappers.append(delay)
+
+    connection_created.connect(add_delay)
+    connection.execute_wrappers.append(delay)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(add_delay)
+        connection.execute_wrappers.remove(delay)
+
+
+def database_profile():
+    """What the results were measured against: the backend and how it hands out connections."""
+    settings_dict = connection.settings_dict
+    options = settings_dict.get('OPTIONS', {})
+    return {
+        'vendor': connection.vendor,
+        'conn_max_age': settings_dict.get('CONN_MAX_AGE'),
+        'health_checks': settings_dict.get('CONN_HEALTH_CHECKS'),
+        'pool': bool(options.get('pool')),
+        'transaction_mode': options.get('transaction_mode'),
+        'init_command': options.get('init_command'),
+    }
+
+
+def run_benchmark(dataset, driver='client', requests=200, warmup=10, concurrency=8,
+                  scenarios=None, seed=1, db_latency=0):
+    """
+    Run every scenario against the dataset and return the results. Warm-up requests
+    (which fill the caches) aren't counted. ``db_latency`` is in seconds.
+    """
+    rng = random.Random(seed)
+    chosen = [scenario for scenario in default_scenarios() if not scenarios or scenario.name in scenarios]
+    runner = DRIVERS[driver](dataset)
+    results = {}
+    try:
+        with simulated_db_latency(db_latency):
+            for scenario in chosen:
+                count = max(1, round(requests * scenario.share))
+                runner.run([scenario.build(rng, dataset) for _ in range(warmup)], concurrency)
+                specs = [scenario.build(rng, dataset) for _ in range(count)]
+                started = time.perf_counter()
+                samples = runner.run(specs, concurrency)
+                results[scenario.name] = summarize(samples, time.perf_counter() - started)
+    finally:
+        runner.close()
+
+    return {
+        'meta': {
+            'commit': current_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'driver': driver,
+            'concurrency': 1 if driver == 'client' else concurrency,
+            'requests_per_scenario': requests,
+            'warmup': warmup,
+            'seed': seed,
+            'db_latency_ms': db_latency * 1000,
+            'async_views': sorted(getattr(settings, 'ASYNC_VIEWS', ())),
+            'database': connection.vendor,
+            'database_profile': database_profile(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'dataset': {
+                'users': len(dataset.usernames),
+                'recipes': len(dataset.recipe_ids),
+            },
+        },
+        'scenarios': results,
+    }
+
+
+def compare_results(current, baseline, threshold=0.10):
+    """
+    Compare a run against a baseline. Returns a list of regressions: p95 latency up,
+    or throughput down, by more than ``threshold`` (a fraction), or any scenario
+    running more queries per request than before. Query counts don't depend on how
+    busy the machine is, so they're compared exactly. Runs with a different driver,
+    concurrency, dataset size or database latency can't be compared, and say so.
+    """
+    regressions = []
+    for key in ('driver', 'concurrency', 'dataset', 'db_latency_ms'):
+        if baseline.get('meta', {}).get(key) != current['meta'].get(key):
+            regressions.append(f"runs are not comparable: {key} differs from the baseline")
+    for name, now in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        old_p95, new_p95 = before['latency_ms']['p95'], now['latency_ms']['p95']
+        if old_p95 and new_p95 > old_p95 * (1 + threshold):
+            regressions.append(f"{name}: p95 {old_p95:.1f}ms -> {new_p95:.1f}ms (+{(new_p95 / old_p95 - 1):.0%})")
+        old_rps, new_rps = before.get('throughput_rps'), now.get('throughput_rps')
+        if old_rps and new_rps is not None and new_rps < old_rps * (1 - threshold):
+            regressions.append(f"{name}: throughput {old_rps:.1f}/s -> {new_rps:.1f}/s ({(new_rps / old_rps - 1):.0%})")
+        old_queries, new_queries = before.get('queries_per_request'), now.get('queries_per_request')
+        if old_queries is not None and new_queries is not None and new_queries > old_queries:
+            regressions.append(f"{name}: {old_queries} -> {new_queries} queries per request")
+    return regressions
+
+
+# --- Serialization ---------------------------------------------------------------------
+
+def _best_of(repeat, function):
+    """The fastest of ``repeat`` calls, in seconds, and what the last one returned."""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def serializer_benchmark(rows=None, repeat=20):
+    """
+    Time each step of turning recipes into a JSON list, per recipe: loading them,
+    serializing them and rendering the result, the old way and the fast way. Uses
+    every recipe in the database, or the first ``rows`` of them. Each step is the
+    best of ``repeat`` runs, the way timeit does it. ``identical`` says whether both
+    ways came out with the same bytes.
+    """
+    queryset = Recipe.objects.with_author().order_by('-created_at', '-id')
+    if rows:
+        queryset = queryset[:rows]
+    request = Request(APIRequestFactory().get('/api/recipes/'))
+    context = {'request': request}
+    steps = {
+        'load: instances': lambda: list(queryset.all()),
+        'load: rows': lambda: list(RecipeRowSerializer.rows(queryset.all())),
+    }
+    instances, row_list = list(queryset), list(RecipeRowSerializer.rows(queryset))
+    steps['serialize: RecipeSerializer'] = lambda: RecipeSerializer(instances, many=True, context=context).data
+    steps['serialize: RecipeRowSerializer'] = lambda: RecipeRowSerializer(row_list, context=context).data
+    data = RecipeRowSerializer(row_list, context=context).data
+    steps['render: JSONRenderer'] = lambda: JSONRenderer().render(data)
+    steps['render: ORJSONRenderer'] = lambda: ORJSONRenderer().render(data)
+
+    results, outputs = {}, {}
+    count = max(1, len(instances))
+    for name, function in steps.items():
+        seconds, outputs[name] = _best_of(repeat, function)
+        results[name] = round(seconds / count * 1_000_000, 3)
+
+    slow = JSONRenderer().render(outputs['serialize: RecipeSerializer'])
+    fast = outputs['render: ORJSONRenderer']
+    return {
+        'rows': len(instances),
+        'repeat': repeat,
+        'us_per_row': results,
+        'identical': slow == fast,
+    }
+
+
+# --- Similar recipes -------------------------------------------------------------------
+
+def _exact_matrix(documents, idf):
+    """The recipes' TF-IDF vectors with a column per feature - no hashing, no collisions."""
+    columns = {feature: column for column, feature in enumerate(idf)}
+    matrix = similar.np.zeros((len(documents), len(columns)), dtype=similar.np.float32)
+    for row, document in enumerate(documents):
+        for feature, weight in document.items():
+            matrix[row, columns[feature]] = weight * idf[feature]
+    norms = similar.np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def similar_benchmark(queries=200, limit=10, seed=1):
+    """
+    Time ``similar_to`` for ``queries`` random recipes, and score its answers against
+    the exact search. The synthetic cookbook is full of ties (two "Spicy soup"s with
+    the same ingredients), so an answer counts as right when its exact similarity is
+    at least that of the exact search's ``limit``-th best: ``recall`` is the share of
+    answers that are. ``similarity_ratio`` compares the mean exact similarity of the
+    answers with that of the exact top ``limit``.
+    """
+    if not similar.available():
+        return None
+    np = similar.np
+    index_size = similar.rebuild()
+    recipes = list(Recipe.objects.only('id', *similar.FEATURE_FIELDS).order_by('pk'))
+    documents = [similar.features(recipe) for recipe in recipes]
+    exact = _exact_matrix(documents, similar.inverse_document_frequencies(documents))
+    rows = {recipe.pk: row for row, recipe in enumerate(recipes)}
+
+    rng = random.Random(seed)
+    latencies, hits, answered, achieved, ideal = [], 0, 0, 0.0, 0.0
+    similar.similar_to(recipes[0], limit)
+    for recipe in rng.sample(recipes, min(queries, len(recipes))):
+        started = time.perf_counter()
+        found = similar.similar_to(recipe, limit)
+        latencies.append(time.perf_counter() - started)
+
+        scores = exact @ exact[rows[recipe.pk]]
+        scores[rows[recipe.pk]] = -np.inf
+        best = np.sort(scores)[::-1][:limit]
+        found_scores = np.array([scores[rows[recipe_id]] for recipe_id, _ in found])
+        hits += int(np.count_nonzero(found_scores >= best[-1] - 1e-5))
+        answered += len(found)
+        achieved += float(found_scores.sum())
+        ideal += float(best.sum())
+
+    latencies.sort()
+    return {
+        'recipes': index_size,
+        'dimensions': similar.get_dimensions(),
+        'queries': len(latencies),
+        'limit': limit,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99': round(percentile(latencies, 0.99) * 1000, 3),
+        },
+        'recall': round(hits / answered, 4) if answered else None,
+        'similarity_ratio': round(achieved / ideal, 4) if ideal else None,
+    }
@@ -0,0 +1,198 @@
+"""
+Bulk import and export of recipes.
+
+Importing takes a stream of NDJSON (one JSON object per line) or CSV (one recipe
+per row, field names in the header) and creates recipes in batches: each batch is
+validated through the recipe serializer, written with one ``bulk_create`` inside
+its own transaction, and then indexed for search and the pantry in one go. Rows
+that don't validate are skipped and reported with their line number, so one bad
+row doesn't sink a migration of thousands.
+
+``bulk_create`` sends no signals, so everything ``recipes/signals.py`` would have
+done per recipe - search index, structured ingredients, facet counts, similar
+recipes, cached responses - is done here per batch instead, and so is what
+RecipeListCreateView does for a new recipe: pushing it into followers' feeds.
+
+Exporting streams the same formats back out, reading the table in chunks with
+``iterator()``, so the export never holds more than a chunk of recipes in memory.
+Images aren't part of either: they still go through the upload endpoints.
+"""
+import csv
+import io
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from . import facets, ingredients, response_cache, search, similar, timelines
+from .models import Recipe
+from .serializers import RecipeImportSerializer
+
+FORMATS = ('ndjson', 'csv')
+
+# Everything RecipeListCreateView.create insists on for a single recipe
+REQUIRED_FIELDS = ['title', 'description', 'ingredients', 'instructions',
+                   'preparation_time', 'cooking_time', 'servings',
+                   'difficulty', 'category', 'cuisine']
+
+EXPORT_FIELDS = ['id', 'title', 'description', 'ingredients', 'instructions',
+                 'preparation_time', 'cooking_time', 'servings', 'difficulty',
+                 'category', 'cuisine', 'is_public', 'author', 'created_at',
+                 'updated_at', 'image']
+
+DEFAULT_BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 1000
+
+# A file where every row is broken would otherwise produce an enormous report
+MAX_REPORTED_ERRORS = 100
+
+
+def format_for_content_type(content_type):
+    return 'csv' if 'csv' in (content_type or '') else 'ndjson'
+
+
+def _decode(lines):
+    for line in lines:
+        yield line.decode('utf-8-sig') if isinstance(line, bytes) else line
+
+
+def read_rows(lines, fmt='ndjson'):
+    """
+    Turn lines of NDJSON or CSV into (line number, row) pairs. A line that can't
+    be parsed at all comes out as (line number, None). Blank lines are skipped.
+    """
+    lines = _decode(lines)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # Empty cells mean "use the default", the same as a missing key in NDJSON
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None
+            continue
+        yield number, row if isinstance(row, dict) else None
+
+
+class ImportReport:
+    """What an import did: how many recipes were created and which rows failed."""
+
+    def __init__(self):
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def _write_batch(recipes, author):
+    with transaction.atomic():
+        # SQLite and PostgreSQL hand back the new primary keys, which the index needs
+        Recipe.objects.bulk_create(recipes)
+        search.index_recipes(recipes)
+        ingredients.sync_recipes(recipes)
+        facets.add_recipes(recipes)
+        transaction.on_commit(lambda: similar.update_recipes(recipes), robust=True)
+        transaction.on_commit(lambda: timelines.push_recipes(recipes), robust=True)
+    scopes = ['all']
+    if author is not None:
+        scopes.append(response_cache.user_scope(author.username))
+    response_cache.invalidate(*scopes)
+
+
+def import_rows(rows, author, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Validate and create recipes from (line number, row) pairs, ``batch_size`` at a
+    time. Each batch is its own transaction, so a crash halfway keeps what was
+    already written. Returns an ImportReport.
+    """
+    report = ImportReport()
+    # One serializer validates the whole import; building its fields is the
+    # expensive part, so it's done once rather than once per row
+    serializer = RecipeImportSerializer()
+    batch = []
+
+    for line, row in rows:
+        if row is None:
+            report.add_error(line, {'non_field_errors': ["Not a JSON object."]})
+            continue
+        missing = [field for field in REQUIRED_FIELDS if field not in row]
+        if missing:
+            report.add_error(line, {field: ["This field is required."] for field in missing})
+            continue
+        try:
+            validated = serializer.run_validation(row)
+        except ValidationError as e:
+            report.add_error(line, e.detail)
+            continue
+        validated.pop('image', None)
+        batch.append(Recipe(author=author, **validated))
+        if len(batch) >= batch_size:
+            _write_batch(batch, author)
+            report.created += len(batch)
+            batch = []
+
+    if batch:
+        _write_batch(batch, author)
+        report.created += len(batch)
+    return report
+
+
+def export_queryset(queryset=None):
+    """The rows of an export, as dicts in EXPORT_FIELDS order, read chunk by chunk."""
+    if queryset is None:
+        queryset = Recipe.objects.all()
+    columns = [('author__username' if field == 'author' else field) for field in EXPORT_FIELDS]
+    rows = queryset.order_by('pk').values_list(*columns).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for values in rows:
+        row = dict(zip(EXPORT_FIELDS, values))
+        row['image'] = row['image'] or None
+        yield row
+
+
+def export_chunks(queryset=None, fmt='ndjson', rows_per_chunk=100):
+    """
+    Encode an export as text chunks of ``rows_per_chunk`` rows each, ready to hand
+    to a StreamingHttpResponse or write to a file.
+    """
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+        def write(row):
+            buffer.write(encoder.encode(row))
+            buffer.write('\n')
+
+    pending = 0
+    for row in export_queryset(queryset):
+        write(row)
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,130 @@
+"""
+Facet counts for browsing: how many recipes there are per category, cuisine and
+difficulty, among the ones the current filters let through.
+
+A GROUP BY over the whole Recipe table on every request gets slower with every
+recipe. Instead, RecipeFacetCount keeps one row per (category, cuisine,
+difficulty, is_public) combination with the number of recipes that have it, and
+facet counts are sums over the rows matching the filters - a table that grows
+with the number of combinations, not the number of recipes.
+
+The table is kept up to date as recipes are created, changed and deleted (the
+signal handlers in recipes/signals.py, and bulk imports through
+``add_recipes``). Anything that goes around both - a raw ``QuerySet.update()``
+of those columns, say - can leave it off, and ``rebuild`` (the
+``rebuild_facet_counts`` command) recounts it from the recipes.
+
+A search narrows the results to a ranked set of recipes the table knows nothing
+about, so with ?search= the counts come from a GROUP BY over just those.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Recipe, RecipeFacetCount
+
+DIMENSIONS = ('category', 'cuisine', 'difficulty')
+KEY_FIELDS = DIMENSIONS + ('is_public',)
+
+
+def facet_key(recipe):
+    return tuple(getattr(recipe, field) for field in KEY_FIELDS)
+
+
+def loaded_key(recipe):
+    """The recipe's key as it was loaded from the database, or None if we don't know it."""
+    loaded_values = getattr(recipe, '_loaded_values', None) or {}
+    if not all(field in loaded_values for field in KEY_FIELDS):
+        return None
+    return tuple(loaded_values[field] for field in KEY_FIELDS)
+
+
+def apply_changes(changes):
+    """Add ``changes`` ({key: +n or -n}) to the counts."""
+    changes = {key: change for key, change in changes.items() if change}
+    # Make sure there's a row to add to (a no-op where there is one already), then add
+    RecipeFacetCount.objects.bulk_create([
+        RecipeFacetCount(count=0, **dict(zip(KEY_FIELDS, key))) for key, change in changes.items() if change > 0
+    ], ignore_conflicts=True)
+    # Always in the same order, so two writers never lock the same rows the other way round
+    for key, change in sorted(changes.items()):
+        RecipeFacetCount.objects.filter(**dict(zip(KEY_FIELDS, key))).update(count=F('count') + change)
+
+
+def add_recipes(recipes):
+    apply_changes(Counter(facet_key(recipe) for recipe in recipes))
+
+
+def remove_recipe(recipe):
+    apply_changes({facet_key(recipe): -1})
+
+
+def move_recipe(old_key, new_key):
+    if old_key != new_key:
+        apply_changes({old_key: -1, new_key: 1})
+
+
+# --- Reading -------------------------------------------------------------------------
+
+def counted_rows(filters):
+    """(category, cuisine, difficulty, count) from the counts table, for exact-match ``filters``."""
+    return (
+        RecipeFacetCount.objects.filter(count__gt=0, **filters)
+        .values_list(*DIMENSIONS, 'count')
+    )
+
+
+def grouped_rows(queryset):
+    """The same rows, straight from a queryset of recipes."""
+    return queryset.order_by().values_list(*DIMENSIONS).annotate(count=Count('id'))
+
+
+def summarize(rows):
+    """
+    {'count': total, 'facets': {'category': [{'value': 'Dinner', 'count': 12}, ...], ...}},
+    most common values first.
+    """
+    counters = {dimension: Counter() for dimension in DIMENSIONS}
+    total = 0
+    for *values, count in rows:
+        total += count
+        for dimension, value in zip(DIMENSIONS, values):
+            counters[dimension][value] += count
+    return {
+        'count': total,
+        'facets': {
+            dimension: [
+                {'value': value, 'count': count}
+                for value, count in sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+            ]
+            for dimension, counter in counters.items()
+        },
+    }
+
+
+# --- Reconciling ---------------------------------------------------------------------
+
+def recount():
+    """The counts as they should be, from the Recipe table: {key: count}."""
+    rows = Recipe.objects.order_by().values_list(*KEY_FIELDS).annotate(count=Count('id'))
+    return {tuple(key): count for *key, count in rows}
+
+
+def rebuild(dry_run=False):
+    """
+    Recount the table from the recipes. Returns how many combinations there are and
+    how many of the stored counts were wrong; with ``dry_run`` only the latter is
+    worked out and nothing is written. A recipe saved while this runs may be off by
+    one until the next rebuild.
+    """
+    with transaction.atomic():
+        actual = recount()
+        stored = {facet_key(row): row.count for row in RecipeFacetCount.objects.all()}
+        wrong = sum(1 for key in actual.keys() | stored.keys() if actual.get(key, 0) != stored.get(key, 0))
+        if not dry_run:
+            RecipeFacetCount.objects.all().delete()
+            RecipeFacetCount.objects.bulk_create([
+                RecipeFacetCount(count=count, **dict(zip(KEY_FIELDS, key))) for key, count in actual.items()
+            ])
+    return len(actual), wrong
@@ -0,0 +1,118 @@
+"""
+Sparse fieldsets for recipe responses.
+
+A recipe's description, ingredients and instructions are most of its size, and a
+page of recipe cards shows none of them. So list routes answer with a summary
+(``SUMMARY_FIELDS``) by default, detail pages with everything, and clients can
+ask for exactly what they need either way:
+
+* ``?fields=title,author,image_variants`` - just these fields
+* ``?omit=description`` - the default fields, minus these
+
+(both take comma-separated names, and can be repeated). The selection goes all the
+way down to the query: the columns for the fields nobody asked for aren't read from
+the database at all (see ``model_columns``).
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .models import Recipe
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+# Enough for a recipe card: title, times, difficulty, author and a thumbnail
+SUMMARY_FIELDS = (
+    'id', 'title', 'preparation_time', 'cooking_time', 'servings', 'difficulty',
+    'category', 'cuisine', 'author', 'created_at', 'updated_at', 'image', 'image_variants',
+)
+
+unknown_field_message = _('Unknown field "{name}". Choose from: {choices}.')
+
+_serializer_fields = {}
+
+
+def get_serializer_fields(serializer_class):
+    """A serializer class's fields, built once: they're only read here."""
+    if serializer_class not in _serializer_fields:
+        _serializer_fields[serializer_class] = serializer_class().fields
+    return _serializer_fields[serializer_class]
+
+
+def requested(request, param):
+    names = []
+    for value in request.query_params.getlist(param):
+        names.extend(name.strip() for name in value.split(',') if name.strip())
+    return names
+
+
+def select_fields(request, available, default=None):
+    """
+    The fields a read should include, in the serializer's order: ?fields= if given,
+    otherwise ``default``, less anything in ?omit=. None if that's all of them anyway,
+    so the common case costs nothing. Asking for a field that doesn't exist is a 400.
+    """
+    fields, omit = requested(request, FIELDS_PARAM), requested(request, OMIT_PARAM)
+    if not fields and not omit and default is None:
+        return None
+
+    errors = {}
+    for param, names in ((FIELDS_PARAM, fields), (OMIT_PARAM, omit)):
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            errors[param] = [
+                unknown_field_message.format(name=name, choices=', '.join(available)) for name in unknown
+            ]
+    if errors:
+        raise ValidationError(errors)
+
+    chosen = set(fields or (available if default is None else default)) - set(omit)
+    selected = [name for name in available if name in chosen]
+    return None if len(selected) == len(available) else selected
+
+
+def field_column(name, field):
+    """
+    The column (in QuerySet lookup form, like 'author__username') a serializer field
+    reads. Method fields read the column with their own name.
+    """
+    if isinstance(field, serializers.SerializerMethodField):
+        return name
+    return field.source.replace('.', '__')
+
+
+def model_columns(serializer_class, fields):
+    """
+    The Recipe columns to load for these of the serializer's fields, for
+    QuerySet.only(). Fields that aren't model columns (annotations) are left to
+    the query that adds them.
+    """
+    serializer_fields = get_serializer_fields(serializer_class)
+    columns = []
+    for name in fields:
+        column = field_column(name, serializer_fields[name])
+        relation = column.split('__')[0]
+        try:
+            Recipe._meta.get_field(relation)
+        except FieldDoesNotExist:
+            continue
+        if relation != column:
+            # A related column needs the relation itself loaded too
+            columns.append(relation)
+        columns.append(column)
+    return columns
+
+
+def only(queryset, serializer_class, fields):
+    """``queryset`` loading only what serializing ``fields`` needs."""
+    columns = model_columns(serializer_class, fields)
+    if {'image', 'image_variants'} & set(fields):
+        # Whether the photo's URLs get signed goes by these (RecipeSerializer.signs_media)
+        columns += ['author', 'is_public']
+    if not any('__' in column for column in columns):
+        # Nothing from the author: don't join it in either
+        queryset = queryset.select_related(None)
+    # The primary key comes along regardless; naming it keeps only() from being empty
+    return queryset.only('id', *columns)
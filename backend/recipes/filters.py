@@ -0,0 +1,54 @@
+from django.db.models import Case, IntegerField, When
+from rest_framework import filters
+
+from . import search
+
+
+class RecipeSearchFilter(filters.SearchFilter):
+    """
+    A drop-in replacement for DRF's SearchFilter that answers ?search= from the
+    recipe search index instead of running icontains over every text column.
+    Results come back ranked best match first, unless the client asks for a
+    specific ?ordering=, in which case the OrderingFilter gets the final say.
+    Either way only the best RECIPE_SEARCH_MAX_RESULTS matches are in the list, and
+    in its count (see recipes/search.py).
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_query(request)
+        if not query.strip():
+            return queryset
+
+        # The ranking is remembered on the request: afilter_queryset() below searches
+        # up front and then comes through here, and a view may filter more than once
+        ranked_ids = self.get_remembered_ranking(request, query)
+        if ranked_ids is None:
+            ranked_ids = [recipe_id for recipe_id, _ in search.search(query, queryset)]
+            request._recipe_search_ranking = (query, ranked_ids)
+        return self.rank_queryset(queryset, ranked_ids)
+
+    async def afilter_queryset(self, request, queryset, view):
+        # Async views search with the async ORM up front; after that it's the same filter
+        query = self.get_query(request)
+        if query.strip() and self.get_remembered_ranking(request, query) is None:
+            ranked_ids = [recipe_id for recipe_id, _ in await search.asearch(query, queryset)]
+            request._recipe_search_ranking = (query, ranked_ids)
+        return self.filter_queryset(request, queryset, view)
+
+    def get_query(self, request):
+        return request.query_params.get(self.search_param, '').replace('\x00', '')
+
+    def get_remembered_ranking(self, request, query):
+        cached = getattr(request, '_recipe_search_ranking', None)
+        if cached is not None and cached[0] == query:
+            return cached[1]
+        return None
+
+    def rank_queryset(self, queryset, ranked_ids):
+        if not ranked_ids:
+            return queryset.none()
+        rank = Case(
+            *[When(pk=recipe_id, then=position) for position, recipe_id in enumerate(ranked_ids)],
+            output_field=IntegerField()
+        )
+        return queryset.filter(pk__in=ranked_ids).order_by(rank)
@@ -0,0 +1,251 @@
+"""
+The recipe image pipeline.
+
+Uploads are streamed to storage chunk by chunk (never read into memory in one go)
+and stored under the SHA-256 of their content, e.g.
+``recipe_images/3f/3fa2...e1.jpg``. Uploading a photo we already have just bumps
+the reference count of the existing ``ImageBlob`` instead of writing a second copy,
+and since a name can only ever hold one content, media URLs never change meaning
+and can be cached forever. The file goes away when the last recipe using it does,
+in a background job (jobs/queue.py) rather than during the request that let it go.
+
+The slow part - decoding the photo and producing smaller copies of it - is a
+background job too, run by the job workers once the request has committed. Each upload
+gets WebP and JPEG variants at a few widths, with EXIF and other metadata dropped
+(so no GPS coordinates from someone's phone end up on the internet), and the
+variant names are recorded in ``Recipe.image_variants``. The serializer turns
+those into srcset strings so list pages can send thumbnails instead of originals.
+"""
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from jobs.queue import task
+from . import response_cache
+from .models import ImageBlob, Recipe
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = 'recipe_images'
+VARIANT_DIR = 'recipe_images/variants'
+
+# Format name -> (Pillow format, file extension, save options)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+def get_variant_widths():
+    return sorted(getattr(settings, 'RECIPE_IMAGE_VARIANT_WIDTHS', [320, 640, 1280]))
+
+
+def hash_upload(upload):
+    """SHA-256 of an upload, read chunk by chunk."""
+    digest = hashlib.sha256()
+    upload.seek(0)
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+def content_name(digest, original_name):
+    extension = os.path.splitext(original_name or '')[1].lower()[:10]
+    return f"{UPLOAD_DIR}/{digest[:2]}/{digest}{extension}"
+
+
+def store_upload(upload):
+    """
+    Store an uploaded image under its content digest and take a reference on it.
+    Returns the ImageBlob; its ``name`` is what goes into ``Recipe.image``.
+    If we already have this exact image nothing is written, and the blob may even
+    come with its variants ready.
+    """
+    digest = hash_upload(upload)
+    name = content_name(digest, upload.name)
+    with transaction.atomic():
+        blob, created = ImageBlob.objects.select_for_update().get_or_create(
+            digest=digest,
+            defaults={'name': name, 'size': upload.size or 0, 'ref_count': 1}
+        )
+        if created:
+            if not default_storage.exists(blob.name):
+                # Storage backends write File objects chunk by chunk
+                stored = default_storage.save(blob.name, upload)
+                if stored != blob.name:
+                    ImageBlob.objects.filter(pk=blob.pk).update(name=stored)
+                    blob.name = stored
+        else:
+            if blob.ref_count == 0 and not default_storage.exists(blob.name):
+                # The last recipe let go of it and the clean-up job got as far as the
+                # file before it failed: this upload brings the photo back
+                default_storage.save(blob.name, upload)
+                ImageBlob.objects.filter(pk=blob.pk).update(variants={})
+                blob.variants = {}
+            ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+            blob.ref_count += 1
+    return blob
+
+
+def release_image(name, variants=None):
+    """
+    Drop one recipe's reference to an image. The file and its variants are only
+    deleted when no recipe uses them any more, by a background job. Images stored
+    before content addressing have no blob and belong to a single recipe, so their
+    files are deleted outright (by a job as well).
+    """
+    if not name:
+        return
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            delete_image.enqueue(name, variants)
+            return
+        ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+        if blob.ref_count == 1:
+            # The blob stays (with no references) until the job has deleted the files
+            collect_blob.enqueue(blob.name, key=f'collect-image:{blob.name}')
+
+
+@task
+def collect_blob(name):
+    """Delete an image nobody uses any more, files and all - unless somebody uploaded it again since."""
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(name=name).first()
+        if blob is None or blob.ref_count > 0:
+            return
+        # Delete the files while we still hold the row, so an upload of the same
+        # image racing with us can't end up pointing at a file we're removing.
+        delete_image(blob.name, blob.variants)
+        blob.delete()
+
+
+def schedule_variants(recipe_id, name):
+    """
+    Generate the variants for a freshly stored image as a background job, which the
+    job workers see once the transaction that saved the image has committed. With
+    RECIPE_IMAGE_PROCESSING = 'inline' the work happens right after the commit,
+    in this process, instead - handy in development and tests.
+    """
+    if getattr(settings, 'RECIPE_IMAGE_PROCESSING', 'background') == 'inline':
+        transaction.on_commit(lambda: generate_variants(recipe_id, name))
+    else:
+        # A photo is worth one job per recipe, however many times it's uploaded meanwhile
+        generate_variants.enqueue(recipe_id, name, key=f'image-variants:{recipe_id}:{name}')
+
+
+def variant_name(name, width, extension):
+    # Keep the original extension in the stem, so photo.jpg and photo.png don't collide
+    stem = os.path.basename(name).replace('.', '_')
+    return f"{VARIANT_DIR}/{stem}_{width}w.{extension}"
+
+
+def render_variants(source, name):
+    """
+    Decode an image once and produce every variant we serve.
+    Returns a dict of format -> {width: (variant name, encoded bytes)}.
+    """
+    with Image.open(source) as original:
+        # Apply the camera's orientation before we throw the EXIF data away
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', image.size, 'white')
+            if 'A' in image.getbands():
+                background.paste(image, mask=image.getchannel('A'))
+            else:
+                background.paste(image.convert('RGB'))
+            image = background
+
+        variants = {fmt: {} for fmt in VARIANT_FORMATS}
+        widths = [width for width in get_variant_widths() if width < image.width] or [image.width]
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            for fmt, (pillow_format, extension, options) in VARIANT_FORMATS.items():
+                buffer = BytesIO()
+                # No exif=/icc_profile= here, so the variants carry no metadata
+                resized.convert('RGB').save(buffer, format=pillow_format, **options)
+                variants[fmt][width] = (variant_name(name, width, extension), buffer.getvalue())
+        return variants
+
+
+# People are waiting for their thumbnails; this goes ahead of the clean-up jobs
+@task(priority=10)
+def generate_variants(recipe_id, name):
+    """Build, store and record the variants of one recipe image."""
+    if not Recipe.objects.filter(image=name).exists():
+        # Replaced or deleted before the job got to it; the file may well be gone too
+        return None
+    blob = ImageBlob.objects.filter(name=name).first()
+    if blob is not None and blob.variants:
+        # Somebody uploaded the same photo before us, the work is already done
+        variants = blob.variants
+    else:
+        with default_storage.open(name, 'rb') as source:
+            rendered = render_variants(source, name)
+
+        stored = {}
+        for fmt, sizes in rendered.items():
+            stored[fmt] = {}
+            for width, (target, data) in sizes.items():
+                # Variant names derive from the content digest, so an existing
+                # file already holds exactly these bytes
+                if blob is not None and default_storage.exists(target):
+                    stored[fmt][str(width)] = target
+                else:
+                    stored[fmt][str(width)] = default_storage.save(target, ContentFile(data))
+        variants = {'source': name, 'formats': stored}
+        if blob is not None:
+            ImageBlob.objects.filter(pk=blob.pk).update(variants=variants)
+
+    # Only record them on recipes that still point at this image - it may have been
+    # replaced while we were busy. update() also leaves every other column alone, but
+    # updated_at has to move, it's what the recipe's ETag is made from.
+    updated = Recipe.objects.filter(image=name).update(image_variants=variants, updated_at=timezone.now())
+    if not updated and not ImageBlob.objects.filter(name=name).exists():
+        # Nobody uses this image any more, don't leave the variants behind
+        delete_variants(variants)
+    # update() sends no signals, so tell the response cache ourselves
+    for pk, username in Recipe.objects.filter(image=name).values_list('pk', 'author__username'):
+        response_cache.invalidate_recipe(pk, username)
+    return variants
+
+
+def delete_variants(variants):
+    for sizes in (variants or {}).get('formats', {}).values():
+        for target in sizes.values():
+            default_storage.delete(target)
+
+
+@task
+def delete_image(name, variants=None):
+    """Remove an image and all of its variants from storage."""
+    if name:
+        default_storage.delete(name)
+    delete_variants(variants)
+
+
+def build_srcsets(variants, url_builder):
+    """
+    Turn recorded variants into what an <img>/<picture> tag wants:
+    {'thumbnail': url, 'webp': 'url 320w, url 640w', 'jpeg': '...'}
+    """
+    formats = (variants or {}).get('formats')
+    if not formats:
+        return None
+    srcsets = {}
+    for fmt, sizes in formats.items():
+        ordered = sorted(sizes.items(), key=lambda item: int(item[0]))
+        srcsets[fmt] = ', '.join(f"{url_builder(target)} {width}w" for width, target in ordered)
+    jpeg = sorted(formats.get('jpeg', {}).items(), key=lambda item: int(item[0]))
+    srcsets['thumbnail'] = url_builder(jpeg[0][1]) if jpeg else None
+    return srcsets
@@ -0,0 +1,249 @@
+"""
+Turning the free-text ingredient list of a recipe into structured rows.
+
+Recipes store their ingredients as one blob of text, usually a comma or newline
+separated list like "2 cups flour, 1/2 tsp salt, chicken breast". We split that up,
+pull out the quantity and unit, and normalise the ingredient name so that
+"Tomatoes", "fresh tomatoes" and "tomato" all end up as the same Ingredient.
+With that in place "what can I cook with chicken and garlic?" is an indexed join
+instead of a substring scan (see ``pantry_recipes``).
+"""
+import re
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from fractions import Fraction
+
+from django.db import transaction
+from django.db.models import Count, FloatField, Q
+from django.db.models.functions import Cast
+
+from .models import Ingredient, Recipe, RecipeIngredient
+
+ParsedIngredient = namedtuple('ParsedIngredient', ['name', 'quantity', 'unit', 'raw_text'])
+
+# Unit spellings we recognise, mapped to the canonical name we store.
+UNITS = {
+    'cup': 'cup', 'cups': 'cup', 'c': 'cup',
+    'tablespoon': 'tbsp', 'tablespoons': 'tbsp', 'tbsp': 'tbsp', 'tbs': 'tbsp', 'tbl': 'tbsp',
+    'teaspoon': 'tsp', 'teaspoons': 'tsp', 'tsp': 'tsp',
+    'gram': 'g', 'grams': 'g', 'g': 'g',
+    'kilogram': 'kg', 'kilograms': 'kg', 'kg': 'kg',
+    'milliliter': 'ml', 'milliliters': 'ml', 'millilitre': 'ml', 'millilitres': 'ml', 'ml': 'ml',
+    'liter': 'l', 'liters': 'l', 'litre': 'l', 'litres': 'l', 'l': 'l',
+    'ounce': 'oz', 'ounces': 'oz', 'oz': 'oz',
+    'pound': 'lb', 'pounds': 'lb', 'lb': 'lb', 'lbs': 'lb',
+    'pinch': 'pinch', 'pinches': 'pinch', 'dash': 'dash', 'dashes': 'dash',
+    'clove': 'clove', 'cloves': 'clove',
+    'can': 'can', 'cans': 'can', 'package': 'package', 'packages': 'package',
+    'slice': 'slice', 'slices': 'slice', 'sprig': 'sprig', 'sprigs': 'sprig',
+    'bunch': 'bunch', 'bunches': 'bunch', 'handful': 'handful',
+}
+
+# Words that describe how an ingredient is prepared rather than what it is.
+# "2 large chopped onions" and "onion" should land on the same Ingredient.
+DESCRIPTORS = {
+    'fresh', 'freshly', 'chopped', 'minced', 'diced', 'sliced', 'grated', 'shredded',
+    'crushed', 'peeled', 'large', 'small', 'medium', 'finely', 'roughly', 'whole',
+}
+
+UNICODE_FRACTIONS = {
+    '½': '1/2', '⅓': '1/3', '⅔': '2/3', '¼': '1/4', '¾': '3/4',
+    '⅕': '1/5', '⅛': '1/8', '⅜': '3/8', '⅝': '5/8', '⅞': '7/8',
+}
+
+# "2", "1/2", "1 1/2", "1.5" or a range like "2-3" (we keep the lower bound)
+_QUANTITY_RE = re.compile(r'^(\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?)(?:\s*(?:-|to)\s*[\d./]+)?\s*')
+# RecipeIngredient.quantity is a DecimalField(max_digits=10, decimal_places=3)
+MAX_QUANTITY = Decimal('9999999.999')
+_SPLIT_RE = re.compile(r'[\n,;]+')
+_PARENS_RE = re.compile(r'\([^)]*\)')
+_WORD_RE = re.compile(r"[a-z][a-z'\-]*")
+
+
+def split_lines(text):
+    """Break an ingredient blob into one entry per ingredient."""
+    if not text:
+        return []
+    return [line.strip(' \t-*•') for line in _SPLIT_RE.split(text) if line.strip(' \t-*•')]
+
+
+def parse_quantity(text):
+    """Read a leading quantity off a line. Returns (Decimal or None, rest of the line)."""
+    for symbol, fraction in UNICODE_FRACTIONS.items():
+        text = text.replace(symbol, f' {fraction}')
+    text = text.strip()
+    match = _QUANTITY_RE.match(text)
+    if not match:
+        # "a pinch of salt", "an onion"
+        first, _, rest = text.partition(' ')
+        if first.lower() in ('a', 'an') and rest:
+            return Decimal('1.000'), rest.strip()
+        return None, text
+    try:
+        amount = sum(Fraction(part) for part in match.group(1).split())
+        if amount > MAX_QUANTITY:
+            # Not a real amount, and it wouldn't fit the column anyway
+            return None, text[match.end():]
+        quantity = Decimal(amount.numerator) / Decimal(amount.denominator)
+        quantity = quantity.quantize(Decimal('0.001'))
+    except (ValueError, ZeroDivisionError, InvalidOperation):
+        return None, text
+    return quantity, text[match.end():]
+
+
+def singularize(word):
+    """A deliberately small set of English plural rules, good enough for ingredient names."""
+    if len(word) <= 3 or word.endswith(('ss', 'us', 'is')):
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith(('oes', 'ches', 'shes', 'xes')):
+        return word[:-2]
+    if word.endswith('ves'):
+        return word[:-3] + 'f'
+    if word.endswith('s'):
+        return word[:-1]
+    return word
+
+
+def normalize_name(text):
+    """
+    Boil an ingredient description down to a canonical name.
+    "Fresh Tomatoes (ripe)" -> "tomato", "extra-virgin olive oil" -> "extra virgin olive oil"
+    """
+    text = _PARENS_RE.sub(' ', text.lower())
+    words = [word.strip("'-") for word in _WORD_RE.findall(text.replace('-', ' '))]
+    words = [word for word in words if word and word not in DESCRIPTORS]
+    if words and words[0] == 'of':
+        words = words[1:]
+    if not words:
+        return ''
+    words[-1] = singularize(words[-1])
+    return ' '.join(words)[:100]
+
+
+def parse_ingredient(line):
+    """Parse one ingredient entry, e.g. "2 cups chopped onions" -> ('onion', 2, 'cup')."""
+    quantity, rest = parse_quantity(line)
+    unit = ''
+    parts = rest.split(None, 1)
+    if parts:
+        candidate = parts[0].lower().rstrip('.')
+        if candidate in UNITS and (quantity is not None or len(candidate) > 2):
+            unit = UNITS[candidate]
+            rest = parts[1] if len(parts) > 1 else ''
+    return ParsedIngredient(normalize_name(rest), quantity, unit, line[:255])
+
+
+def parse_ingredients(text):
+    """Parse a whole ingredient blob, skipping entries we can't make a name out of."""
+    parsed = (parse_ingredient(line) for line in split_lines(text))
+    return [item for item in parsed if item.name]
+
+
+def ingredient_head(name):
+    return name.rsplit(' ', 1)[-1]
+
+
+def _get_ingredient_ids(names, ingredient_model=Ingredient):
+    """Map ingredient names to Ingredient ids, creating any we haven't seen before."""
+    names = set(names)
+    if not names:
+        return {}
+    ingredient_model.objects.bulk_create(
+        [ingredient_model(name=name, head=ingredient_head(name)) for name in names],
+        ignore_conflicts=True
+    )
+    return dict(ingredient_model.objects.filter(name__in=names).values_list('name', 'pk'))
+
+
+def build_recipe_ingredients(recipes, ingredient_model=Ingredient, recipe_ingredient_model=RecipeIngredient):
+    """
+    Build (unsaved) RecipeIngredient rows for a batch of recipes.
+    The model classes can be swapped for historical ones, which is how the data
+    migration reuses this.
+    """
+    parsed = {recipe.pk: parse_ingredients(recipe.ingredients) for recipe in recipes}
+    ids = _get_ingredient_ids(
+        (item.name for items in parsed.values() for item in items),
+        ingredient_model
+    )
+    rows = []
+    for recipe_id, items in parsed.items():
+        seen = set()
+        for position, item in enumerate(items):
+            # The same ingredient listed twice (salt for the dough and the topping)
+            # still only counts once towards pantry coverage.
+            if item.name in seen:
+                continue
+            seen.add(item.name)
+            rows.append(recipe_ingredient_model(
+                recipe_id=recipe_id,
+                ingredient_id=ids[item.name],
+                position=position,
+                quantity=item.quantity,
+                unit=item.unit,
+                raw_text=item.raw_text,
+            ))
+    return rows
+
+
+def sync_recipes(recipes):
+    """Replace the structured ingredients of the given recipes with a fresh parse."""
+    recipes = list(recipes)
+    if not recipes:
+        return
+    with transaction.atomic():
+        RecipeIngredient.objects.filter(recipe_id__in=[recipe.pk for recipe in recipes]).delete()
+        RecipeIngredient.objects.bulk_create(build_recipe_ingredients(recipes), batch_size=1000)
+
+
+def sync_recipe(recipe):
+    sync_recipes([recipe])
+
+
+def resolve_pantry(items):
+    """
+    Find the Ingredient ids a pantry list refers to. Each item matches ingredients
+    with exactly that name, names that start with it ("chicken" -> "chicken breast")
+    and names that end with it ("oil" -> "olive oil"). All three are index lookups.
+    """
+    condition = Q()
+    for item in items:
+        name = normalize_name(item)
+        if not name:
+            continue
+        condition |= Q(name=name) | Q(name__gte=name + ' ', name__lt=name + ' \uffff')
+        if ' ' not in name:
+            condition |= Q(head=name)
+    if not condition:
+        return []
+    return list(Ingredient.objects.filter(condition).values_list('pk', flat=True))
+
+
+def pantry_recipes(items, queryset=None):
+    """
+    Recipes that use at least one of the pantry items, annotated with how many of their
+    ingredients are covered and ranked best coverage first.
+    """
+    if queryset is None:
+        queryset = Recipe.objects.all()
+    ingredient_ids = resolve_pantry(items)
+    if not ingredient_ids:
+        return queryset.none()
+
+    candidates = RecipeIngredient.objects.filter(ingredient_id__in=ingredient_ids).values('recipe_id')
+    return (
+        queryset.filter(pk__in=candidates)
+        .annotate(
+            matched_ingredients=Count(
+                'recipe_ingredients',
+                filter=Q(recipe_ingredients__ingredient_id__in=ingredient_ids)
+            ),
+            total_ingredients=Count('recipe_ingredients'),
+        )
+        .annotate(
+            coverage=Cast('matched_ingredients', FloatField()) / Cast('total_ingredients', FloatField())
+        )
+        .order_by('-coverage', '-matched_ingredients', '-created_at', '-id')
+    )
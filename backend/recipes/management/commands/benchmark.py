@@ -0,0 +1,161 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from recipes import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic dataset and benchmark the API: p50/p95/p99 latency, throughput and "
+        "queries per request for each endpoint. Runs against a throwaway test database unless "
+        "--use-current-db is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="Users to create (default: 20).")
+        parser.add_argument('--recipes', type=int, default=1000, help="Recipes to create (default: 1000).")
+        parser.add_argument('--photos', type=int, default=10, help="Distinct photos to attach to recipes (default: 10).")
+        parser.add_argument('--seed', type=int, default=1, help="Random seed for the data and the request mix.")
+        parser.add_argument('--driver', choices=sorted(benchmark.DRIVERS), default='client',
+                            help="client: in-process test client (counts queries); asgi: the ASGI handler, "
+                                 "the way an ASGI server runs it (set ASYNC_VIEWS to use the async read views); "
+                                 "wsgi: local threaded HTTP server.")
+        parser.add_argument('--requests', type=int, default=200, help="Measured requests per scenario (default: 200).")
+        parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests per scenario first (default: 10).")
+        parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight for the asgi and wsgi drivers.")
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help="Only run this scenario (repeatable). Default: all of them.")
+        parser.add_argument('--db-latency', type=float, default=0,
+                            help="Milliseconds added to every query, to simulate a database across the network.")
+        parser.add_argument('--no-response-cache', action='store_true', help="Benchmark with the response cache off.")
+        parser.add_argument('--output', '-o', help="Write the results to this JSON file.")
+        parser.add_argument('--compare', help="Baseline results (JSON) to compare against.")
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help="Allowed slowdown against the baseline, as a fraction (default: 0.10).")
+        parser.add_argument('--serializers', action='store_true',
+                            help="Instead of the scenarios, time loading, serializing and rendering the seeded "
+                                 "recipes, in microseconds per recipe (best of --requests runs).")
+        parser.add_argument('--similar', action='store_true',
+                            help="Instead of the scenarios, time similar-recipe queries against the index and "
+                                 "score their answers against an exact search (--requests of them).")
+        parser.add_argument('--use-current-db', action='store_true',
+                            help="Seed into the configured database instead of a temporary one. It is not cleaned up!")
+
+    def handle(self, *args, **options):
+        known = {scenario.name for scenario in benchmark.default_scenarios()}
+        unknown = set(options['scenarios'] or ()) - known
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}. Choose from {', '.join(sorted(known))}.")
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read baseline {options['compare']}: {e}")
+
+        media_root = tempfile.mkdtemp(prefix='bench-')
+        overrides = override_settings(
+            MEDIA_ROOT=media_root,
+            RECIPE_SIMILAR_INDEX_DIR=os.path.join(media_root, 'similar-index'),
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver', '127.0.0.1', 'localhost'],
+            RECIPE_RESPONSE_CACHE_ENABLED=not options['no_response_cache'] and getattr(settings, 'RECIPE_RESPONSE_CACHE_ENABLED', True),
+        )
+        old_config = None
+        overrides.enable()
+        try:
+            if not options['use_current_db']:
+                setup_test_environment()
+                for alias in connections:
+                    if connections[alias].vendor == 'sqlite':
+                        # A file rather than SQLite's default in-memory test database: the image
+                        # workers write from other threads, and shared-cache memory databases lock
+                        # whole tables against that. It's closer to production, too.
+                        connections[alias].settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(media_root, f'{alias}.sqlite3')
+                old_config = setup_databases(verbosity=0, interactive=False)
+            self.stdout.write(f"Seeding {options['users']} users, {options['recipes']} recipes, {options['photos']} photos...")
+            dataset = benchmark.seed_dataset(options['users'], options['recipes'], options['photos'], options['seed'])
+            if options['serializers']:
+                self.stdout.write("Timing serialization...")
+                results = benchmark.serializer_benchmark(repeat=options['requests'])
+            elif options['similar']:
+                self.stdout.write("Querying the similar-recipes index...")
+                results = benchmark.similar_benchmark(queries=options['requests'], seed=options['seed'])
+                if results is None:
+                    raise CommandError("The similar-recipes index needs NumPy.")
+            else:
+                async_views = ', '.join(getattr(settings, 'ASYNC_VIEWS', ())) or 'none'
+                database = benchmark.database_profile()
+                pooling = 'pool' if database['pool'] else f"CONN_MAX_AGE={database['conn_max_age']}"
+                self.stdout.write(
+                    f"Running {options['driver']} benchmark (async views: {async_views}; "
+                    f"database: {database['vendor']}, {pooling})..."
+                )
+                results = benchmark.run_benchmark(
+                    dataset, driver=options['driver'], requests=options['requests'], warmup=options['warmup'],
+                    concurrency=options['concurrency'], scenarios=options['scenarios'], seed=options['seed'],
+                    db_latency=options['db_latency'] / 1000,
+                )
+                results['meta']['response_cache'] = not options['no_response_cache']
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+            overrides.disable()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        if options['serializers']:
+            self.report_serializers(results)
+        elif options['similar']:
+            self.report_similar(results)
+        else:
+            self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None and not options['serializers'] and not options['similar']:
+            regressions = benchmark.compare_results(results, baseline, options['threshold'])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(self.style.ERROR(f"  regression: {regression}"))
+                raise CommandError(f"{len(regressions)} regressions against {options['compare']}.")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']} (threshold {options['threshold']:.0%})."))
+
+    def report(self, results):
+        self.stdout.write(f"{'scenario':<14}{'reqs':>6}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'queries':>9}")
+        for name, result in results['scenarios'].items():
+            latency = result['latency_ms']
+            queries = result['queries_per_request']
+            self.stdout.write(
+                f"{name:<14}{result['requests']:>6}{result['errors']:>8}{latency['p50']:>10.2f}{latency['p95']:>10.2f}"
+                f"{latency['p99']:>10.2f}{result['throughput_rps'] or 0:>10.1f}{'-' if queries is None else queries:>9}"
+            )
+
+    def report_serializers(self, results):
+        self.stdout.write(f"{results['rows']} recipes, best of {results['repeat']} runs")
+        self.stdout.write(f"{'step':<34}{'us/recipe':>10}")
+        for name, micros in results['us_per_row'].items():
+            self.stdout.write(f"{name:<34}{micros:>10.2f}")
+        if results['identical']:
+            self.stdout.write(self.style.SUCCESS("Both ways produce the same JSON."))
+        else:
+            self.stderr.write(self.style.ERROR("The fast path's JSON differs from RecipeSerializer's!"))
+
+    def report_similar(self, results):
+        latency = results['latency_ms']
+        self.stdout.write(
+            f"{results['recipes']} recipes, {results['dimensions']} dimensions, "
+            f"{results['queries']} queries for the top {results['limit']}"
+        )
+        self.stdout.write(f"latency ms: p50 {latency['p50']:.2f}, p95 {latency['p95']:.2f}, p99 {latency['p99']:.2f}")
+        self.stdout.write(f"recall against the exact search: {results['recall']:.1%}")
+        self.stdout.write(f"mean similarity against the exact top {results['limit']}: {results['similarity_ratio']:.1%}")
@@ -0,0 +1,99 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+
+from recipes.query_plans import ShapeReport, explain, parse_log_line, plan_problems, query_shape, request_path
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a captured request log against the API, collect the database plan of "
+        "every query the views run, and report which query shapes still scan whole tables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('logfile', help="Request log: one request per line ('GET /api/recipes/?page=2', a bare path or an access-log line).")
+        parser.add_argument('--token', help="Send requests with this API token, for endpoints that need a login.")
+        parser.add_argument('--host', default='localhost', help="Host header to send (must be in ALLOWED_HOSTS).")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+        parser.add_argument('--all', action='store_true', help="Also list query shapes that use indexes properly.")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['logfile']) as logfile:
+                requests = [parsed for parsed in map(parse_log_line, logfile) if parsed]
+        except OSError as e:
+            raise CommandError(f"Can't read {options['logfile']}: {e}")
+
+        headers = {'HTTP_HOST': options['host']}
+        if options['token']:
+            headers['HTTP_AUTHORIZATION'] = f"Token {options['token']}"
+        client = Client(**headers)
+
+        shapes = {}
+        replayed = skipped = 0
+        for method, url in requests:
+            # Replaying writes against a real database would be a bad surprise
+            if method not in ('GET', 'HEAD'):
+                skipped += 1
+                continue
+            path = request_path(url)
+            try:
+                endpoint = resolve(path.split('?', 1)[0]).url_name or path
+            except Resolver404:
+                skipped += 1
+                continue
+
+            with CaptureQueriesContext(connection) as captured:
+                client.generic(method, path)
+            replayed += 1
+
+            for query in captured.captured_queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith('SELECT'):
+                    continue
+                shape = query_shape(sql)
+                report = shapes.setdefault(shape, ShapeReport(shape, sql))
+                report.count += 1
+                report.endpoints[endpoint] = True
+
+        for report in shapes.values():
+            try:
+                report.plan = explain(report.example)
+            except Exception as e:
+                report.plan = [f"could not explain: {e}"]
+                continue
+            report.problems = plan_problems(report.plan)
+
+        reports = sorted(shapes.values(), key=lambda report: (not report.problems, -report.count))
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'vendor': connection.vendor,
+                'replayed': replayed,
+                'skipped': skipped,
+                'shapes': [report.as_dict() for report in reports],
+            }, indent=2))
+            return
+
+        self.stdout.write(f"Replayed {replayed} requests ({skipped} skipped), {len(reports)} distinct query shapes.\n")
+        flagged = [report for report in reports if report.problems]
+        for report in reports:
+            if not report.problems and not options['all']:
+                continue
+            style = self.style.WARNING if report.problems else self.style.SUCCESS
+            self.stdout.write(style(f"[{report.count}x] {', '.join(report.endpoints)}"))
+            self.stdout.write(f"  {report.shape}")
+            for step in report.plan:
+                self.stdout.write(f"    {step}")
+            for problem in report.problems:
+                self.stdout.write(self.style.WARNING(f"  ! {problem}"))
+            self.stdout.write('')
+
+        if flagged:
+            self.stdout.write(self.style.WARNING(f"{len(flagged)} query shapes still scan or sort whole tables."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every query shape is served from an index."))
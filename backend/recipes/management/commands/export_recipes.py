@@ -0,0 +1,35 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import bulk
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Export recipes as NDJSON or CSV, streaming them out chunk by chunk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--author', help="Only export this user's recipes.")
+        parser.add_argument('--format', choices=bulk.FORMATS, default='ndjson', help="Output format (default: ndjson).")
+        parser.add_argument('--output', '-o', default='-', help="File to write to (default: stdout).")
+
+    def handle(self, *args, **options):
+        queryset = Recipe.objects.all()
+        if options['author']:
+            if not get_user_model().objects.filter(username=options['author']).exists():
+                raise CommandError(f"No user called {options['author']!r}.")
+            queryset = queryset.filter(author__username=options['author'])
+
+        output = options['output']
+        try:
+            target = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+        except OSError as e:
+            raise CommandError(f"Can't write {output}: {e}")
+        try:
+            for chunk in bulk.export_chunks(queryset, options['format']):
+                target.write(chunk)
+        finally:
+            if target is not sys.stdout:
+                target.close()
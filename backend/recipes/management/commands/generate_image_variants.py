@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from recipes import images
+from recipes.models import ImageBlob, Recipe
+
+
+class Command(BaseCommand):
+    help = "Generate resized image variants for recipes that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Regenerate variants for every recipe with an image.")
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').exclude(image__isnull=True).only('id', 'image', 'image_variants')
+        done = failed = 0
+        for recipe in recipes.iterator():
+            if recipe.image_variants and not options['all']:
+                continue
+            try:
+                if recipe.image_variants:
+                    images.delete_variants(recipe.image_variants)
+                    ImageBlob.objects.filter(name=recipe.image.name).update(variants={})
+                images.generate_variants(recipe.pk, recipe.image.name)
+                done += 1
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f"Recipe {recipe.pk} ({recipe.image.name}): {e}")
+        self.stdout.write(self.style.SUCCESS(f"Generated variants for {done} recipes ({failed} failed)."))
@@ -0,0 +1,39 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import bulk
+
+
+class Command(BaseCommand):
+    help = "Import recipes from an NDJSON or CSV file (or stdin), in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin.")
+        parser.add_argument('--author', required=True, help="Username the recipes will belong to.")
+        parser.add_argument('--format', choices=bulk.FORMATS, help="Input format (default: from the file extension, else ndjson).")
+        parser.add_argument('--batch-size', type=int, default=bulk.DEFAULT_BATCH_SIZE, help="Recipes per batch/transaction.")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            author = User.objects.get(username=options['author'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user called {options['author']!r}.")
+
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        try:
+            source = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        except OSError as e:
+            raise CommandError(f"Can't read {path}: {e}")
+        with source:
+            report = bulk.import_rows(bulk.read_rows(source, fmt), author, batch_size=options['batch_size'])
+
+        for error in report.errors:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        if report.failed > len(report.errors):
+            self.stderr.write(f"... and {report.failed - len(report.errors)} more failed rows")
+        style = self.style.WARNING if report.failed else self.style.SUCCESS
+        self.stdout.write(style(f"Imported {report.created} recipes ({report.failed} rows failed)."))
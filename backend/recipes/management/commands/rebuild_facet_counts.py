@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import facets
+
+
+class Command(BaseCommand):
+    help = "Recount the recipe facet counts (per category, cuisine and difficulty) from the recipes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Only report whether the stored counts are right; fail if they aren't."
+        )
+
+    def handle(self, *args, **options):
+        combinations, wrong = facets.rebuild(dry_run=options['check'])
+        if options['check']:
+            if wrong:
+                raise CommandError(f"{wrong} of the facet counts are wrong; run rebuild_facet_counts to fix them.")
+            self.stdout.write(self.style.SUCCESS("The facet counts are right."))
+            return
+        self.stdout.write(self.style.SUCCESS(f"Counted {combinations} combinations, {wrong} of them were wrong."))
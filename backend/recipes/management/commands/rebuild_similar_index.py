@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import similar
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the similar-recipes index from scratch, word weights included. "
+        "Saves keep it up to date in between; run this now and then (nightly, say)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help="How many recipes to read per query (default: 2000)."
+        )
+
+    def handle(self, *args, **options):
+        if not similar.available():
+            raise CommandError("The similar-recipes index needs NumPy (pip install -r requirements.txt).")
+        total = similar.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} recipes."))
@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from recipes import popularity
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the view and engagement counts the web processes keep in the cache to the "
+        "database, and work out the trending recipes again every TRENDING_REFRESH_SECONDS. "
+        "Runs until stopped; --once does one round and exits (for cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Flush and refresh once, then exit.")
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['once']:
+            self.run_once(refresh=True)
+            return
+        interval = popularity.get_period_seconds()
+        refresh_every = getattr(settings, 'TRENDING_REFRESH_SECONDS', 60)
+        last_refresh = None
+        self.stdout.write(f"Flushing recipe stats every {interval}s, trending every {refresh_every}s.")
+        while True:
+            refresh = last_refresh is None or time.monotonic() - last_refresh >= refresh_every
+            self.run_once(refresh)
+            if refresh:
+                last_refresh = time.monotonic()
+            # Connections go stale between rounds, like they would between requests
+            close_old_connections()
+            time.sleep(interval)
+
+    def run_once(self, refresh):
+        try:
+            updated = popularity.flush()
+            trending = popularity.refresh_trending() if refresh else None
+        except Exception:
+            # A database hiccup shouldn't end the worker; the counts of the periods it
+            # didn't get to are still in the cache for the next round
+            popularity.logger.exception("Flushing recipe stats failed")
+            return
+        if updated or self.verbosity > 1:
+            message = f"Updated the stats of {updated} recipes"
+            if trending is not None:
+                message += f", {trending} trending"
+            self.stdout.write(message + ".")
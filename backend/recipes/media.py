@@ -0,0 +1,308 @@
+"""
+Serving uploaded media (recipe photos and their variants) from MEDIA_ROOT.
+
+Every file is checked against the recipes that use it before anything is sent: a
+photo is there for everybody if any public recipe uses it, and otherwise only for
+the author of one of the recipes that do (by session or API token). Anything else
+under MEDIA_URL - including files no recipe uses - is a 404, and so is a private
+photo for anybody else, so its existence isn't given away either.
+
+An ``<img>`` tag can't send the API token the frontend keeps in localStorage, so
+the recipes an author gets from the API carry signed URLs for the photos of their
+own private recipes (``?expires=...&signature=...``, see sign_url()), which work
+without any credentials until they expire. They stay the same for a while, so
+the browser cache still does its job: every URL signed in one stretch of
+MEDIA_SIGNED_URL_MAX_AGE seconds expires at the same time, between one and two of
+those stretches later. The ETags of those responses move on with the stretch
+too (recipes/views.py), so a 304 never leaves a client holding an expired URL.
+
+How the bytes go out depends on MEDIA_SERVE:
+
+``django`` (the default)
+    Django sends the file itself, through FileResponse. Under a WSGI server with
+    ``wsgi.file_wrapper`` (gunicorn) that's os.sendfile(), so the bytes go from the
+    page cache to the socket without passing through Python, ranges included.
+``x-sendfile``
+    Apache (mod_xsendfile) or lighttpd send it: the response only carries the
+    file's path in an X-Sendfile header.
+``x-accel-redirect``
+    nginx sends it: the response names it under MEDIA_ACCEL_PREFIX, an ``internal``
+    location aliased to MEDIA_ROOT.
+``off``
+    Nothing is served from here, for media kept somewhere that serves itself (S3).
+
+The offloading servers handle ranges themselves; otherwise a single ``Range:
+bytes=...`` is answered with 206 (If-Range respected), and anything fancier with
+the whole file. Every response carries strong validators, and conditional requests
+get their 304 before any file is opened.
+
+Photos and variants stored under their content digest (recipes/images.py) never
+change, so browsers cache public ones for MEDIA_CACHE_MAX_AGE (a year), marked
+``immutable``. Who may see a photo can change, though - its recipe can be made
+private - so shared caches only get to keep it for MEDIA_MUTABLE_MAX_AGE
+(``s-maxage``). Files named the old way, and private photos, are only cached for
+MEDIA_MUTABLE_MAX_AGE, privately in the latter case.
+"""
+import mimetypes
+import os
+import re
+import time
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.http import parse_etags, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from culinary_connect.conditional import is_not_modified, make_etag, set_validators
+from users.authentication import request_user
+from .images import UPLOAD_DIR, VARIANT_DIR
+from .models import Recipe
+
+MODES = ('django', 'x-sendfile', 'x-accel-redirect', 'off')
+
+# recipe_images/3f/<sha256>.jpg, and its variants recipe_images/variants/<sha256>_jpg_640w.webp
+CONTENT_ADDRESSED = re.compile(rf'^{UPLOAD_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{64}}(\.\w+)?$')
+VARIANT = re.compile(rf'^{VARIANT_DIR}/(?P<stem>[^/]+)_\d+w\.\w+$')
+DIGEST_STEM = re.compile(r'^(?P<digest>[0-9a-f]{64})(_\w+)?$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Returned by requested_range() for a range that starts past the end of the file
+UNSATISFIABLE = 'unsatisfiable'
+
+
+def get_mode():
+    mode = getattr(settings, 'MEDIA_SERVE', 'django')
+    return mode if mode in MODES else 'django'
+
+
+def get_signed_url_max_age():
+    return getattr(settings, 'MEDIA_SIGNED_URL_MAX_AGE', 24 * 3600)
+
+
+def signature_expiry(now=None):
+    """When the URLs signed now expire: the end of the stretch after this one."""
+    period = get_signed_url_max_age()
+    now = time.time() if now is None else now
+    return (int(now) // period + 2) * period
+
+
+def signature(name, expires):
+    return signing.Signer(salt='recipes.media').signature(f'{name}:{expires}')
+
+
+def sign_url(url, name, expires=None):
+    """``url``, the URL of the media file ``name``, made good for anybody until ``expires``."""
+    if expires is None:
+        expires = signature_expiry()
+    query = urlencode({'expires': expires, 'signature': signature(name, expires)})
+    return f"{url}{'&' if '?' in url else '?'}{query}"
+
+
+def url_signer(build_url):
+    """Wraps a name -> URL function (serializers.variant_url_builder) to sign what it builds."""
+    def build_signed_url(name):
+        return sign_url(build_url(name), name)
+    return build_signed_url
+
+
+def has_valid_signature(request, name):
+    expires, given = request.GET.get('expires', ''), request.GET.get('signature', '')
+    if not expires.isdigit() or not given or int(expires) < time.time():
+        return False
+    return constant_time_compare(given, signature(name, int(expires)))
+
+
+def signing_user_id(request):
+    """The user whose private photos get signed URLs in the responses to ``request``, if any."""
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def signs_for(request, author_id, is_public):
+    """Do the photos of this recipe go out signed in the response to ``request``?"""
+    return not is_public and author_id is not None and author_id == signing_user_id(request)
+
+
+def source_names(name):
+    """
+    The Recipe.image values whose recipes decide who may see the file ``name``: the
+    file itself for a photo, the photo it was made from for a variant. None for
+    anything else.
+    """
+    if not name.startswith(f'{UPLOAD_DIR}/'):
+        return None
+    match = VARIANT.match(name)
+    if match is None:
+        return None if name.startswith(f'{VARIANT_DIR}/') else [name]
+    # A variant's stem is its photo's file name with the dots turned into underscores
+    stem = match['stem']
+    digest = DIGEST_STEM.match(stem)
+    directory = f"{UPLOAD_DIR}/{digest['digest'][:2]}" if digest else UPLOAD_DIR
+    head, _, extension = stem.rpartition('_')
+    names = [f'{directory}/{stem}']
+    if head:
+        names.append(f'{directory}/{head}.{extension}')
+    return names
+
+
+def is_immutable(name):
+    """Whether ``name`` is derived from its content, so it will never hold anything else."""
+    if CONTENT_ADDRESSED.match(name):
+        return True
+    match = VARIANT.match(name)
+    return bool(match and DIGEST_STEM.match(match['stem']))
+
+
+def file_validators(name, stat):
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), tz=dt_timezone.utc)
+    if is_immutable(name):
+        # The same on every server, whenever the file was written there
+        return make_etag(name), last_modified
+    return make_etag(name, stat.st_size, stat.st_mtime_ns), last_modified
+
+
+def if_range_matches(value, etag, last_modified):
+    """If-Range holds when it names the current ETag (strongly) or exactly the current date."""
+    if value.startswith(('"', 'W/')):
+        return not value.startswith('W/') and etag in parse_etags(value)
+    date = parse_http_date_safe(value)
+    return date is not None and date == int(last_modified.timestamp())
+
+
+def requested_range(request, size, etag, last_modified):
+    """
+    The (first, last) bytes a GET asked for, UNSATISFIABLE, or None to send it all:
+    no Range header, several ranges, or one the If-Range says is out of date.
+    """
+    header = request.META.get('HTTP_RANGE')
+    if not header or request.method != 'GET':
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and not if_range_matches(if_range, etag, last_modified):
+        return None
+    match = RANGE.match(header.replace(' ', ''))
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-500: the last 500 bytes
+        if int(last) == 0:
+            return UNSATISFIABLE
+        return max(0, size - int(last)), size - 1
+    first = int(first)
+    if first >= size:
+        return UNSATISFIABLE
+    last = size - 1 if not last else int(last)
+    if last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+class FileRange:
+    """
+    Part of an open file, for FileResponse. Reads stop at the end of the range; a
+    server that can sendfile() gets the descriptor, already at the range's start,
+    and stops where Content-Length says.
+    """
+
+    def __init__(self, file, first, length):
+        self.file = file
+        self.file.seek(first)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def send_file(request, name, path, stat, etag, last_modified, content_type):
+    mode = get_mode()
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+    if mode == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(name)
+        return response
+
+    byte_range = requested_range(request, stat.st_size, etag, last_modified)
+    if byte_range == UNSATISFIABLE:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        first, last = byte_range
+        response = FileResponse(FileRange(open(path, 'rb'), first, last - first + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {first}-{last}/{stat.st_size}'
+        response['Content-Length'] = str(last - first + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """A file under MEDIA_ROOT, if the recipes using it let this request see it."""
+    name = path.lstrip('/')
+    sources = source_names(name) if get_mode() != 'off' else None
+    if not sources:
+        raise Http404
+    recipes = Recipe.objects.filter(image__in=sources)
+    # Public photos are answered without looking at who's asking, so they don't vary by it
+    public = recipes.filter(is_public=True).exists()
+    if not public and not (has_valid_signature(request, name) and recipes.exists()):
+        user = request_user(request)
+        if user is None or not recipes.filter(author=user).exists():
+            raise Http404
+
+    try:
+        path = default_storage.path(name)
+        stat = os.stat(path)
+    except (NotImplementedError, SuspiciousFileOperation, OSError):
+        raise Http404
+    if not os.path.isfile(path):
+        raise Http404
+
+    etag, last_modified = file_validators(name, stat)
+    if is_not_modified(request, etag, last_modified):
+        response = HttpResponse(status=304)
+    else:
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        response = send_file(request, name, path, stat, etag, last_modified, content_type)
+    set_validators(response, etag, last_modified)
+
+    max_age = getattr(settings, 'MEDIA_MUTABLE_MAX_AGE', 3600)
+    if public and is_immutable(name):
+        # Browsers keep it for good, the bytes can't change. Shared caches (a CDN) only
+        # keep it as long as anything else, so a recipe made private later takes its
+        # photo with it from there too.
+        patch_cache_control(
+            response, public=True, max_age=getattr(settings, 'MEDIA_CACHE_MAX_AGE', 365 * 24 * 3600),
+            s_maxage=max_age, immutable=True
+        )
+    else:
+        if public:
+            patch_cache_control(response, public=True, max_age=max_age)
+        else:
+            patch_cache_control(response, private=True, max_age=max_age)
+            patch_vary_headers(response, ('Cookie', 'Authorization'))
+    return response
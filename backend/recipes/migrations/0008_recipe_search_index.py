@@ -0,0 +1,86 @@
+# Generated by Django 5.1 on 2026-10-18 10:22
+
+import re
+import unicodedata
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# A frozen copy of how recipes/search.py indexed recipes when this migration was
+# written, so changing the live code can't break migrating a fresh database.
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'ingredients': 2.0,
+    'description': 1.0,
+}
+MAX_TERM_LENGTH = 64
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    if not text:
+        return []
+    folded = unicodedata.normalize('NFKD', text)
+    folded = ''.join(ch for ch in folded if not unicodedata.combining(ch)).lower()
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(folded)]
+
+
+def build_postings(recipe):
+    frequencies = Counter()
+    length = 0
+    for field, weight in FIELD_WEIGHTS.items():
+        tokens = tokenize(getattr(recipe, field, '') or '')
+        length += len(tokens)
+        for token in tokens:
+            frequencies[token] += weight
+    return length, frequencies
+
+
+def build_search_index(apps, schema_editor):
+    # Index the recipes we already have, so ?search= keeps working right after the upgrade.
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeSearchDocument = apps.get_model('recipes', 'RecipeSearchDocument')
+    RecipeSearchPosting = apps.get_model('recipes', 'RecipeSearchPosting')
+
+    documents = []
+    postings = []
+    for recipe in Recipe.objects.only('title', 'description', 'ingredients').iterator():
+        length, frequencies = build_postings(recipe)
+        documents.append(RecipeSearchDocument(recipe_id=recipe.pk, length=length))
+        postings.extend(
+            RecipeSearchPosting(term=term, recipe_id=recipe.pk, frequency=frequency)
+            for term, frequency in frequencies.items()
+        )
+    RecipeSearchDocument.objects.bulk_create(documents, batch_size=500)
+    RecipeSearchPosting.objects.bulk_create(postings, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_remove_recipe_image_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSearchDocument',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='recipes.recipe')),
+                ('length', models.PositiveIntegerField(default=0, help_text='Number of indexed tokens')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecipeSearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('frequency', models.FloatField(help_text='Field-weighted term frequency')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_postings', to='recipes.recipe')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('term', 'recipe'), name='unique_search_posting')],
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
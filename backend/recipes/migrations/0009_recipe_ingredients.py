@@ -0,0 +1,56 @@
+# Generated by Django 5.1 on 2026-10-18 10:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_recipe_ingredients(apps, schema_editor):
+    # Parse the ingredient text of every existing recipe into structured rows.
+    from recipes.ingredients import build_recipe_ingredients
+
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+
+    batch = []
+    for recipe in Recipe.objects.only('ingredients').iterator(chunk_size=500):
+        batch.append(recipe)
+        if len(batch) >= 500:
+            RecipeIngredient.objects.bulk_create(build_recipe_ingredients(batch, Ingredient, RecipeIngredient))
+            batch = []
+    RecipeIngredient.objects.bulk_create(build_recipe_ingredients(batch, Ingredient, RecipeIngredient))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ingredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('head', models.CharField(db_index=True, max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecipeIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(default=0)),
+                ('quantity', models.DecimalField(blank=True, decimal_places=3, max_digits=10, null=True)),
+                ('unit', models.CharField(blank=True, max_length=20)),
+                ('raw_text', models.CharField(blank=True, max_length=255)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipe_ingredients', to='recipes.ingredient')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipe_ingredients', to='recipes.recipe')),
+            ],
+            options={
+                'ordering': ['recipe', 'position'],
+                'indexes': [models.Index(fields=['ingredient', 'recipe'], name='recipe_ingr_lookup_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_recipe_ingredients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1 on 2026-10-18 11:16
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_facets(apps, schema_editor):
+    # Count the recipes we already have, so the facet counts are right from the start
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeFacetCount = apps.get_model('recipes', 'RecipeFacetCount')
+    rows = (
+        Recipe.objects.order_by()
+        .values_list('category', 'cuisine', 'difficulty', 'is_public')
+        .annotate(count=Count('id'))
+    )
+    RecipeFacetCount.objects.bulk_create([
+        RecipeFacetCount(category=category, cuisine=cuisine, difficulty=difficulty, is_public=is_public, count=count)
+        for category, cuisine, difficulty, is_public, count in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_image_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=100)),
+                ('cuisine', models.CharField(max_length=100)),
+                ('difficulty', models.CharField(max_length=10)),
+                ('is_public', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'cuisine', 'difficulty', 'is_public'), name='unique_recipe_facet')],
+            },
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
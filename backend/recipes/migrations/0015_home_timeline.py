@@ -0,0 +1,25 @@
+# Generated by Django 5.1 on 2026-10-18 11:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_facet_count'),
+        ('users', '0002_follow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HomeTimeline',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='home_timeline', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('recipe_ids', models.JSONField(blank=True, default=list)),
+                ('pulled_authors', models.JSONField(blank=True, default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
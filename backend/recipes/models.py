@@ -3,6 +3,25 @@ from django.conf import settings
 from django.contrib.auth.models import User
 import os
 
+
+class RecipeQuerySet(models.QuerySet):
+    # The only bits of the author a recipe response ever shows
+    AUTHOR_FIELDS = ('id', 'username')
+
+    def with_author(self):
+        """
+        Fetch the author's username in the same query as the recipes, so serializing
+        a page of recipes doesn't cost one extra user lookup per row. The rest of the
+        author's profile (password hash, bio, ...) stays in the database.
+        """
+        author_model = self.model._meta.get_field('author').related_model
+        deferred = [
+            f'author__{field.attname}' for field in author_model._meta.concrete_fields
+            if field.attname not in self.AUTHOR_FIELDS
+        ]
+        return self.select_related('author').defer(*deferred)
+
+
 class Recipe(models.Model):
     DIFFICULTY_CHOICES = [
         ('easy', 'Easy'),
@@ -30,11 +49,207 @@ class Recipe(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_public = models.BooleanField(default=True)
     image = models.ImageField(upload_to='recipe_images/', blank=True, null=True) 
+    # Resized, metadata-free copies of the image, filled in by the image pipeline (recipes/images.py)
+    image_variants = models.JSONField(default=dict, blank=True)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination walks the feeds in (created_at, id) order
+            models.Index(fields=['created_at', 'id'], name='recipe_created_id_idx'),
+            # ...and a user's public recipes in created_at order
+            models.Index(fields=['author', 'is_public', 'created_at'], name='recipe_author_public_idx'),
+            # "My recipes", newest first
+            models.Index(fields=['author', 'created_at'], name='recipe_author_created_idx'),
+            # Public-only listings (pantry, media access checks)
+            models.Index(fields=['is_public', 'created_at'], name='recipe_public_created_idx'),
+            # The filterset fields, each paired with the default sort
+            models.Index(fields=['category', 'created_at'], name='recipe_category_created_idx'),
+            models.Index(fields=['cuisine', 'created_at'], name='recipe_cuisine_created_idx'),
+            models.Index(fields=['difficulty', 'created_at'], name='recipe_difficulty_created_idx'),
+            # The other two ?ordering= options
+            models.Index(fields=['updated_at', 'id'], name='recipe_updated_id_idx'),
+            models.Index(fields=['title', 'id'], name='recipe_title_id_idx'),
+            # Who uses an image: media access checks and the image pipeline
+            models.Index(fields=['image', 'is_public'], name='recipe_image_public_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember what the row looked like when we loaded it, so the signal handlers
+        # can skip re-indexing when a save didn't touch the fields they care about.
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in self.get_deferred_fields()
+        }
+
+    def field_changed(self, field_name):
+        """Has this field changed since the recipe was loaded (or last saved)?"""
+        loaded_values = getattr(self, '_loaded_values', None)
+        if loaded_values is None or field_name not in loaded_values:
+            return True
+        return getattr(self, field_name) != loaded_values[field_name]
+
     def get_image_url(self):
         if self.image:
             return self.image.url
-        return None
\ No newline at end of file
+        return None
+
+
+# The search index lives right next to the recipes it describes. Each posting says
+# "this term shows up in this recipe, this many (weighted) times", which is all we
+# need to look recipes up by term and rank them BM25-style. See recipes/search.py.
+class RecipeSearchDocument(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_document'
+    )
+    length = models.PositiveIntegerField(default=0, help_text="Number of indexed tokens")
+
+    def __str__(self):
+        return f"Search document for recipe {self.recipe_id}"
+
+
+class RecipeSearchPosting(models.Model):
+    term = models.CharField(max_length=64)
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='search_postings')
+    frequency = models.FloatField(help_text="Field-weighted term frequency")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'recipe'], name='unique_search_posting'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.recipe_id}"
+
+
+# Ingredients, parsed out of the free-text Recipe.ingredients field into something we
+# can actually query. "2 cups chopped onions" becomes quantity=2, unit='cup' and a link
+# to the Ingredient named 'onion'. See recipes/ingredients.py for the parsing rules.
+class Ingredient(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    # The last word of the name ("oil" for "olive oil"), so a pantry search for "oil"
+    # can find every kind of oil without scanning the table.
+    head = models.CharField(max_length=100, db_index=True)
+
+    def __str__(self):
+        return self.name
+
+
+class RecipeIngredient(models.Model):
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='recipe_ingredients')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='recipe_ingredients')
+    position = models.PositiveIntegerField(default=0)
+    quantity = models.DecimalField(max_digits=10, decimal_places=3, null=True, blank=True)
+    unit = models.CharField(max_length=20, blank=True)
+    raw_text = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        ordering = ['recipe', 'position']
+        indexes = [
+            models.Index(fields=['ingredient', 'recipe'], name='recipe_ingr_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return self.raw_text or str(self.ingredient)
+
+
+# One stored image file, named after the SHA-256 of its content. Recipes that upload
+# the same photo share a single blob; ref_count says how many recipes point at it,
+# and the file (plus its variants) only goes away when the last one lets go.
+# See recipes/images.py.
+class ImageBlob(models.Model):
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True, help_text="Storage name of the original file")
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    variants = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+# How many recipes there are for each combination of category, cuisine, difficulty and
+# visibility. Facet counts for the browse pages are sums over this small table rather
+# than a GROUP BY over every recipe; recipes/facets.py keeps it in step as recipes come,
+# change and go, and the rebuild_facet_counts command recounts it from scratch.
+class RecipeFacetCount(models.Model):
+    category = models.CharField(max_length=100)
+    cuisine = models.CharField(max_length=100)
+    difficulty = models.CharField(max_length=10)
+    is_public = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'cuisine', 'difficulty', 'is_public'], name='unique_recipe_facet'),
+        ]
+
+    def __str__(self):
+        return f"{self.category} / {self.cuisine} / {self.difficulty}: {self.count}"
+
+
+# A user's home feed, materialized: the ids of the newest public recipes by the authors they
+# follow, newest first and at most FEED_TIMELINE_LENGTH of them, pushed here as the recipes are
+# posted. Reading a feed is a primary-key lookup of this row and one query for the recipes on
+# the page. Authors with more than FEED_FANOUT_MAX_FOLLOWERS followers aren't pushed; their
+# ids are in pulled_authors instead, and the feed reads their recipes as it goes.
+# See recipes/timelines.py.
+class HomeTimeline(models.Model):
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='home_timeline'
+    )
+    recipe_ids = models.JSONField(default=list, blank=True)
+    pulled_authors = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Home timeline of {self.user_id}"
+
+
+# How often a recipe has been looked at and engaged with, and its popularity score. The
+# counts are added in batches by the stats worker (see recipes/popularity.py), never per
+# request. ``score`` is as of ``scored_at`` and halves every TRENDING_HALF_LIFE_HOURS;
+# ``rank_key`` orders recipes by their score now, which is what trending is the top of.
+class RecipeStats(models.Model):
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    views = models.PositiveBigIntegerField(default=0)
+    engagements = models.PositiveBigIntegerField(default=0)
+    score = models.FloatField(default=0)
+    scored_at = models.DateTimeField(null=True, blank=True)
+    rank_key = models.FloatField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"Stats for recipe {self.recipe_id}"
+
+
+# The trending list as the stats worker last worked it out, in order. Read as it is by
+# /api/recipes/trending/, so nothing gets sorted per request.
+class TrendingRecipe(models.Model):
+    position = models.PositiveIntegerField(primary_key=True)
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, related_name='trending')
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['position']
+
+    def __str__(self):
+        return f"{self.position}. {self.recipe_id}"
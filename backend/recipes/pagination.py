@@ -0,0 +1,189 @@
+"""
+Pagination for the recipe feeds.
+
+Page-number pagination needs a ``COUNT(*)`` for every page and an ``OFFSET`` that
+makes the database walk past every recipe it skips, so the deeper you scroll the
+slower it gets. Keyset (cursor) pagination instead remembers where the last page
+ended - the (created_at, id) of its last recipe - and asks for "the next N recipes
+after that one", which the (created_at, id) index answers directly on every page.
+It also never shows a recipe twice or skips one when new recipes are posted while
+somebody is scrolling.
+
+Clients opt in with ``?pagination=cursor`` and then follow the ``next`` and
+``previous`` links; plain ``?page=`` keeps working exactly as before.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class RecipeKeysetPagination(BasePagination):
+    """
+    Keyset pagination over (created_at, id). Newest first by default, oldest first
+    with ?ordering=created_at.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    ordering_query_param = api_settings.ORDERING_PARAM
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request)
+        return self.set_page(list(queryset[:self.page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request)
+        return self.set_page([recipe async for recipe in queryset[:self.page_size + 1]])
+
+    def get_page_queryset(self, queryset, request):
+        """The recipes after (or before) the cursor, in the order the page is read in."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.descending = self.get_descending(request)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor[2]
+
+        # Walking backwards (the "previous" link) is the same query with the
+        # comparison and sort order flipped; we put the page back in order afterwards.
+        newest_first = self.descending != reverse
+        order = ('-created_at', '-id') if newest_first else ('created_at', 'id')
+        queryset = queryset.order_by(*order)
+        if self.cursor is not None:
+            created_at, pk, _ = self.cursor
+            if newest_first:
+                position = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            else:
+                position = Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            queryset = queryset.filter(position)
+        return queryset
+
+    def set_page(self, results):
+        reverse = self.cursor is not None and self.cursor[2]
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        self.page = results
+        return results
+
+    def get_descending(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, '-created_at')
+        if ordering not in ('created_at', '-created_at'):
+            raise ValidationError({
+                self.ordering_query_param: _('Cursor pagination only supports ordering by created_at.')
+            })
+        return ordering.startswith('-')
+
+    def encode_cursor(self, recipe, reverse):
+        # ``recipe`` may be a Recipe or one of RecipeRowSerializer's rows; both have these
+        raw = f"{recipe.created_at.isoformat()}|{recipe.id}|{int(reverse)}"
+        encoded = base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            created_at, pk, reverse = raw.split('|')
+            return datetime.fromisoformat(created_at), int(pk), bool(int(reverse))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class RecipeFeedPagination(PageNumberPagination):
+    """
+    The usual page-number pagination, unless the client asks for ?pagination=cursor
+    (or follows a cursor link), in which case RecipeKeysetPagination takes over.
+    """
+    mode_query_param = 'pagination'
+    keyset_pagination_class = RecipeKeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.wants_cursor(request):
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() for async views: the count and the page are awaited."""
+        self.keyset = None
+        if self.wants_cursor(request):
+            self.keyset = self.keyset_pagination_class()
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator counts lazily (and synchronously); count up front instead
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = [recipe async for recipe in self.page.object_list]
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return list(self.page)
+
+    def wants_cursor(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.keyset_pagination_class.cursor_query_param in request.query_params
+        )
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,254 @@
+"""
+Popularity: how often recipes are looked at and engaged with, and what's trending.
+
+A counter column bumped on every recipe page view would turn the busiest reads into
+writes on the same few rows - and on SQLite, into a lock on the whole database. So
+views and engagements are counted in a cache (``RECIPE_STATS_CACHE``) instead, and
+written to the database in batches by a periodic worker (``manage.py
+recipe_stats_worker``).
+
+Counts are kept per period of RECIPE_STATS_FLUSH_SECONDS: a counter per (period,
+kind, recipe), and, the first time a recipe is counted in a period, a numbered slot
+recording that it was, so the worker can find every counter without scanning the
+cache. Counting a view is one ``incr`` once the counter exists. The worker only flushes
+periods that have ended, which nobody writes to anymore, so it can read and delete
+their keys without losing counts to a race. The cache has to be shared by the web
+processes and the worker (Redis or memcached): a local-memory cache is per process,
+and the worker would never see what the web processes counted.
+
+Flushing adds the counts to each recipe's RecipeStats row, including its score: views
+count 1 and engagements TRENDING_ENGAGEMENT_WEIGHT, decaying by half every
+TRENDING_HALF_LIFE_HOURS. A row's ``rank_key`` is log2(score) plus the time it was
+scored in half-lives, which orders rows by how big their score is now without touching
+the rows that haven't changed since; trending is the top of that index. The worker
+materializes it into TrendingRecipe every TRENDING_REFRESH_SECONDS, and
+/api/recipes/trending/ reads it from there.
+"""
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from culinary_connect.caching import cache_call
+from . import response_cache
+from .models import Recipe, RecipeStats, TrendingRecipe
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'recipes:stats'
+FLUSHED_KEY = f'{KEY_PREFIX}:flushed'
+KINDS = ('view', 'engagement')
+# What people can say they did with a recipe, all counted as engagements
+ENGAGEMENTS = ('save', 'share', 'cook')
+# Periods the worker looks back over when it doesn't know where it stopped
+BACKLOG_PERIODS = 360
+# Counts the worker never gets to (it isn't running) go away on their own
+KEY_TIMEOUT = 24 * 60 * 60
+BATCH_SIZE = 500
+TRENDING_SCOPE = 'trending'
+
+
+def get_cache():
+    return caches[getattr(settings, 'RECIPE_STATS_CACHE', 'default')]
+
+
+def get_period_seconds():
+    return max(1, getattr(settings, 'RECIPE_STATS_FLUSH_SECONDS', 10))
+
+
+def get_half_life():
+    return getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24) * 3600
+
+
+def current_period(now=None):
+    return int((time.time() if now is None else now) // get_period_seconds())
+
+
+def counter_key(period, kind, recipe_id):
+    return f'{KEY_PREFIX}:{period}:{kind}:{recipe_id}'
+
+
+def slots_key(period):
+    return f'{KEY_PREFIX}:{period}:slots'
+
+
+def slot_key(period, number):
+    return f'{KEY_PREFIX}:{period}:slot:{number}'
+
+
+# --- Counting --------------------------------------------------------------------------
+
+def record(recipe_id, kind='view'):
+    """
+    Count one view (or engagement) of a recipe. A handful of cache operations, no queries.
+    Never raises: counting is bookkeeping, and a cache that's down mustn't turn the read
+    being counted into an error. The count is lost and logged instead.
+    """
+    try:
+        _count(recipe_id, kind)
+    except Exception:
+        logger.exception("Couldn't count a %s of recipe %s", kind, recipe_id)
+
+
+async def arecord(recipe_id, kind='view'):
+    try:
+        await _acount(recipe_id, kind)
+    except Exception:
+        logger.exception("Couldn't count a %s of recipe %s", kind, recipe_id)
+
+
+def _count(recipe_id, kind):
+    cache = get_cache()
+    period = current_period()
+    key = counter_key(period, kind, recipe_id)
+    try:
+        cache.incr(key)
+        return
+    except ValueError:
+        pass
+    if cache.add(key, 1, KEY_TIMEOUT):
+        cache.add(slots_key(period), 0, KEY_TIMEOUT)
+        cache.set(slot_key(period, cache.incr(slots_key(period))), (kind, int(recipe_id)), KEY_TIMEOUT)
+    else:
+        # Somebody else added it in between
+        cache.incr(key)
+
+
+async def _acount(recipe_id, kind):
+    cache = get_cache()
+    period = current_period()
+    key = counter_key(period, kind, recipe_id)
+    try:
+        await cache_call(cache, 'incr', key)
+        return
+    except ValueError:
+        pass
+    if await cache_call(cache, 'add', key, 1, KEY_TIMEOUT):
+        await cache_call(cache, 'add', slots_key(period), 0, KEY_TIMEOUT)
+        number = await cache_call(cache, 'incr', slots_key(period))
+        await cache_call(cache, 'set', slot_key(period, number), (kind, int(recipe_id)), KEY_TIMEOUT)
+    else:
+        await cache_call(cache, 'incr', key)
+
+
+def record_engagement(user_id, recipe_id, kind):
+    """
+    Count an engagement, unless this user already reported the same one with this recipe
+    in the last ENGAGEMENT_REPEAT_SECONDS: cooking something five times in a row shouldn't
+    put it five times further up the trending list. Returns whether it was counted.
+    """
+    seen = f'{KEY_PREFIX}:engaged:{user_id}:{recipe_id}:{kind}'
+    if not get_cache().add(seen, 1, getattr(settings, 'ENGAGEMENT_REPEAT_SECONDS', KEY_TIMEOUT)):
+        return False
+    record(recipe_id, 'engagement')
+    return True
+
+
+# --- Flushing --------------------------------------------------------------------------
+
+def collect(until=None):
+    """
+    The counts of every period that has ended and hasn't been flushed yet: ({recipe id:
+    {kind: count}}, the keys they came from, the last period). The period before the
+    current one is left alone too, for web processes whose clocks are a little behind.
+    """
+    cache = get_cache()
+    last = current_period(until) - 2
+    first = cache.get(FLUSHED_KEY)
+    first = last - BACKLOG_PERIODS if first is None else max(first + 1, last - BACKLOG_PERIODS)
+    periods = range(first, last + 1)
+    counts, keys = {}, []
+    if not periods:
+        return counts, keys, last
+
+    sizes = cache.get_many([slots_key(period) for period in periods])
+    for period in periods:
+        size = sizes.get(slots_key(period), 0)
+        if not size:
+            continue
+        slots = cache.get_many([slot_key(period, number) for number in range(1, size + 1)])
+        counters = [counter_key(period, kind, recipe_id) for kind, recipe_id in slots.values()]
+        values = cache.get_many(counters)
+        for kind, recipe_id in slots.values():
+            count = values.get(counter_key(period, kind, recipe_id), 0)
+            if count:
+                per_recipe = counts.setdefault(recipe_id, dict.fromkeys(KINDS, 0))
+                per_recipe[kind] += count
+        keys.extend([slots_key(period), *slots, *counters])
+    return counts, keys, last
+
+
+def decayed(score, scored_at, now):
+    """``score`` as it was at ``scored_at``, decayed to ``now``."""
+    if not score or scored_at is None:
+        return 0.0
+    return score * 2 ** (-(now - scored_at).total_seconds() / get_half_life())
+
+
+def rank_key(score, at):
+    # log2(score * 2^(t / half-life)): sorts rows by their score decayed to any one moment
+    return math.log2(score) + at.timestamp() / get_half_life() if score > 0 else None
+
+
+def apply_counts(counts, now=None):
+    """Add {recipe id: {kind: count}} to the recipes' stats, in batches. Returns the recipes updated."""
+    now = now or timezone.now()
+    weight = getattr(settings, 'TRENDING_ENGAGEMENT_WEIGHT', 5)
+    recipe_ids = sorted(counts)
+    updated = 0
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        chunk = recipe_ids[start:start + BATCH_SIZE]
+        with transaction.atomic():
+            stats = {row.recipe_id: row for row in RecipeStats.objects.select_for_update().filter(recipe_id__in=chunk)}
+            # Counts for recipes deleted since are dropped here
+            new = Recipe.objects.filter(pk__in=set(chunk) - set(stats)).values_list('pk', flat=True)
+            created = [RecipeStats(recipe_id=recipe_id) for recipe_id in new]
+            for row in [*stats.values(), *created]:
+                added = counts[row.recipe_id]
+                row.views += added['view']
+                row.engagements += added['engagement']
+                row.score = decayed(row.score, row.scored_at, now) + added['view'] + weight * added['engagement']
+                row.scored_at = now
+                row.rank_key = rank_key(row.score, now)
+            RecipeStats.objects.bulk_update(list(stats.values()), ['views', 'engagements', 'score', 'scored_at', 'rank_key'])
+            RecipeStats.objects.bulk_create(created)
+        updated += len(stats) + len(created)
+    return updated
+
+
+def flush(until=None):
+    """
+    Move the counts of the finished periods from the cache to the database. They're only
+    taken out of the cache once they're saved, so if saving fails the next flush has them
+    (and counts again the batches that did make it before the failure).
+    """
+    counts, keys, last = collect(until)
+    updated = apply_counts(counts)
+    cache = get_cache()
+    cache.delete_many(keys)
+    cache.set(FLUSHED_KEY, last, None)
+    return updated
+
+
+# --- Trending --------------------------------------------------------------------------
+
+def refresh_trending(now=None):
+    """Work out the top TRENDING_SIZE public recipes by decayed score, and save them as the trending list."""
+    now = now or timezone.now()
+    size = getattr(settings, 'TRENDING_SIZE', 50)
+    top = list(
+        RecipeStats.objects.filter(recipe__is_public=True, rank_key__isnull=False)
+        .order_by('-rank_key').values_list('recipe_id', 'score', 'scored_at')[:size]
+    )
+    with transaction.atomic():
+        TrendingRecipe.objects.all().delete()
+        TrendingRecipe.objects.bulk_create([
+            TrendingRecipe(position=position, recipe_id=recipe_id, score=decayed(score, scored_at, now))
+            for position, (recipe_id, score, scored_at) in enumerate(top, start=1)
+        ])
+    response_cache.invalidate(TRENDING_SCOPE)
+    return len(top)
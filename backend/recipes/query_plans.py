@@ -0,0 +1,119 @@
+"""
+Helpers for checking which queries the API runs and how the database executes them.
+
+The ``explain_requests`` management command replays a request log through the
+views, captures every query they run, and asks the database for its plan.
+Queries that differ only in their literal values are grouped into one "shape",
+so a thousand ``?category=...`` requests show up as a single line.
+"""
+import re
+import shlex
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from django.db import connection
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN \((?:\s*\?\s*,?)+\)')
+_SPACE_RE = re.compile(r'\s+')
+_REQUEST_RE = re.compile(r'"?\b(GET|HEAD|POST|PUT|PATCH|DELETE|OPTIONS)\s+(\S+)')
+# "SCAN recipes_recipe", "SCAN TABLE recipes_recipe AS U0", "SCAN U0 USING INDEX ...";
+# not "SCAN (subquery-1)" or "SCAN CONSTANT ROW", which read no table
+_SQLITE_SCAN_RE = re.compile(r'^\s*SCAN (?:TABLE )?(?!\(|CONSTANT ROW)(\S+)(.*)$')
+
+
+def parse_log_line(line):
+    """
+    Pull (method, path) out of a log line. Understands plain "GET /api/recipes/"
+    lines, bare paths, and access-log lines like nginx/gunicorn write
+    (... "GET /api/recipes/?page=2 HTTP/1.1" 200 ...).
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    match = _REQUEST_RE.search(line)
+    if match:
+        return match.group(1), match.group(2)
+    try:
+        first = shlex.split(line)[0] if line[0] in '"\'' else line.split()[0]
+    except (ValueError, IndexError):
+        # Unbalanced quotes: not a line we can make sense of, but the rest of the log may be
+        return None
+    if first.startswith(('/', 'http://', 'https://')):
+        return 'GET', first
+    return None
+
+
+def request_path(url):
+    parts = urlsplit(url)
+    return parts.path + (f'?{parts.query}' if parts.query else '')
+
+
+def query_shape(sql):
+    """Replace literal values with placeholders, so similar queries group together."""
+    shape = _STRING_RE.sub('?', sql)
+    shape = _NUMBER_RE.sub('?', shape)
+    shape = _IN_LIST_RE.sub('IN (...)', shape)
+    return _SPACE_RE.sub(' ', shape).strip()
+
+
+def explain(sql, using=connection):
+    """Ask the database how it would run a query. Returns the plan as a list of lines."""
+    with using.cursor() as cursor:
+        cursor.execute(f'{using.ops.explain_query_prefix()} {sql}')
+        rows = cursor.fetchall()
+    if using.vendor == 'sqlite':
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [' '.join(str(column) for column in row) for row in rows]
+
+
+def plan_problems(plan, using=connection):
+    """
+    Find the steps in a plan that read a whole table or sort rows on the fly.
+    Scanning an index in order is fine - that's exactly what the indexes are for -
+    and so is scanning the output of a subquery, which isn't a table at all. SQLite
+    names a table by its alias when the query gives it one (``SCAN U0`` in a
+    subquery), so any other scan it reports counts.
+    """
+    tables = set(using.introspection.table_names())
+    problems = []
+    for step in plan:
+        if using.vendor == 'sqlite':
+            match = _SQLITE_SCAN_RE.match(step)
+            if match and not re.search(r'\bUSING\b.*\bINDEX\b', match.group(2)):
+                problems.append(f'full scan: {step.strip()}')
+            elif 'USE TEMP B-TREE' in step:
+                problems.append(f'sort: {step.strip()}')
+        elif using.vendor == 'postgresql':
+            match = re.search(r'Seq Scan on (\S+)', step)
+            if match and match.group(1) in tables:
+                problems.append(f'full scan: {step.strip()}')
+            elif re.search(r'->\s+Sort\b|^\s*Sort\b', step):
+                problems.append(f'sort: {step.strip()}')
+        elif re.search(r'\b(full|seq(uential)?)\s+scan\b', step, re.IGNORECASE):
+            problems.append(f'full scan: {step.strip()}')
+    return problems
+
+
+class ShapeReport:
+    """Everything we learned about one query shape."""
+
+    def __init__(self, shape, example):
+        self.shape = shape
+        self.example = example
+        self.count = 0
+        self.endpoints = OrderedDict()
+        self.plan = None
+        self.problems = []
+
+    def as_dict(self):
+        return {
+            'shape': self.shape,
+            'example': self.example,
+            'count': self.count,
+            'endpoints': list(self.endpoints),
+            'plan': self.plan,
+            'problems': self.problems,
+        }
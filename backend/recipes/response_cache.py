@@ -0,0 +1,175 @@
+"""
+Response caching for the public recipe endpoints.
+
+Anonymous visitors all see the same recipe list, the same recipe pages and the same
+public cookbooks, so there's no reason to query and serialize them again on every
+hit. We keep the serialized response data in the ``recipes`` cache (local memory,
+files or Redis - whatever ``RECIPE_CACHE_URL`` points at, see settings.py).
+
+Invalidation works through versions rather than by hunting down keys. Every cache
+key embeds a version token for what it depends on:
+
+* ``all``            - any recipe list; changes whenever any recipe changes
+* ``recipe:<pk>``    - one recipe page
+* ``user:<username>`` - one author's public recipes
+* ``trending``       - the trending list; changes when it's worked out again
+
+Saving or deleting a recipe (or renaming its author) just replaces the relevant
+tokens, and the old entries are never looked up again; the cache's own size limit
+evicts them in time. Version tokens are random rather than counters, so a token
+that gets evicted can never come back and resurrect stale entries.
+
+Hits, misses, stores and invalidations are counted in the ``/metrics`` registry
+(``recipe_response_cache_events_total``), so the hit rate can be graphed.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from culinary_connect.caching import cache_call
+from monitoring import metrics
+
+CACHE_ALIAS = 'recipes'
+KEY_PREFIX = 'recipes:response'
+VERSION_PREFIX = 'recipes:version'
+
+# Exported at /metrics, like the request metrics (monitoring/middleware.py)
+cache_events = metrics.counter(
+    'recipe_response_cache_events_total',
+    'Anonymous response cache lookups (hit, miss), stores and invalidated scopes.', ('event',))
+EVENTS = {'hits': 'hit', 'misses': 'miss', 'stores': 'store', 'invalidations': 'invalidation'}
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def is_enabled():
+    return getattr(settings, 'RECIPE_RESPONSE_CACHE_ENABLED', True)
+
+
+def _count(stat, amount=1):
+    cache_events.inc(amount, event=EVENTS[stat])
+
+
+def stats():
+    """Hit/miss counters for this process, plus the hit rate."""
+    snapshot = {stat: cache_events.get(event=event) for stat, event in EVENTS.items()}
+    lookups = snapshot['hits'] + snapshot['misses']
+    snapshot['hit_rate'] = snapshot['hits'] / lookups if lookups else 0.0
+    return snapshot
+
+
+def reset_stats():
+    cache_events.clear()
+
+
+def recipe_scope(pk):
+    return f'recipe:{pk}'
+
+
+def user_scope(username):
+    return f'user:{username}'
+
+
+def get_versions(scopes):
+    """Current version token of each scope, creating tokens for scopes we haven't seen."""
+    cache = get_cache()
+    keys = [f'{VERSION_PREFIX}:{scope}' for scope in scopes]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        version = found.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            # add() rather than set(), so we don't clobber a token another worker just created
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+        versions.append(version)
+    return versions
+
+
+async def aget_versions(scopes):
+    cache = get_cache()
+    keys = [f'{VERSION_PREFIX}:{scope}' for scope in scopes]
+    found = await cache_call(cache, 'get_many', keys)
+    versions = []
+    for key in keys:
+        version = found.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not await cache_call(cache, 'add', key, version, timeout=None):
+                version = await cache_call(cache, 'get', key, version)
+        versions.append(version)
+    return versions
+
+
+def invalidate(*scopes):
+    """Give the scopes new version tokens, orphaning everything cached under the old ones."""
+    if not scopes:
+        return
+    get_cache().set_many({f'{VERSION_PREFIX}:{scope}': uuid.uuid4().hex for scope in scopes}, timeout=None)
+    _count('invalidations', len(scopes))
+
+
+def invalidate_recipe(recipe_id, author_username=None):
+    scopes = ['all', recipe_scope(recipe_id)]
+    if author_username:
+        scopes.append(user_scope(author_username))
+    invalidate(*scopes)
+
+
+def normalized_params(request):
+    """The query string in a canonical form: sorted, blanks dropped, repeats kept in order."""
+    params = []
+    for key in sorted(request.query_params):
+        values = [value for value in request.query_params.getlist(key) if value != '']
+        if values:
+            params.append((key, values))
+    return params
+
+
+def response_key(request, scopes):
+    return _response_key(request, get_versions(scopes))
+
+
+async def aresponse_key(request, scopes):
+    return _response_key(request, await aget_versions(scopes))
+
+
+def _response_key(request, versions):
+    # Responses contain absolute URLs (pagination links, images), so the host is part of the key
+    raw = repr((request.scheme, request.get_host(), request.path, normalized_params(request), versions))
+    return f'{KEY_PREFIX}:{hashlib.sha256(raw.encode()).hexdigest()}'
+
+
+def should_cache(request):
+    return (
+        is_enabled()
+        and request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+    )
+
+
+def get(key):
+    data = get_cache().get(key)
+    _count('misses' if data is None else 'hits')
+    return data
+
+
+async def aget(key):
+    data = await cache_call(get_cache(), 'get', key)
+    _count('misses' if data is None else 'hits')
+    return data
+
+
+def store(key, data):
+    get_cache().set(key, data)
+    _count('stores')
+
+
+async def astore(key, data):
+    await cache_call(get_cache(), 'set', key, data)
+    _count('stores')
@@ -0,0 +1,261 @@
+"""
+Full-text search for recipes.
+
+Instead of asking the database for ``LIKE '%term%'`` over three big text columns
+(which means reading every recipe on every search), we keep a small inverted index:
+one posting per (term, recipe) pair, plus the token count of every recipe.
+Looking a term up is then an index range scan on ``RecipeSearchPosting.term``, and
+the postings carry everything needed to rank the matches with BM25.
+
+Only the RECIPE_SEARCH_MAX_RESULTS (1000) best matches come back. The list views
+page over, and count, those; a search matching more than that is meant to be
+narrowed down, not paged to the end, and ranking and ordering by an id list of
+every match would cost more the broader the term.
+
+The index is kept up to date by the ``Recipe`` signals in ``recipes/signals.py``
+and can be rebuilt from scratch with ``python manage.py rebuild_search_index``.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, Q
+
+from culinary_connect.caching import cache_call
+
+from .models import Recipe, RecipeSearchDocument, RecipeSearchPosting
+
+# Which recipe fields go into the index, and how much a hit in each one is worth.
+# A match in the title says a lot more about a recipe than one buried in the description.
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'ingredients': 2.0,
+    'description': 1.0,
+}
+
+# Classic BM25 tuning knobs.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# A term that only matches as a prefix ("chick" -> "chicken") counts for less than
+# a term that matches exactly.
+PREFIX_MATCH_WEIGHT = 0.5
+
+# Shorter terms only match whole words: "a" as a prefix is half the index, and every
+# one of those postings would be loaded before the result cap gets a say.
+MIN_PREFIX_LENGTH = 3
+
+MAX_TERM_LENGTH = 64
+CORPUS_STATS_CACHE_KEY = 'recipes:search:corpus-stats'
+CORPUS_STATS_TIMEOUT = 60
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def get_max_results():
+    return getattr(settings, 'RECIPE_SEARCH_MAX_RESULTS', 1000)
+
+
+def tokenize(text):
+    """
+    Split text into lowercase, accent-free alphanumeric tokens.
+    "Crème Brûlée (6 servings)" -> ['creme', 'brulee', '6', 'servings']
+    """
+    if not text:
+        return []
+    folded = unicodedata.normalize('NFKD', text)
+    folded = ''.join(ch for ch in folded if not unicodedata.combining(ch)).lower()
+    return [token[:MAX_TERM_LENGTH] for token in _TOKEN_RE.findall(folded)]
+
+
+def build_postings(recipe):
+    """
+    Work out what the index should hold for a recipe.
+    Returns the document length and a Counter of term -> weighted frequency.
+    """
+    frequencies = Counter()
+    length = 0
+    for field, weight in FIELD_WEIGHTS.items():
+        tokens = tokenize(getattr(recipe, field, '') or '')
+        length += len(tokens)
+        for token in tokens:
+            frequencies[token] += weight
+    return length, frequencies
+
+
+def _posting_objects(recipe, frequencies, posting_model=RecipeSearchPosting):
+    return [
+        posting_model(term=term, recipe_id=recipe.pk, frequency=frequency)
+        for term, frequency in frequencies.items()
+    ]
+
+
+def index_recipe(recipe):
+    """(Re)index a single recipe, replacing whatever postings it had before."""
+    index_recipes([recipe])
+
+
+def index_recipes(recipes):
+    """Index a batch of recipes with a handful of bulk queries."""
+    recipes = list(recipes)
+    if not recipes:
+        return
+    documents = []
+    postings = []
+    for recipe in recipes:
+        length, frequencies = build_postings(recipe)
+        documents.append(RecipeSearchDocument(recipe_id=recipe.pk, length=length))
+        postings.extend(_posting_objects(recipe, frequencies))
+    ids = [recipe.pk for recipe in recipes]
+    with transaction.atomic():
+        RecipeSearchPosting.objects.filter(recipe_id__in=ids).delete()
+        RecipeSearchDocument.objects.filter(recipe_id__in=ids).delete()
+        RecipeSearchDocument.objects.bulk_create(documents)
+        RecipeSearchPosting.objects.bulk_create(postings, batch_size=1000)
+    cache.delete(CORPUS_STATS_CACHE_KEY)
+
+
+def rebuild_index(batch_size=500):
+    """Throw the whole index away and build it again from the Recipe table."""
+    with transaction.atomic():
+        RecipeSearchPosting.objects.all().delete()
+        RecipeSearchDocument.objects.all().delete()
+        batch = []
+        total = 0
+        recipes = Recipe.objects.only(*FIELD_WEIGHTS).iterator(chunk_size=batch_size)
+        for recipe in recipes:
+            batch.append(recipe)
+            if len(batch) >= batch_size:
+                index_recipes(batch)
+                total += len(batch)
+                batch = []
+        index_recipes(batch)
+        total += len(batch)
+    return total
+
+
+def get_corpus_stats():
+    """
+    Number of indexed recipes and their average length. BM25 only needs ballpark
+    figures here, so we keep them in the cache for a little while instead of
+    aggregating over the whole document table on every search.
+    """
+    stats = cache.get(CORPUS_STATS_CACHE_KEY)
+    if stats is None:
+        stats = _corpus_stats(RecipeSearchDocument.objects.aggregate(count=Count('pk'), average=Avg('length')))
+        cache.set(CORPUS_STATS_CACHE_KEY, stats, CORPUS_STATS_TIMEOUT)
+    return stats
+
+
+async def aget_corpus_stats():
+    stats = await cache_call(cache, 'get', CORPUS_STATS_CACHE_KEY)
+    if stats is None:
+        stats = _corpus_stats(await RecipeSearchDocument.objects.aaggregate(count=Count('pk'), average=Avg('length')))
+        await cache_call(cache, 'set', CORPUS_STATS_CACHE_KEY, stats, CORPUS_STATS_TIMEOUT)
+    return stats
+
+
+def _corpus_stats(aggregate):
+    return aggregate['count'] or 0, aggregate['average'] or 0.0
+
+
+def _prefix_filter(terms):
+    # "term >= 'chick' AND term < 'chick\uffff'" is a range the term index can answer
+    # directly, unlike LIKE 'chick%' which SQLite won't use an index for by default.
+    condition = Q()
+    for term in terms:
+        if is_prefix(term):
+            condition |= Q(term__gte=term, term__lt=term + '\uffff')
+        else:
+            condition |= Q(term=term)
+    return condition
+
+
+def is_prefix(term):
+    return len(term) >= MIN_PREFIX_LENGTH
+
+
+def _query_terms(query):
+    return list(dict.fromkeys(tokenize(query)))
+
+
+def _matching_postings(terms, queryset):
+    postings = RecipeSearchPosting.objects.filter(_prefix_filter(terms))
+    if queryset is not None:
+        postings = postings.filter(recipe__in=queryset.values('pk'))
+    return postings.values_list('term', 'recipe_id', 'frequency', 'recipe__search_document__length')
+
+
+def _document_frequencies(matched_terms):
+    return (
+        RecipeSearchPosting.objects.filter(term__in=matched_terms)
+        .values_list('term')
+        .annotate(count=Count('pk'))
+        .values_list('term', 'count')
+    )
+
+
+def search(query, queryset=None, limit=None):
+    """
+    Rank recipes against a free-text query.
+
+    Every query term has to match (as a whole word or a word prefix) somewhere in the
+    title, ingredients or description, just like DRF's SearchFilter. Only recipes in
+    ``queryset`` are considered. Returns a list of (recipe_id, score), best first.
+    """
+    terms = _query_terms(query)
+    if not terms:
+        return []
+
+    rows = list(_matching_postings(terms, queryset))
+    if not rows:
+        return []
+    document_frequencies = dict(_document_frequencies({row[0] for row in rows}))
+    return _rank(terms, rows, document_frequencies, get_corpus_stats(), limit)
+
+
+async def asearch(query, queryset=None, limit=None):
+    """search(), for async views."""
+    terms = _query_terms(query)
+    if not terms:
+        return []
+
+    rows = [row async for row in _matching_postings(terms, queryset)]
+    if not rows:
+        return []
+    document_frequencies = {term: count async for term, count in _document_frequencies({row[0] for row in rows})}
+    return _rank(terms, rows, document_frequencies, await aget_corpus_stats(), limit)
+
+
+def _rank(terms, rows, document_frequencies, corpus_stats, limit):
+    if limit is None:
+        limit = get_max_results()
+    document_count, average_length = corpus_stats
+    document_count = max(document_count, 1)
+    average_length = average_length or 1.0
+
+    scores = defaultdict(float)
+    matched = defaultdict(set)
+    for term, recipe_id, frequency, length in rows:
+        df = document_frequencies.get(term, 1)
+        idf = math.log(1 + (document_count - df + 0.5) / (df + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * (length or 0) / average_length)
+        term_score = idf * (frequency * (BM25_K1 + 1)) / (frequency + norm)
+        for index, query_term in enumerate(terms):
+            if term == query_term:
+                scores[recipe_id] += term_score
+                matched[recipe_id].add(index)
+            elif is_prefix(query_term) and term.startswith(query_term):
+                scores[recipe_id] += term_score * PREFIX_MATCH_WEIGHT
+                matched[recipe_id].add(index)
+
+    results = [
+        (recipe_id, score) for recipe_id, score in scores.items()
+        if len(matched[recipe_id]) == len(terms)
+    ]
+    results.sort(key=lambda item: (-item[1], -item[0]))
+    return results[:limit]
@@ -1,7 +1,34 @@
-from rest_framework import serializers
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from rest_framework import ISO_8601, serializers
+from rest_framework.fields import empty
+from rest_framework.settings import api_settings
+from monitoring.instrumentation import TimedListSerializer, TimedSerializerMixin, timed
 from .models import Recipe
+from . import fieldsets, images, media
 
-class RecipeSerializer(serializers.ModelSerializer):
+
+def variant_url_builder(request):
+    """Turns the storage name of an image variant into the URL a client can fetch."""
+    def build_url(name):
+        url = default_storage.url(name)
+        return request.build_absolute_uri(url) if request else url
+    return build_url
+
+
+class SparseFieldsMixin:
+    """
+    Pass fields=[...] to include only those of the serializer's fields; the views
+    work out which from ?fields= and ?omit= (see recipes/fieldsets.py).
+    """
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class RecipeSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """
     This serializer is like a master chef that knows how to present our Recipe model
     in a way that's easy for our API to serve up and for others to consume.
@@ -14,15 +41,38 @@ class RecipeSerializer(serializers.ModelSerializer):
     # The image field is optional. It's like the garnish on a plate - nice to have, but not required.
     image = serializers.ImageField(required=False, allow_null=True)
 
+    # Smaller versions of the image as ready-to-use srcset strings, plus a thumbnail URL.
+    # List pages can show these instead of pulling down the full-size photo.
+    image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
         # Here's our menu of fields. We're including everything from the recipe's ID to its image.
         fields = ['id', 'title', 'description', 'ingredients', 'instructions', 
                   'preparation_time', 'cooking_time', 'servings', 'difficulty', 
-                  'category', 'cuisine', 'author', 'created_at', 'updated_at', 'image']
+                  'category', 'cuisine', 'author', 'created_at', 'updated_at', 'image',
+                  'image_variants']
         # These fields are for display only - like the date on a wine bottle, you can see it but not change it.
         read_only_fields = ['author', 'created_at', 'updated_at']
+        # Times .data for lists of recipes too (see monitoring/instrumentation.py)
+        list_serializer_class = TimedListSerializer
     
+    def signs_media(self, obj):
+        # The author gets signed URLs for the photos of their private recipes (recipes/media.py)
+        return media.signs_for(self.context.get('request'), obj.author_id, obj.is_public)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if data.get('image') and self.signs_media(instance):
+            data['image'] = media.sign_url(data['image'], instance.image.name)
+        return data
+
+    def get_image_variants(self, obj):
+        build_url = variant_url_builder(self.context.get('request'))
+        if self.signs_media(obj):
+            build_url = media.url_signer(build_url)
+        return images.build_srcsets(obj.image_variants, build_url)
+
     def get_image_url(self, obj):
         """
         This method is like a helpful waiter who brings you a photo of the dish if it's available.
@@ -49,6 +99,193 @@ class RecipeSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
+class PantryRecipeSerializer(RecipeSerializer):
+    """
+    A recipe, plus how well it fits what's in your pantry. The extra numbers come
+    from annotations added by ingredients.pantry_recipes, so no extra queries here.
+    """
+    matched_ingredients = serializers.IntegerField(read_only=True)
+    total_ingredients = serializers.IntegerField(read_only=True)
+    coverage = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ['matched_ingredients', 'total_ingredients', 'coverage']
+
+class SimilarRecipeSerializer(RecipeSerializer):
+    """A recipe, plus how similar it is to the one asked about (recipes/similar.py), from 0 to 1."""
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ['similarity']
+
+class RecipeImportSerializer(RecipeSerializer):
+    """
+    Validates the rows of a bulk import (see recipes/bulk.py). Imports can also say
+    whether a recipe is public, which the regular create endpoint leaves at the default.
+    """
+    is_public = serializers.BooleanField(required=False, default=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ['is_public']
+
+class RecipeRowSerializer:
+    """
+    RecipeSerializer's output for a list page, without building a Recipe and walking
+    sixteen serializer fields for every row. The recipes come out of the database as
+    plain tuples (see rows()), and a plan worked out once from RecipeSerializer's own
+    fields says what each column needs: most need nothing at all, dates go through the
+    serializer's DateTimeField, and image names become URLs straight from the storage
+    instead of through a FieldFile per row. The result is the same, byte for byte.
+
+    Like RecipeSerializer, it takes fields=[...] for a sparse fieldset; pass the same
+    to rows() and only those columns are read.
+
+    Read-only: writes, and single recipes, still go through RecipeSerializer.
+    """
+    serializer_class = RecipeSerializer
+    # Fields whose to_representation() hands back what the database already gave us
+    passthrough_fields = (
+        serializers.CharField, serializers.IntegerField, serializers.ChoiceField,
+        serializers.BooleanField, serializers.ReadOnlyField,
+    )
+
+    # Keyset pagination builds its cursors from these, and the list views their ETags,
+    # asked for or not
+    key_columns = ('id', 'created_at', 'updated_at')
+    # ...and whether a photo's URLs have to be signed (see RecipeSerializer.signs_media) from these
+    image_fields = ('image', 'image_variants')
+    access_columns = ('author_id', 'is_public')
+
+    def __init__(self, rows, context=None, fields=None):
+        self.instance = rows
+        self.context = context or {}
+        self.request = self.context.get('request')
+        self.build_variant_url = variant_url_builder(self.request)
+        self.plan = self.get_plan(fields)
+        self.signing_user_id = media.signing_user_id(self.request)
+
+    @classmethod
+    def get_plan(cls, fields=None):
+        """(field name, column, field) for each of the serializer's fields (or ``fields``), in order."""
+        plan = cls.__dict__.get('_plan')
+        if plan is None:
+            plan = cls._plan = tuple(cls.plan_field(name, field) for name, field in cls.serializer_class().fields.items())
+        if fields is not None:
+            plan = tuple(entry for entry in plan if entry[0] in fields)
+        return plan
+
+    @classmethod
+    def plan_field(cls, name, field):
+        if isinstance(field, serializers.SerializerMethodField):
+            # Method fields get the whole recipe; here they get their column and convert_<name>()
+            if not hasattr(cls, f'convert_{name}'):
+                raise ImproperlyConfigured(f"{cls.__name__} needs a convert_{name}() for the method field '{name}'.")
+        elif field.source == '*':
+            raise ImproperlyConfigured(f"{cls.__name__} can't serialize '{name}' from a single column.")
+        return name, fieldsets.field_column(name, field), field
+
+    @classmethod
+    def columns(cls, fields=None):
+        plan = cls.get_plan(fields)
+        columns = [column for _, column, _ in plan]
+        extra = list(cls.key_columns)
+        if any(name in cls.image_fields for name, _, _ in plan):
+            extra.extend(cls.access_columns)
+        # Extra columns go last, where serializing (zip) never gets to them
+        return columns + [column for column in extra if column not in columns]
+
+    @classmethod
+    def rows(cls, queryset, fields=None):
+        """The queryset as the rows this serializer reads, with just the columns ``fields`` need."""
+        return queryset.values_list(*cls.columns(fields), named=True)
+
+    def get_converters(self):
+        converters = []
+        for name, column, field in self.plan:
+            if isinstance(field, serializers.SerializerMethodField):
+                convert = getattr(self, f'convert_{name}')
+            elif isinstance(field, serializers.FileField):
+                convert = self.file_converter(column, field)
+            elif isinstance(field, serializers.DateTimeField):
+                convert = self.datetime_converter(field)
+            elif isinstance(field, self.passthrough_fields):
+                convert = None
+            else:
+                convert = field.to_representation
+            converters.append((name, convert))
+        return converters
+
+    def file_converter(self, column, field):
+        # FileField.to_representation() without the FieldFile: the storage does the work
+        use_url = getattr(field, 'use_url', True)
+        storage = Recipe._meta.get_field(column).storage
+        request = self.request
+
+        def convert(name):
+            if not name:
+                return None
+            if not use_url:
+                return name
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+        return convert
+
+    def datetime_converter(self, field):
+        # DateTimeField.to_representation() looks the time zone up again for every value;
+        # it can't change halfway through a page, so look it up once
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+            return field.to_representation
+
+        def convert(value):
+            if value.utcoffset() is None:
+                return field.to_representation(value)
+            value = value.astimezone(field_timezone).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return convert
+
+    def convert_image_variants(self, variants):
+        return images.build_srcsets(variants, self.build_variant_url)
+
+    def get_nullable_relations(self):
+        # A field reading through a relation that isn't there (a recipe without an author)
+        # is left out of RecipeSerializer's output altogether, rather than sent as null
+        return [
+            name for name, column, field in self.plan
+            if '__' in column and not field.required and not field.allow_null and field.default is empty
+        ]
+
+    @property
+    def data(self):
+        with timed('serialize'):
+            return self.serialize()
+
+    def serialize(self):
+        converters = self.get_converters()
+        nullable_relations = self.get_nullable_relations()
+        data = []
+        for row in self.instance:
+            item = {
+                name: value if convert is None or value is None else convert(value)
+                for (name, convert), value in zip(converters, row)
+            }
+            for name in nullable_relations:
+                if item[name] is None:
+                    del item[name]
+            if self.signing_user_id is not None and (item.get('image') or item.get('image_variants')):
+                self.sign_media(item, row)
+            data.append(item)
+        return data
+
+    def sign_media(self, item, row):
+        if row.is_public or row.author_id != self.signing_user_id:
+            return
+        if item.get('image'):
+            item['image'] = media.sign_url(item['image'], row.image)
+        if item.get('image_variants'):
+            item['image_variants'] = images.build_srcsets(row.image_variants, media.url_signer(self.build_variant_url))
+
 # Remember, this serializer is your kitchen assistant. It helps prepare your Recipe data
 # for serving via the API, and helps interpret incoming data to create or update recipes.
 # Use it wisely in your views, and your API will be serving up delicious data in no time!
\ No newline at end of file
@@ -0,0 +1,139 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import facets, ingredients, response_cache, search, similar
+from .models import Recipe
+
+User = get_user_model()
+
+
+def _author_username(recipe):
+    if recipe.author_id is None:
+        return None
+    if Recipe.author.is_cached(recipe):
+        return recipe.author.username
+    return User.objects.filter(pk=recipe.author_id).values_list('username', flat=True).first()
+
+
+# Whenever a recipe is saved, we refresh its entry in the search index so that
+# ?search= always sees the latest title, description and ingredients.
+# Deleting a recipe needs no handler: its postings go away with it (on_delete=CASCADE).
+@receiver(post_save, sender=Recipe, dispatch_uid='recipes_index_recipe')
+def index_recipe_on_save(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not set(update_fields) & set(search.FIELD_WEIGHTS):
+        return
+    if not created and not any(instance.field_changed(field) for field in search.FIELD_WEIGHTS):
+        return
+    search.index_recipe(instance)
+
+
+# Same idea for the structured ingredients: re-parse the ingredient text on every save
+# so the pantry lookup never works from a stale list.
+@receiver(post_save, sender=Recipe, dispatch_uid='recipes_sync_ingredients')
+def sync_ingredients_on_save(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and 'ingredients' not in update_fields:
+        return
+    if not created and not instance.field_changed('ingredients'):
+        return
+    ingredients.sync_recipe(instance)
+
+
+# The facet counts (recipes/facets.py): a new recipe adds one to its combination of category,
+# cuisine, difficulty and visibility, a changed recipe moves from its old combination to its
+# new one, and a deleted recipe takes one away. The old combination has to be known before
+# the save overwrites it, and all of it before the delete, hence the pre_ handlers.
+@receiver(pre_save, sender=Recipe, dispatch_uid='recipes_remember_facet_key')
+def remember_facet_key(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(facets.KEY_FIELDS):
+        return
+    key = facets.loaded_key(instance)
+    if key is None:
+        # Loaded without some of those columns (or not loaded at all): ask the database
+        key = Recipe.objects.filter(pk=instance.pk).values_list(*facets.KEY_FIELDS).first()
+    instance._facet_key = key
+
+
+@receiver(post_save, sender=Recipe, dispatch_uid='recipes_count_facets_on_save')
+def count_facets_on_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    old_key = instance.__dict__.pop('_facet_key', None)
+    if created:
+        facets.add_recipes([instance])
+    elif old_key is not None:
+        facets.move_recipe(tuple(old_key), facets.facet_key(instance))
+
+
+@receiver(pre_delete, sender=Recipe, dispatch_uid='recipes_load_facet_key')
+def load_facet_key(sender, instance, **kwargs):
+    deferred = instance.get_deferred_fields() & set(facets.KEY_FIELDS)
+    if deferred:
+        instance.refresh_from_db(fields=sorted(deferred))
+
+
+@receiver(post_delete, sender=Recipe, dispatch_uid='recipes_count_facets_on_delete')
+def count_facets_on_delete(sender, instance, **kwargs):
+    facets.remove_recipe(instance)
+
+
+# The similar-recipes index (recipes/similar.py) is a file, not a table, so it's only
+# written once the recipe really is in the database: after the transaction commits.
+# robust=True: a failed write is logged, the save itself already happened.
+@receiver(post_save, sender=Recipe, dispatch_uid='recipes_update_similar_on_save')
+def update_similar_on_save(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw or not similar.available():
+        return
+    if update_fields is not None and not set(update_fields) & set(similar.FEATURE_FIELDS):
+        return
+    if not created and not any(instance.field_changed(field) for field in similar.FEATURE_FIELDS):
+        return
+    transaction.on_commit(lambda: similar.update_recipes([instance]), robust=True)
+
+
+@receiver(post_delete, sender=Recipe, dispatch_uid='recipes_remove_similar_on_delete')
+def remove_similar_on_delete(sender, instance, **kwargs):
+    if not similar.available():
+        return
+    recipe_id = instance.pk
+    transaction.on_commit(lambda: similar.remove_recipe(recipe_id), robust=True)
+
+
+# Cached responses (recipes/response_cache.py) that show this recipe are stale now:
+# the recipe's own page, every recipe list, and its author's public cookbook. Only once
+# the transaction commits, though: bump the versions any earlier and a concurrent read
+# could cache what the database still says under the new ones.
+@receiver(post_save, sender=Recipe, dispatch_uid='recipes_invalidate_cache_on_save')
+@receiver(post_delete, sender=Recipe, dispatch_uid='recipes_invalidate_cache_on_delete')
+def invalidate_cached_responses(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    recipe_id, username = instance.pk, _author_username(instance)
+    transaction.on_commit(lambda: response_cache.invalidate_recipe(recipe_id, username), robust=True)
+
+
+# Recipes show their author's username, so a profile change can make them stale too.
+# Saves that can't touch the username (last_login, is_active, ...) are ignored. After a
+# rename the cookbook was cached under the old name, so that scope goes as well.
+@receiver(post_save, sender=User, dispatch_uid='recipes_invalidate_cache_on_author_change')
+def invalidate_author_responses(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw or created:
+        return
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    recipe_ids = list(Recipe.objects.filter(author=instance).values_list('pk', flat=True))
+    if recipe_ids:
+        usernames = {instance.username, getattr(instance, '_loaded_username', None)} - {None}
+        scopes = [
+            'all',
+            *[response_cache.user_scope(username) for username in sorted(usernames)],
+            *[response_cache.recipe_scope(pk) for pk in recipe_ids],
+        ]
+        transaction.on_commit(lambda: response_cache.invalidate(*scopes), robust=True)
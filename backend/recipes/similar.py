@@ -0,0 +1,428 @@
+"""
+"Similar recipes": the recipes closest to a given one by title, ingredients,
+category and cuisine.
+
+Every recipe becomes a fixed-length vector. Its words and ingredient names are
+weighted by how rare they are across the cookbook (TF-IDF) and hashed straight
+into ``RECIPE_SIMILAR_DIMENSIONS`` slots, each with a random sign - no vocabulary
+to keep in step, and collisions cancel out rather than pile up. Vectors are
+normalized, so the dot product of two of them is their cosine similarity.
+
+Comparing a recipe with every other one means reading the whole matrix, 100MB at
+100k recipes, and that's memory bandwidth more than arithmetic. So each vector
+also gets a 256-bit signature: which side of each of 256 fixed random hyperplanes
+it falls on (SimHash). The more two vectors' signatures agree, the smaller the
+angle between them; a query counts the disagreeing bits against every signature
+(a few MB, stored bit-word by bit-word so that's a handful of vectorized XORs),
+takes the SHORTLIST rows that agree most, and ranks only those by their real
+cosine similarity. On the benchmark's cookbook the answers are the ones a full
+scan gives (``manage.py benchmark --similar``).
+
+The vectors live in a NumPy file under ``RECIPE_SIMILAR_INDEX_DIR`` that every
+worker memory-maps, so they share one copy through the page cache, next to the
+signatures and a file holding the recipe id of each row (0 for a free row). Saving a recipe
+rewrites its row in place and deleting one frees it (the handlers in
+recipes/signals.py, after the transaction commits); the other workers see the
+change straight away. Growing the matrix, or ``rebuild`` (the
+``rebuild_similar_index`` command), writes a new generation of the files next to
+the old one and switches a pointer over, and workers pick the new one up on
+their next query.
+
+The word weights are worked out when the index is built; recipes added since
+then use them as they are, and words nobody had used yet count as rare. Rebuild
+now and then (nightly, say) to bring them up to date.
+
+Needs NumPy. Without it ``available()`` is False, the index isn't kept and the
+endpoint says it's unavailable.
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+
+from . import ingredients
+from .models import Recipe
+from .search import tokenize
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is in requirements.txt
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Windows
+    fcntl = None
+
+# What goes into a recipe's vector, and how much each part counts
+FEATURE_FIELDS = ('title', 'ingredients', 'category', 'cuisine')
+TITLE_WEIGHT = 2.0
+INGREDIENT_WEIGHT = 1.5
+CUISINE_WEIGHT = 1.5
+CATEGORY_WEIGHT = 1.0
+
+# Signature bits per vector, and how many rows make the shortlist a query ranks
+SIGNATURE_BITS = 256
+SHORTLIST = 1000
+HYPERPLANE_SEED = 20240601
+
+CURRENT = 'CURRENT'
+_open_lock = threading.Lock()
+_write_thread_lock = threading.Lock()
+
+
+def available():
+    return np is not None
+
+
+def get_index_dir():
+    return str(getattr(settings, 'RECIPE_SIMILAR_INDEX_DIR', os.path.join(settings.BASE_DIR, 'similar-index')))
+
+
+def get_dimensions():
+    return getattr(settings, 'RECIPE_SIMILAR_DIMENSIONS', 256)
+
+
+def words(text):
+    # "Pancakes (makes 12)": the 12 says nothing about what the recipe is like
+    return [token for token in tokenize(text) if not token.isdigit()]
+
+
+def features(recipe):
+    """
+    Feature -> weight for a recipe. Words of the title and of the ingredient names
+    share one space, so "chicken" in one recipe's title matches it in another's
+    ingredients; whole ingredient names, the category and the cuisine are features
+    of their own. Plain attribute access, so deferred-free instances and rows both work.
+    """
+    counts = Counter()
+    for token in words(recipe.title):
+        counts[token] += TITLE_WEIGHT
+    for parsed in ingredients.parse_ingredients(recipe.ingredients or ''):
+        counts[f'ingredient:{parsed.name}'] += INGREDIENT_WEIGHT
+        for token in words(parsed.name):
+            counts[token] += INGREDIENT_WEIGHT / 2
+    if recipe.category:
+        counts[f'category:{recipe.category.lower()}'] += CATEGORY_WEIGHT
+    if recipe.cuisine:
+        counts[f'cuisine:{recipe.cuisine.lower()}'] += CUISINE_WEIGHT
+    # Saying "garlic" three times doesn't make a recipe three times as garlicky
+    return {feature: 1 + math.log(weight) if weight > 1 else weight for feature, weight in counts.items()}
+
+
+@lru_cache(maxsize=200_000)
+def _slot(feature, dimensions):
+    digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+    return digest % dimensions, 1.0 if digest >> 63 else -1.0
+
+
+def vectorize(recipe_features, dimensions, idf, default_idf):
+    """A recipe's features as a unit vector."""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature, weight in recipe_features.items():
+        slot, sign = _slot(feature, dimensions)
+        vector[slot] += sign * weight * idf.get(feature, default_idf)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def default_idf(documents):
+    # A word the index hasn't seen yet is as rare as a word can be
+    return math.log((1 + documents) / 2) + 1
+
+
+def inverse_document_frequencies(documents):
+    """idf for each feature of ``documents`` (feature dicts), smoothed: log((1 + n) / (1 + df)) + 1."""
+    frequencies = Counter()
+    for document in documents:
+        frequencies.update(document.keys())
+    total = len(documents)
+    return {feature: math.log((1 + total) / (1 + df)) + 1 for feature, df in frequencies.items()}
+
+
+@lru_cache(maxsize=4)
+def _hyperplanes(dimensions, bits):
+    # The same planes in every process: they're derived from a fixed seed, not stored
+    return np.random.default_rng(HYPERPLANE_SEED).standard_normal((dimensions, bits)).astype(np.float32)
+
+
+def signatures(vectors, bits=SIGNATURE_BITS):
+    """
+    The SimHash signatures of a matrix of vectors, as (bits // 64, rows) uint64:
+    word ``w`` of every signature is contiguous, so distances are computed a word
+    at a time over all the rows at once.
+    """
+    vectors = np.atleast_2d(vectors)
+    sides = vectors @ _hyperplanes(vectors.shape[1], bits) > 0
+    return np.ascontiguousarray(np.packbits(sides, axis=1).view(np.uint64).T)
+
+
+class SimilarIndex:
+    """One generation of the index files, memory-mapped."""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.dimensions = meta['dimensions']
+        self.idf = meta['idf']
+        self.default_idf = meta['default_idf']
+        self.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r+')
+        self.signatures = np.load(os.path.join(path, 'signatures.npy'), mmap_mode='r+')
+        self.ids = np.load(os.path.join(path, 'ids.npy'), mmap_mode='r+')
+
+    @property
+    def capacity(self):
+        return len(self.ids)
+
+    def vector(self, recipe_features):
+        return vectorize(recipe_features, self.dimensions, self.idf, self.default_idf)
+
+    def shortlist(self, vector, size):
+        """The ``size`` rows whose signatures are closest to ``vector``'s, or None for all of them."""
+        if self.capacity <= size:
+            return None
+        query = signatures(vector)[:, 0]
+        distances = np.bitwise_count(self.signatures[0] ^ query[0]).astype(np.uint16)
+        for word in range(1, len(query)):
+            distances += np.bitwise_count(self.signatures[word] ^ query[word])
+        distances[np.asarray(self.ids) == 0] = np.iinfo(np.uint16).max
+        rows = np.argpartition(distances, size - 1)[:size]
+        rows.sort()
+        return rows
+
+    def search(self, vector, limit, exclude=()):
+        """(recipe id, cosine similarity) of the ``limit`` rows nearest ``vector``, best first."""
+        rows = self.shortlist(vector, max(SHORTLIST, limit * 20))
+        if rows is None:
+            scores, ids = self.vectors @ vector, np.asarray(self.ids)
+        else:
+            scores, ids = self.vectors[rows] @ vector, self.ids[rows]
+        scores[ids == 0] = -np.inf
+        if exclude:
+            scores[np.isin(ids, list(exclude))] = -np.inf
+        limit = min(limit, int(np.count_nonzero(np.isfinite(scores))))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(ids[position]), float(scores[position])) for position in top]
+
+    def row_of(self, recipe_id):
+        rows = np.flatnonzero(self.ids == recipe_id)
+        return int(rows[0]) if len(rows) else None
+
+    def free_rows(self):
+        return np.flatnonzero(self.ids == 0)
+
+
+# --- Files -----------------------------------------------------------------------------
+
+def _read_current(index_dir):
+    try:
+        with open(os.path.join(index_dir, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_generation(index_dir, vectors, ids, idf, documents):
+    """Write a new generation of the files and make it the current one. Returns its path."""
+    name = f'gen-{time.time_ns()}'
+    path = os.path.join(index_dir, name)
+    os.makedirs(path)
+    np.save(os.path.join(path, 'vectors.npy'), vectors)
+    np.save(os.path.join(path, 'signatures.npy'), signatures(vectors))
+    np.save(os.path.join(path, 'ids.npy'), ids)
+    meta = {
+        'dimensions': vectors.shape[1],
+        'signature_bits': SIGNATURE_BITS,
+        'documents': documents,
+        'default_idf': default_idf(documents),
+        'idf': idf,
+    }
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    pointer = os.path.join(index_dir, f'{CURRENT}.{name}')
+    with open(pointer, 'w') as f:
+        f.write(name)
+    old = _read_current(index_dir)
+    os.replace(pointer, os.path.join(index_dir, CURRENT))
+    if old and old != name:
+        # Workers still reading the old files keep them until they move on (they're mapped)
+        shutil.rmtree(os.path.join(index_dir, old), ignore_errors=True)
+    return path
+
+
+_opened = {}   # index dir -> (generation, SimilarIndex)
+
+
+def get_index(create=False):
+    """The current index (reopened if it moved on since), or None if there isn't one yet."""
+    index_dir = get_index_dir()
+    generation = _read_current(index_dir)
+    if generation is None:
+        if not create:
+            return None
+        with _write_lock(index_dir):
+            generation = _read_current(index_dir)
+            if generation is None:
+                _write_generation(
+                    index_dir, np.zeros((0, get_dimensions()), dtype=np.float32), np.zeros(0, dtype=np.int64), {}, 0
+                )
+                generation = _read_current(index_dir)
+    with _open_lock:
+        opened = _opened.get(index_dir)
+        if opened is None or opened[0] != generation:
+            opened = _opened[index_dir] = _open_generation(index_dir, generation)
+        return opened[1]
+
+
+def _open_generation(index_dir, generation):
+    for _ in range(3):
+        path = os.path.join(index_dir, generation)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                return generation, SimilarIndex(path, json.load(f))
+        except FileNotFoundError:
+            # Replaced (and removed) between reading CURRENT and opening it; the new one is there now
+            generation = _read_current(index_dir)
+    raise FileNotFoundError(f"Can't open the similar-recipes index in {index_dir}")
+
+
+@contextmanager
+def _write_lock(index_dir):
+    """One writer at a time, across threads and worker processes."""
+    os.makedirs(index_dir, exist_ok=True)
+    with _write_thread_lock, open(os.path.join(index_dir, 'lock'), 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# --- Keeping it up to date -------------------------------------------------------------
+
+def update_recipes(recipes):
+    """Write (or rewrite) the rows of these recipes."""
+    recipes = [recipe for recipe in recipes if recipe.pk is not None]
+    if not available() or not recipes:
+        return
+    index_dir = get_index_dir()
+    get_index(create=True)
+    with _write_lock(index_dir):
+        index = get_index()
+        rows = [index.row_of(recipe.pk) for recipe in recipes]
+        free = list(index.free_rows())
+        needed = sum(1 for row in rows if row is None)
+        if needed > len(free):
+            index = _grow(index_dir, index, needed - len(free))
+            free = list(index.free_rows())
+        for recipe, row in zip(recipes, rows):
+            if row is None:
+                row = int(free.pop(0))
+            # The vector first: a reader never sees the id next to some other recipe's vector
+            vector = index.vector(features(recipe))
+            index.vectors[row] = vector
+            index.signatures[:, row] = signatures(vector)[:, 0]
+            index.ids[row] = recipe.pk
+        index.vectors.flush()
+        index.signatures.flush()
+        index.ids.flush()
+
+
+def remove_recipe(recipe_id):
+    if not available():
+        return
+    index_dir = get_index_dir()
+    if _read_current(index_dir) is None:
+        return
+    with _write_lock(index_dir):
+        index = get_index()
+        row = index.row_of(recipe_id)
+        if row is not None:
+            index.ids[row] = 0
+            index.vectors[row] = 0
+            index.signatures[:, row] = 0
+            index.ids.flush()
+            index.vectors.flush()
+            index.signatures.flush()
+
+
+def _grow(index_dir, index, extra):
+    capacity = max(64, index.capacity * 2, index.capacity + extra)
+    vectors = np.zeros((capacity, index.dimensions), dtype=np.float32)
+    ids = np.zeros(capacity, dtype=np.int64)
+    vectors[:index.capacity] = index.vectors
+    ids[:index.capacity] = index.ids
+    _write_generation(index_dir, vectors, ids, index.idf, index.meta['documents'])
+    return get_index()
+
+
+def rebuild(batch_size=2000):
+    """
+    Build the index again from every recipe, word weights and all. Returns how many
+    recipes it holds. A recipe saved while this runs may be left out until it's
+    saved again or the next rebuild.
+    """
+    if not available():
+        return 0
+    recipe_ids, documents = [], []
+    for recipe in Recipe.objects.only('id', *FEATURE_FIELDS).order_by('pk').iterator(chunk_size=batch_size):
+        recipe_ids.append(recipe.pk)
+        documents.append(features(recipe))
+    idf = inverse_document_frequencies(documents)
+    index_dir = get_index_dir()
+    with _write_lock(index_dir):
+        dimensions = get_dimensions()
+        capacity = max(64, len(recipe_ids) + len(recipe_ids) // 4)
+        vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        ids = np.zeros(capacity, dtype=np.int64)
+        unseen = default_idf(len(documents))
+        for row, document in enumerate(documents):
+            vectors[row] = vectorize(document, dimensions, idf, unseen)
+        ids[:len(recipe_ids)] = recipe_ids
+        _write_generation(index_dir, vectors, ids, idf, len(documents))
+    return len(recipe_ids)
+
+
+# --- Asking it -------------------------------------------------------------------------
+
+def similar_to(recipe, limit=10, exclude=()):
+    """(recipe id, similarity) of the recipes most like ``recipe``, best first, itself left out."""
+    index = get_index()
+    if index is None:
+        return []
+    return index.search(index.vector(features(recipe)), limit, exclude=(recipe.pk, *exclude))
+
+
+def similar_recipes(recipe, queryset, limit=10):
+    """
+    The recipes in ``queryset`` most like ``recipe``, best first, each with its
+    ``similarity``. The index knows nothing about visibility; ask it for a few more
+    than needed, and keep the ones ``queryset`` lets through.
+    """
+    found, excluded = [], set()
+    for _ in range(3):
+        candidates = similar_to(recipe, (limit - len(found)) * 4, exclude=excluded)
+        if not candidates:
+            break
+        recipes = queryset.in_bulk([recipe_id for recipe_id, _ in candidates])
+        for recipe_id, similarity in candidates:
+            excluded.add(recipe_id)
+            if recipe_id in recipes and len(found) < limit:
+                recipes[recipe_id].similarity = similarity
+                found.append(recipes[recipe_id])
+        if len(found) >= limit:
+            break
+    return found
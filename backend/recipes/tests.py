@@ -1,3 +1,1589 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import random
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, router
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.throttling import ScopedRateThrottle
+import environ
+from jobs import queue
+from monitoring import metrics
+from culinary_connect.database import database_config
+from culinary_connect import replicas
+from culinary_connect.renderers import ORJSONRenderer
+from users import authentication
+
+from . import (
+    benchmark, facets, fieldsets, images, ingredients, popularity, query_plans, response_cache, similar, timelines
+)
+from .models import HomeTimeline, ImageBlob, Recipe, RecipeFacetCount, RecipeStats
+from .serializers import RecipeRowSerializer, RecipeSerializer
+from .views import AsyncPublicUserRecipeListView, AsyncRecipeDetailView, AsyncRecipeListCreateView
+
+User = get_user_model()
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+    authentication.clear()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+# The read routes served by their async views, for AsyncReadViewTests (ROOT_URLCONF=__name__)
+urlpatterns = [
+    path('api/recipes/', AsyncRecipeListCreateView.as_view(), name='recipe-list-create'),
+    path('api/recipes/<int:pk>/', AsyncRecipeDetailView.as_view(), name='recipe-detail'),
+    path('api/users/<str:username>/public-recipes/', AsyncPublicUserRecipeListView.as_view(),
+         name='public-user-recipes'),
+]
+
+
+def make_recipe(author, index, **overrides):
+    fields = {
+        'title': f"Garlic Chicken {index}",
+        'description': "A weeknight favourite.",
+        'ingredients': "Chicken breast, garlic, olive oil, salt",
+        'instructions': "Cook it.",
+        'preparation_time': 10,
+        'cooking_time': 20,
+        'servings': 2,
+        'difficulty': 'easy',
+        'category': 'Dinner',
+        'cuisine': 'Italian',
+        'author': author,
+    }
+    fields.update(overrides)
+    return Recipe.objects.create(**fields)
+
+
+def make_image(name='photo.png'):
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), 'red').save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeQueryCountTests(TestCase):
+    """
+    Every recipe endpoint should run the same number of queries whether a page
+    holds one recipe or ten. If one of these starts failing, something is
+    loading related data row by row again.
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.other = User.objects.create_user(username='critic', password='secret-pass-123')
+        self.token = Token.objects.create(user=self.author)
+        self.recipe = make_recipe(self.author, 0)
+        make_recipe(self.other, 1)
+        self.client = APIClient()
+
+    def authenticate(self):
+        # Measure the steady state, where the token comes out of the token cache
+        authentication.remember(self.token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def add_recipes(self, count=12):
+        for index in range(count):
+            make_recipe(self.author if index % 2 else self.other, 100 + index)
+        clear_caches()
+        authentication.remember(self.token)
+
+    def assertConstantQueries(self, num, url, data=None):
+        """Same query count with a near-empty page and with a full one."""
+        with self.assertNumQueries(num):
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        self.add_recipes()
+        with self.assertNumQueries(num):
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_recipe_list(self):
+        # count + page; the ETag goes by the page
+        self.assertConstantQueries(2, reverse('recipe-list-create'))
+
+    def test_recipe_list_filtered_and_ordered(self):
+        self.assertConstantQueries(2, reverse('recipe-list-create'), {
+            'category': 'Dinner', 'difficulty': 'easy', 'ordering': '-created_at'
+        })
+
+    def test_recipe_list_search(self):
+        # postings + document frequencies + corpus stats + count + page
+        response = self.assertConstantQueries(5, reverse('recipe-list-create'), {'search': 'garlic chick'})
+        self.assertEqual(response.data['count'], 14)
+
+    def test_recipe_list_authenticated(self):
+        # count + page; the token comes from the token cache
+        self.authenticate()
+        self.assertConstantQueries(2, reverse('recipe-list-create'))
+
+    def test_recipe_create(self):
+        self.authenticate()
+        data = {
+            'title': "Tomato Soup", 'description': "Warming.", 'ingredients': "tomatoes, onion",
+            'instructions': "Simmer.", 'preparation_time': 5, 'cooking_time': 30, 'servings': 4,
+            'difficulty': 'easy', 'category': 'Soup', 'cuisine': 'French',
+        }
+        # insert, search index (savepoint, 2 deletes, 2 inserts, release),
+        # ingredients (savepoint, delete, upsert + select ingredients, insert, release),
+        # facet count (insert if missing, increment)
+        with self.assertNumQueries(15):
+            response = self.client.post(reverse('recipe-list-create'), data, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+    def test_recipe_detail(self):
+        url = reverse('recipe-detail', args=[self.recipe.pk])
+        # updated_at for the ETag + the recipe
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.data['author'], 'chef')
+
+    def test_cached_anonymous_reads(self):
+        urls = [
+            reverse('recipe-list-create'),
+            reverse('recipe-detail', args=[self.recipe.pk]),
+            reverse('public-user-recipes', args=['chef']),
+        ]
+        response_cache.reset_stats()
+        for url in urls:
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response_cache.stats()['hit_rate'], 0.5)
+        self.assertIn('recipe_response_cache_events_total{event="hit"} 3', metrics.exposition())
+
+    def test_cache_is_invalidated_by_edits(self):
+        url = reverse('recipe-detail', args=[self.recipe.pk])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.title = "Lemon Chicken"
+            self.recipe.save()
+            # Until the edit commits, readers keep getting (and caching) what's committed
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['title'], "Lemon Chicken")
+
+        cookbook = reverse('public-user-recipes', args=['chef'])
+        self.assertEqual(self.client.get(cookbook).data['count'], 1)
+        self.client.get(url)
+        author = User.objects.get(pk=self.author.pk)
+        author.username = 'head-chef'
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        self.assertEqual(self.client.get(url).data['author'], 'head-chef')
+        # Nobody is called chef any more
+        self.assertEqual(self.client.get(cookbook).status_code, 404)
+
+    def test_recipe_partial_update(self):
+        self.authenticate()
+        url = reverse('recipe-detail', args=[self.recipe.pk])
+        # recipe, update, then the search index refresh. The ingredients
+        # didn't change, so they aren't parsed again.
+        with self.assertNumQueries(8):
+            response = self.client.patch(url, {'title': "Lemon Chicken"}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+
+    def test_recipe_delete(self):
+        self.authenticate()
+        url = reverse('recipe-detail', args=[self.recipe.pk])
+        # recipe, then the cascade to postings, search document, ingredients, stats and
+        # trending, facet count
+        with self.assertNumQueries(8):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_my_recipes(self):
+        self.authenticate()
+        self.assertConstantQueries(2, reverse('my-recipes'))
+
+    def test_public_user_recipes(self):
+        # user + count + page
+        self.assertConstantQueries(3, reverse('public-user-recipes', args=['chef']))
+
+    def test_pantry(self):
+        # ingredient ids + count + page
+        self.assertConstantQueries(3, reverse('recipe-pantry'), {'ingredients': 'chicken,garlic'})
+
+    def test_image_upload(self):
+        self.authenticate()
+        url = reverse('recipe-image-upload', args=[self.recipe.pk])
+        # recipe, blob get_or_create (select + insert), update, author's
+        # username for cache invalidation, the variants job, plus savepoints
+        with self.assertNumQueries(12):
+            response = self.client.post(url, {'image': make_image()}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+
+    def test_recipe_list_cursor(self):
+        # no COUNT(*), just the page
+        self.assertConstantQueries(1, reverse('recipe-list-create'), {'pagination': 'cursor'})
+
+
+class RecipeCursorPaginationTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        for index in range(25):
+            make_recipe(self.author, index)
+        self.client = APIClient()
+
+    def test_walks_every_recipe_once_despite_new_posts(self):
+        seen = []
+        response = self.client.get(reverse('recipe-list-create'), {'pagination': 'cursor'})
+        while True:
+            self.assertNotIn('count', response.data)
+            seen.extend(recipe['id'] for recipe in response.data['results'])
+            # somebody posts a recipe while we're scrolling
+            with self.captureOnCommitCallbacks(execute=True):
+                make_recipe(self.author, 1000 + len(seen))
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+
+    def test_previous_link_returns_the_same_page(self):
+        first = self.client.get(reverse('recipe-list-create'), {'pagination': 'cursor'})
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [recipe['id'] for recipe in back.data['results']],
+            [recipe['id'] for recipe in first.data['results']]
+        )
+
+    def test_page_numbers_still_work(self):
+        response = self.client.get(reverse('recipe-list-create'), {'page': 2})
+        self.assertEqual(response.data['count'], 25)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('recipe-list-create'), {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 404)
+
+
+class RecipeSearchTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.client = APIClient()
+
+    def search(self, query):
+        response = self.client.get(reverse('recipe-list-create'), {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['title'] for recipe in response.data['results']]
+
+    def test_best_matches_come_first(self):
+        make_recipe(self.author, 1, title="Weeknight Pasta", description="Plenty of garlic.",
+                    ingredients="Pasta, tomatoes")
+        make_recipe(self.author, 2, title="Garlic Bread", ingredients="Bread, garlic, butter")
+        make_recipe(self.author, 3, title="Lemon Tart", description="No garlic here, promise.",
+                    ingredients="Lemons, sugar, butter, eggs, flour, cream")
+        make_recipe(self.author, 4, title="Green Salad", ingredients="Lettuce")
+        # A hit in the title counts for most, then ingredients, then a short description
+        self.assertEqual(self.search('garlic'), ["Garlic Bread", "Weeknight Pasta", "Lemon Tart"])
+        # Every term has to match
+        self.assertEqual(self.search('garlic butter'), ["Garlic Bread", "Lemon Tart"])
+        self.assertEqual(self.search('garlic chocolate'), [])
+
+    def test_terms_match_word_prefixes(self):
+        make_recipe(self.author, 1, title="Chicken Soup", description="", ingredients="Chicken, water")
+        make_recipe(self.author, 2, title="Chick Pea Stew", description="", ingredients="Chickpeas")
+        make_recipe(self.author, 3, title="A Stew", description="", ingredients="Onions")
+        # Whole words score above prefixes
+        self.assertEqual(self.search('chick'), ["Chick Pea Stew", "Chicken Soup"])
+        self.assertEqual(self.search('crème chick'), [])
+        self.assertEqual(self.search('STEW chickp'), ["Chick Pea Stew"])
+        # Short terms only match whole words
+        self.assertEqual(self.search('a'), ["A Stew"])
+        self.assertEqual(self.search('ch'), [])
+
+    @override_settings(RECIPE_SEARCH_MAX_RESULTS=3)
+    def test_results_stop_at_the_cap(self):
+        for index in range(12):
+            make_recipe(self.author, index, title=f"Soup {index}" if index < 2 else f"Stew {index}",
+                        description="", ingredients="Soup bones")
+        response = self.client.get(reverse('recipe-list-create'), {'search': 'soup'})
+        # All twelve match, more than a page; only the three best are listed and counted
+        self.assertEqual(response.data['count'], 3)
+        self.assertIsNone(response.data['next'])
+        titles = [recipe['title'] for recipe in response.data['results']]
+        self.assertEqual(sorted(titles[:2]), ["Soup 0", "Soup 1"])
+        self.assertEqual(len(titles), 3)
+
+
+class IngredientParserTests(TestCase):
+    def parse(self, text):
+        return [(item.name, item.quantity, item.unit) for item in ingredients.parse_ingredients(text)]
+
+    def test_quantities_units_and_names(self):
+        self.assertEqual(self.parse("2 cups chopped onions\n1 1/2 tsp salt; 1.5 kg Fresh Tomatoes (ripe)"), [
+            ('onion', Decimal('2.000'), 'cup'),
+            ('salt', Decimal('1.500'), 'tsp'),
+            ('tomato', Decimal('1.500'), 'kg'),
+        ])
+        self.assertEqual(self.parse("2-3 cloves garlic, a pinch of pepper, an onion"), [
+            ('garlic', Decimal('2.000'), 'clove'),
+            ('pepper', Decimal('1.000'), 'pinch'),
+            ('onion', Decimal('1.000'), ''),
+        ])
+        # A lone "c" is only a cup after a number
+        self.assertEqual(self.parse("C vitamin drops"), [('c vitamin drop', None, '')])
+
+    def test_unicode_fractions(self):
+        self.assertEqual(self.parse("½ cup sugar, 1½ cups milk, ¾ tbsp butter"), [
+            ('sugar', Decimal('0.500'), 'cup'),
+            ('milk', Decimal('1.500'), 'cup'),
+            ('butter', Decimal('0.750'), 'tbsp'),
+        ])
+
+    def test_junk_and_oversized_quantities(self):
+        self.assertEqual(self.parse("1/0 cup flour"), [('cup flour', None, '')])
+        self.assertEqual(self.parse("100000000000000000000000000 eggs"), [('egg', None, '')])
+        # The most RecipeIngredient.quantity holds, and just past it
+        self.assertEqual(self.parse("9999999.999 g rice, 10000000 g rice"), [
+            ('rice', Decimal('9999999.999'), 'g'), ('g rice', None, ''),
+        ])
+        self.assertEqual(self.parse("Salt to taste,, --\n(optional)"), [('salt to taste', None, '')])
+        self.assertEqual(self.parse(""), [])
+
+    def test_oversized_quantities_dont_break_saving_a_recipe(self):
+        author = User.objects.create_user(username='chef', password='secret-pass-123')
+        recipe = make_recipe(author, 1, ingredients="100000000000000000000000000 eggs, 2 cups flour")
+        self.assertEqual(
+            list(recipe.recipe_ingredients.order_by('position').values_list('ingredient__name', 'quantity')),
+            [('egg', None), ('flour', Decimal('2.000'))]
+        )
+
+
+class QueryPlanTests(TestCase):
+    def test_parse_log_line(self):
+        self.assertEqual(query_plans.parse_log_line("GET /api/recipes/?page=2\n"), ('GET', '/api/recipes/?page=2'))
+        self.assertEqual(
+            query_plans.parse_log_line('10.0.0.1 - - [18/Oct/2026:10:00:00 +0000] "HEAD /api/recipes/1/ HTTP/1.1" 200 0'),
+            ('HEAD', '/api/recipes/1/')
+        )
+        self.assertEqual(query_plans.parse_log_line("/api/recipes/ 200"), ('GET', '/api/recipes/'))
+        self.assertEqual(query_plans.parse_log_line('"/api/recipes/?search=garlic bread" 200'),
+                         ('GET', '/api/recipes/?search=garlic bread'))
+        for junk in ("", "   ", "# comment", "hello world", '"/api/recipes/?search=garlic'):
+            self.assertIsNone(query_plans.parse_log_line(junk), junk)
+
+    def test_query_shape(self):
+        self.assertEqual(
+            query_plans.query_shape(
+                "SELECT *  FROM recipes_recipe\nWHERE category = 'Dinner' AND id IN (1, 2, 3) LIMIT 10"
+            ),
+            "SELECT * FROM recipes_recipe WHERE category = ? AND id IN (...) LIMIT ?"
+        )
+        self.assertEqual(
+            query_plans.query_shape("SELECT 1 FROM t WHERE title = 'It''s 5 o''clock'"),
+            "SELECT ? FROM t WHERE title = ?"
+        )
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', "SQLite plan output")
+    def test_plan_problems(self):
+        plan = [
+            'SCAN recipes_recipe',
+            'SCAN U0',
+            'SCAN TABLE recipes_recipe AS U1',
+            'SCAN recipes_recipe USING INDEX recipe_feed_idx',
+            'SCAN U2 USING COVERING INDEX recipe_ingredient_idx',
+            'SEARCH recipes_recipe USING INTEGER PRIMARY KEY (rowid=?)',
+            'SCAN (subquery-1)',
+            'SCAN CONSTANT ROW',
+            'USE TEMP B-TREE FOR ORDER BY',
+        ]
+        self.assertEqual(query_plans.plan_problems(plan), [
+            'full scan: SCAN recipes_recipe',
+            'full scan: SCAN U0',
+            'full scan: SCAN TABLE recipes_recipe AS U1',
+            'sort: USE TEMP B-TREE FOR ORDER BY',
+        ])
+
+    def test_explain_requests(self):
+        author = User.objects.create_user(username='chef', password='secret-pass-123')
+        make_recipe(author, 1)
+        make_recipe(author, 2, category='Lunch')
+        with tempfile.NamedTemporaryFile('w', suffix='.log') as log:
+            log.write("# captured on staging\n"
+                      "GET /api/recipes/?category=Dinner&ordering=title\n"
+                      '10.0.0.1 - - [18/Oct/2026:10:00:00 +0000] "GET /api/recipes/?category=Lunch&ordering=title HTTP/1.1" 200 512\n'
+                      '"/api/recipes/?search=garlic\n'
+                      "POST /api/recipes/\n"
+                      "GET /nowhere/\n")
+            log.flush()
+            out = io.StringIO()
+            call_command('explain_requests', log.name, '--json', '--host', 'testserver', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['replayed'], report['skipped']), (2, 2))
+        listed = [shape for shape in report['shapes'] if 'LIMIT' in shape['shape'] and 'recipes_recipe' in shape['shape']]
+        # Both category filters are one shape
+        self.assertEqual([shape['count'] for shape in listed], [2])
+        self.assertEqual(listed[0]['endpoints'], ['recipe-list-create'])
+        self.assertTrue(listed[0]['plan'])
+
+        with self.assertRaises(CommandError):
+            call_command('explain_requests', '/no/such/file.log', stdout=io.StringIO())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, RECIPE_IMAGE_VARIANT_WIDTHS=[320, 640, 1280])
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.recipe = make_recipe(self.author, 1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def photo(self, size=(2000, 1000), orientation=None, name='photo.jpg'):
+        """A JPEG straight off a phone: GPS coordinates and all."""
+        exif = Image.Exif()
+        exif[0x8825] = {2: (51.0, 30.0, 0.0), 4: (0.0, 7.0, 0.0)}
+        if orientation:
+            exif[0x0112] = orientation
+        buffer = BytesIO()
+        Image.new('RGB', size, 'orange').save(buffer, format='JPEG', exif=exif)
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def upload(self, upload):
+        url = reverse('recipe-image-upload', args=[self.recipe.pk])
+        response = self.client.post(url, {'image': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.recipe.refresh_from_db()
+        return response
+
+    def test_variants_are_made_in_the_background(self):
+        self.upload(self.photo())
+        # The upload is stored as it came, the resizing waits for a job worker
+        with default_storage.open(self.recipe.image.name) as stored:
+            self.assertEqual(Image.open(stored).size, (2000, 1000))
+        self.assertEqual(self.recipe.image_variants, {})
+        self.assertIsNone(self.client.get(reverse('recipe-detail', args=[self.recipe.pk])).data['image_variants'])
+
+        self.assertEqual(queue.run_pending(), 1)
+        self.recipe.refresh_from_db()
+        formats = self.recipe.image_variants['formats']
+        self.assertEqual(sorted(formats), ['jpeg', 'webp'])
+        for fmt, pillow_format in (('jpeg', 'JPEG'), ('webp', 'WEBP')):
+            self.assertEqual(sorted(formats[fmt], key=int), ['320', '640', '1280'])
+            for width, name in formats[fmt].items():
+                with default_storage.open(name) as stored, Image.open(stored) as variant:
+                    self.assertEqual(variant.format, pillow_format)
+                    self.assertEqual(variant.size, (int(width), int(width) // 2))
+                    # No GPS (or any other EXIF) on the way out
+                    self.assertFalse(variant.getexif())
+
+        variants = self.client.get(reverse('recipe-detail', args=[self.recipe.pk])).data['image_variants']
+        self.assertTrue(variants['thumbnail'].endswith(formats['jpeg']['320']))
+        self.assertEqual(variants['webp'].count('w, '), 2)
+        self.assertTrue(variants['webp'].endswith(f"{formats['webp']['1280']} 1280w"))
+
+    def test_small_and_rotated_photos(self):
+        # Smaller than every width: one variant at its own size
+        self.upload(self.photo(size=(200, 100)))
+        queue.run_pending()
+        self.recipe.refresh_from_db()
+        self.assertEqual(list(self.recipe.image_variants['formats']['jpeg']), ['200'])
+
+        # Taken holding the phone sideways: the variants come out the right way up
+        self.upload(self.photo(size=(1000, 600), orientation=6, name='sideways.jpg'))
+        queue.run_pending()
+        self.recipe.refresh_from_db()
+        with default_storage.open(self.recipe.image_variants['formats']['jpeg']['320']) as stored:
+            self.assertEqual(Image.open(stored).size, (320, 533))
+
+    def test_replaced_photos_are_not_processed(self):
+        self.upload(self.photo())
+        self.upload(make_image())
+        queue.run_pending()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_variants['source'], self.recipe.image.name)
+        self.assertFalse(ImageBlob.objects.exclude(name=self.recipe.image.name).exists())
+
+    @override_settings(RECIPE_IMAGE_PROCESSING='inline')
+    def test_inline_processing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(self.photo())
+        self.recipe.refresh_from_db()
+        self.assertEqual(sorted(self.recipe.image_variants['formats']['webp'], key=int), ['320', '640', '1280'])
+
+    def test_build_srcsets(self):
+        variants = {'formats': {'jpeg': {'640': 'b.jpg', '320': 'a.jpg'}, 'webp': {'320': 'a.webp'}}}
+        self.assertEqual(images.build_srcsets(variants, lambda name: f'/media/{name}'), {
+            'jpeg': '/media/a.jpg 320w, /media/b.jpg 640w',
+            'webp': '/media/a.webp 320w',
+            'thumbnail': '/media/a.jpg',
+        })
+        self.assertIsNone(images.build_srcsets({}, str))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ContentAddressedImageTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.token = Token.objects.create(user=self.author)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def upload(self, recipe, name):
+        url = reverse('recipe-image-upload', args=[recipe.pk])
+        self.assertEqual(self.client.post(url, {'image': make_image(name)}, format='multipart').status_code, 200)
+        recipe.refresh_from_db()
+        return recipe.image.name
+
+    def test_identical_uploads_share_one_file_until_the_last_recipe_goes(self):
+        first, second = make_recipe(self.author, 1), make_recipe(self.author, 2)
+        name = self.upload(first, 'one.png')
+        self.assertEqual(self.upload(second, 'two.png'), name)
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 2)
+
+        self.client.delete(reverse('recipe-detail', args=[first.pk]))
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+        self.client.delete(reverse('recipe-detail', args=[second.pk]))
+        # The files go in the background
+        self.assertTrue(default_storage.exists(name))
+        queue.run_pending()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+
+    def test_uploading_an_image_again_before_it_is_collected_keeps_it(self):
+        first, second = make_recipe(self.author, 1), make_recipe(self.author, 2)
+        name = self.upload(first, 'one.png')
+        self.client.delete(reverse('recipe-detail', args=[first.pk]))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 0)
+        self.assertEqual(self.upload(second, 'two.png'), name)
+        # The clean-up job finds the image in use again and leaves it be
+        queue.run_pending()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+        second.refresh_from_db()
+        self.assertTrue(second.image_variants)
+
+    def test_reuploading_the_same_image_keeps_one_reference(self):
+        recipe = make_recipe(self.author, 1)
+        name = self.upload(recipe, 'one.png')
+        self.assertEqual(self.upload(recipe, 'again.png'), name)
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+        self.assertTrue(default_storage.exists(name))
+
+
+class ConditionalRequestTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.token = Token.objects.create(user=self.author)
+        self.recipe = make_recipe(self.author, 0)
+        self.client = APIClient()
+
+    def test_unchanged_recipe_is_not_sent_again(self):
+        url = reverse('recipe-detail', args=[self.recipe.pk])
+        etag = self.client.get(url)['ETag']
+        # The validators are cached with the response, so revalidating costs nothing
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        # A proxy that compressed the body hands the tag back weakened
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=f'"other", W/{etag}').status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.title = "Lemon Chicken"
+            self.recipe.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        url = reverse('recipe-detail', args=[self.recipe.pk])
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_etag_follows_the_list(self):
+        url = reverse('recipe-list-create')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Another page is another representation
+        self.assertNotEqual(self.client.get(url, {'ordering': 'title'})['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_recipe(self.author, 1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # Deleting a recipe moves no date, so lists have no Last-Modified to revalidate
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(title="Garlic Chicken 1").delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(RECIPE_RESPONSE_CACHE_ENABLED=False)
+    def test_list_etag_notices_changes_off_the_page(self):
+        for index in range(1, 12):
+            make_recipe(self.author, index)
+        url = reverse('recipe-list-create')
+        etag = self.client.get(url)['ETag']
+        # Checking the tag costs what the page does (count + page), not a pass over the list
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # The oldest recipe is on the second page, but the count on the first one changes
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_match_guards_edits(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        url = reverse('recipe-detail', args=[self.recipe.pk])
+        etag = self.client.get(url)['ETag']
+        # If-Match compares strongly
+        response = self.client.patch(url, {'title': "Lemon Chicken"}, format='multipart', HTTP_IF_MATCH=f'W/{etag}')
+        self.assertEqual(response.status_code, 412)
+
+        response = self.client.patch(url, {'title': "Lemon Chicken"}, format='multipart', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        new_etag = response['ETag']
+        self.assertEqual(self.client.get(url)['ETag'], new_etag)
+
+        # Still holding the old ETag: somebody else's edit got in first
+        response = self.client.patch(url, {'title': "Garlic Chicken"}, format='multipart', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        response = self.client.delete(url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertTrue(Recipe.objects.filter(pk=self.recipe.pk).exists())
+
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH=new_etag).status_code, 200)
+
+
+class BulkImportExportTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.token = Token.objects.create(user=self.author)
+        authentication.remember(self.token)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def row(self, index, **overrides):
+        row = {
+            'title': f"Tomato Soup {index}", 'description': "Warming.", 'ingredients': "2 tomatoes, 1 onion",
+            'instructions': "Simmer.", 'preparation_time': 5, 'cooking_time': 30, 'servings': 4,
+            'difficulty': 'easy', 'category': 'Soup', 'cuisine': 'French',
+        }
+        row.update(overrides)
+        return row
+
+    def post_ndjson(self, rows):
+        body = '\n'.join(json.dumps(row) if isinstance(row, dict) else row for row in rows)
+        return self.client.generic('POST', reverse('recipe-import'), body, content_type='application/x-ndjson')
+
+    def test_ndjson_import_reports_bad_rows(self):
+        response = self.post_ndjson([self.row(1), self.row(2, difficulty='impossible'), 'not json', self.row(3)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['data']['created'], 2)
+        self.assertEqual([error['line'] for error in response.data['data']['errors']], [2, 3])
+        self.assertIn('difficulty', response.data['data']['errors'][0]['errors'])
+
+        # Imported recipes are searchable and in the pantry like any other
+        search = self.client.get(reverse('recipe-list-create'), {'search': 'tomato soup'})
+        self.assertEqual(search.data['count'], 2)
+        pantry = self.client.get(reverse('recipe-pantry'), {'ingredients': 'onion'})
+        self.assertEqual(pantry.data['count'], 2)
+
+    def test_batches_keep_the_query_count_flat(self):
+        with CaptureQueriesContext(connection) as small:
+            self.post_ndjson([self.row(index) for index in range(3)])
+        with CaptureQueriesContext(connection) as large:
+            self.post_ndjson([self.row(index) for index in range(30)])
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(Recipe.objects.count(), 33)
+
+    def test_csv_import(self):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(self.row(1)))
+        writer.writeheader()
+        writer.writerow(self.row(1))
+        writer.writerow(self.row(2, servings='lots'))
+        response = self.client.generic('POST', reverse('recipe-import'), buffer.getvalue(), content_type='text/csv')
+        self.assertEqual(response.data['data']['created'], 1)
+        self.assertEqual(response.data['data']['errors'][0]['line'], 3)
+
+    def test_export_round_trips(self):
+        self.post_ndjson([self.row(1), self.row(2, is_public=False)])
+        response = self.client.get(reverse('recipe-export'))
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        exported = [json.loads(line) for line in lines]
+        self.assertEqual([row['title'] for row in exported], ["Tomato Soup 1", "Tomato Soup 2"])
+        self.assertEqual([row['is_public'] for row in exported], [True, False])
+
+        response = self.client.get(reverse('recipe-export'), {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        csv_body = b''.join(response.streaming_content).decode()
+        reimport = self.client.generic('POST', reverse('recipe-import'), csv_body, content_type='text/csv')
+        self.assertEqual(reimport.data['data']['created'], 2)
+        self.assertEqual(Recipe.objects.filter(is_public=False).count(), 2)
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    RECIPE_IMAGE_PROCESSING='inline',
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class BenchmarkHarnessTests(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_run_and_compare(self):
+        dataset = benchmark.seed_dataset(users=2, recipes=20, photos=1, seed=3)
+        self.assertEqual(len(dataset.recipe_ids), 20)
+
+        results = benchmark.run_benchmark(dataset, requests=3, warmup=1, scenarios=['list', 'detail', 'my_recipes'])
+        self.assertEqual(set(results['scenarios']), {'list', 'detail', 'my_recipes'})
+        for result in results['scenarios'].values():
+            self.assertEqual(result['errors'], 0, result['status_codes'])
+            self.assertIsNotNone(result['queries_per_request'])
+        self.assertEqual(results['meta']['dataset'], {'users': 2, 'recipes': 20})
+
+        self.assertEqual(benchmark.compare_results(results, results), [])
+        baseline = json.loads(json.dumps(results))
+        baseline['scenarios']['my_recipes']['queries_per_request'] -= 1
+        regressions = benchmark.compare_results(results, baseline)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('my_recipes', regressions[0])
+
+    def test_serializer_benchmark(self):
+        benchmark.seed_dataset(users=2, recipes=20, photos=1, seed=3)
+        results = benchmark.serializer_benchmark(repeat=2)
+        self.assertEqual(results['rows'], 20)
+        self.assertTrue(results['identical'])
+        self.assertEqual(len(results['us_per_row']), 6)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, RECIPE_RESPONSE_CACHE_ENABLED=False)
+class AsyncReadViewTests(TestCase):
+    """The async read views have to send exactly what the sync ones do, with the same queries."""
+
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.token = Token.objects.create(user=self.author)
+        self.recipe = make_recipe(self.author, 0)
+        for index in range(1, 14):
+            make_recipe(self.author, index, category='Lunch' if index % 3 else 'Dinner')
+        make_recipe(self.author, 99, is_public=False)
+        self.client = APIClient()
+
+    def fetch(self, url, **extra):
+        # Start cold each time, so both views run the same queries - and with the same
+        # response cache version tokens, which list ETags go by
+        clear_caches()
+        authentication.remember(self.token)
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch('recipes.response_cache.uuid.uuid4', return_value=uuid.UUID(int=1)):
+            response = self.client.get(url, **extra)
+        return response, len(queries)
+
+    def assertSameResponse(self, url, **extra):
+        expected, expected_queries = self.fetch(url, **extra)
+        with override_settings(ROOT_URLCONF=__name__):
+            actual, actual_queries = self.fetch(url, **extra)
+        self.assertEqual(actual.status_code, expected.status_code, url)
+        self.assertEqual(actual.content, expected.content, url)
+        for header in ('Content-Type', 'ETag', 'Last-Modified', 'Allow', 'Vary', 'WWW-Authenticate'):
+            self.assertEqual(actual.get(header), expected.get(header), f"{header} of {url}")
+        self.assertEqual(actual_queries, expected_queries, url)
+        return actual
+
+    def test_same_responses_as_the_sync_views(self):
+        urls = [
+            '/api/recipes/', '/api/recipes/?page=2', '/api/recipes/?page=9',
+            '/api/recipes/?search=garlic%20chicken', '/api/recipes/?category=Dinner&ordering=title',
+            '/api/recipes/?pagination=cursor', '/api/recipes/?cursor=nonsense',
+            f'/api/recipes/{self.recipe.pk}/', '/api/recipes/987654/',
+            '/api/users/chef/public-recipes/', '/api/users/nobody/public-recipes/',
+        ]
+        for url in urls:
+            self.assertSameResponse(url)
+
+        next_page = self.assertSameResponse('/api/recipes/?pagination=cursor').json()['next']
+        self.assertSameResponse(next_page)
+
+        for url in urls[:3]:
+            self.assertSameResponse(url, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertSameResponse('/api/recipes/', HTTP_AUTHORIZATION='Token not-a-token')
+
+    @override_settings(RECIPE_RESPONSE_CACHE_ENABLED=True, ROOT_URLCONF=__name__)
+    def test_cache_and_conditional_requests(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        first = self.client.get(url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(ROOT_URLCONF=__name__)
+    def test_writes_and_the_browsable_api_use_the_sync_view(self):
+        authentication.remember(self.token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        response = self.client.post('/api/recipes/', {
+            'title': "Tomato Soup", 'description': "Warming.", 'ingredients': "Tomatoes, salt",
+            'instructions': "Simmer.", 'preparation_time': 5, 'cooking_time': 30, 'servings': 4,
+            'difficulty': 'easy', 'category': 'Lunch', 'cuisine': 'Italian',
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get(f"/api/recipes/{response.data['data']['id']}/", HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Tomato Soup', response.content)
+        self.assertIn(b'<title>Recipe Detail', response.content)
+        self.assertEqual(self.client.options('/api/recipes/').data['name'], "Recipe List Create")
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, RECIPE_RESPONSE_CACHE_ENABLED=False)
+class FastListSerializationTests(TestCase):
+    """The list fast path (RecipeRowSerializer + ORJSONRenderer) has to send RecipeSerializer's bytes."""
+
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.token = Token.objects.create(user=self.author)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.with_image = make_recipe(self.author, 0, title="Crème brûlée   🍮")
+        blob = images.store_upload(benchmark.make_photo(random.Random(1)))
+        Recipe.objects.filter(pk=self.with_image.pk).update(image=blob.name)
+        images.generate_variants(self.with_image.pk, blob.name)
+        make_recipe(self.author, 1, description='')
+        make_recipe(None, 2)
+        self.request = Request(APIRequestFactory().get('/api/recipes/'))
+
+    def test_rows_serialize_and_render_like_recipe_serializer(self):
+        queryset = Recipe.objects.with_author().order_by('pk')
+        context = {'request': self.request}
+        expected = RecipeSerializer(queryset, many=True, context=context).data
+        self.assertTrue(expected[0]['image_variants'])
+        self.assertNotIn('author', expected[2])
+
+        data = RecipeRowSerializer(RecipeRowSerializer.rows(queryset), context=context).data
+        self.assertEqual(JSONRenderer().render(data), JSONRenderer().render(expected))
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(expected))
+
+    def test_list_endpoints_use_the_fast_path(self):
+        mine = Recipe.objects.filter(author=self.author)
+        for url, queryset in ((reverse('recipe-list-create'), Recipe.objects.all()), (reverse('my-recipes'), mine)):
+            response = self.client.get(url, {'ordering': 'created_at'})
+            expected = RecipeSerializer(
+                queryset.order_by('created_at'), many=True, context={'request': self.request}, fields=fieldsets.SUMMARY_FIELDS
+            ).data
+            self.assertEqual(response.content, JSONRenderer().render({
+                'count': len(expected), 'next': None, 'previous': None, 'results': expected,
+            }))
+
+        # Cursor links are built from the rows too
+        response = self.client.get(reverse('my-recipes'), {'pagination': 'cursor', 'ordering': 'created_at'})
+        self.assertEqual([recipe['id'] for recipe in response.json()['results']], [recipe.pk for recipe in mine.order_by('created_at')])
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            'when': timezone.now(), 'day': datetime.date(2024, 2, 29), 'price': Decimal('1.50'),
+            'lazy': gettext_lazy('Not found.'), 1: [None, True, 0.25, ' \x01"'], 'nested': {'ids': {3, 4}},
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        # Indented JSON and integers orjson can't hold are left to JSONRenderer
+        for data, media_type in (({'a': [1]}, 'application/json; indent=2'), ({'big': 2 ** 70}, None)):
+            self.assertEqual(ORJSONRenderer().render(data, media_type), JSONRenderer().render(data, media_type))
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.recipe = make_recipe(self.author, 0)
+        self.client = APIClient()
+
+    def get(self, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        sql = ' '.join(query['sql'] for query in queries)
+        return response, sql
+
+    def test_lists_send_a_summary_without_reading_the_text_columns(self):
+        for url in (reverse('recipe-list-create'), reverse('public-user-recipes', args=['chef'])):
+            response, sql = self.get(url)
+            self.assertEqual(list(response.json()['results'][0]), list(fieldsets.SUMMARY_FIELDS))
+            self.assertNotIn('"instructions"', sql)
+            self.assertNotIn('"description"', sql)
+
+        response, sql = self.get(reverse('recipe-list-create'), {'fields': 'title,description', 'omit': 'title'})
+        self.assertEqual(response.json()['results'], [{'description': self.recipe.description}])
+        self.assertNotIn('"instructions"', sql)
+
+    def test_detail_sends_everything_unless_asked(self):
+        url = reverse('recipe-detail', args=[self.recipe.pk])
+        full, sql = self.get(url)
+        self.assertIn('instructions', full.json())
+        self.assertEqual(sql.count('JOIN "users_customuser"'), 2)
+
+        sparse, sql = self.get(url, {'fields': 'title,author'})
+        self.assertEqual(sparse.json(), {'title': self.recipe.title, 'author': 'chef'})
+        self.assertNotIn('"instructions"', sql)
+        self.assertNotEqual(sparse['ETag'], full['ETag'])
+
+        omitted, sql = self.get(url, {'omit': ['instructions', 'ingredients,author']})
+        self.assertEqual(set(full.json()) - set(omitted.json()), {'instructions', 'ingredients', 'author'})
+        # Only the ETag's lookup joins the author now, not the recipe's
+        self.assertEqual(sql.count('JOIN "users_customuser"'), 1)
+
+    def test_cursor_links_work_with_any_fieldset(self):
+        for index in range(12):
+            make_recipe(self.author, index + 1)
+        response = self.client.get(reverse('recipe-list-create'), {'pagination': 'cursor', 'fields': 'title'})
+        self.assertEqual(len(response.json()['results']), 10)
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([list(recipe) for recipe in response.json()['results']], [['title']] * 3)
+
+    def test_unknown_fields_are_a_bad_request(self):
+        response = self.client.get(reverse('recipe-list-create'), {'fields': 'title,secret', 'omit': 'nope'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'fields', 'omit'})
+
+
+class FacetCountTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.token = Token.objects.create(user=self.author)
+        self.dinner = make_recipe(self.author, 0)
+        make_recipe(self.author, 1, category='Soup', ingredients="Tomatoes, onion")
+        make_recipe(self.author, 2, difficulty='hard', is_public=False)
+        self.client = APIClient()
+
+    def assertCountsRight(self):
+        self.assertEqual(facets.rebuild(dry_run=True)[1], 0)
+
+    def test_counts_follow_every_change(self):
+        self.assertCountsRight()
+        self.dinner.cuisine = 'Thai'
+        self.dinner.save()
+        self.assertCountsRight()
+
+        # Saved without having loaded the counted columns
+        recipe = Recipe.objects.only('id').get(pk=self.dinner.pk)
+        recipe.is_public = False
+        recipe.save(update_fields=['is_public'])
+        self.assertCountsRight()
+
+        Recipe.objects.only('id', 'title', 'author_id').get(pk=self.dinner.pk).delete()
+        self.assertCountsRight()
+        Recipe.objects.filter(category='Soup').delete()
+        self.assertCountsRight()
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        body = json.dumps({
+            'title': "Imported", 'description': "-", 'ingredients': "rice", 'instructions': "-",
+            'preparation_time': 1, 'cooking_time': 1, 'servings': 1, 'difficulty': 'easy',
+            'category': 'Dinner', 'cuisine': 'Thai',
+        })
+        self.client.generic('POST', reverse('recipe-import'), body, content_type='application/x-ndjson')
+        self.assertCountsRight()
+
+    def test_facets_follow_the_filters_and_search(self):
+        url = reverse('recipe-facets')
+        # Straight from the counts table
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'cuisine': 'Italian', 'difficulty': 'easy'})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['facets']['category'], [
+            {'value': 'Dinner', 'count': 1}, {'value': 'Soup', 'count': 1},
+        ])
+        self.assertEqual(response.data['facets']['difficulty'], [{'value': 'easy', 'count': 2}])
+
+        response = self.client.get(url, {'search': 'tomatoes'})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['facets']['category'], [{'value': 'Soup', 'count': 1}])
+
+        self.assertEqual(self.client.get(url, {'difficulty': 'impossible'}).status_code, 400)
+
+    def test_rebuild_command(self):
+        RecipeFacetCount.objects.update(count=F('count') + 5)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_facet_counts', '--check', stdout=io.StringIO())
+        call_command('rebuild_facet_counts', stdout=io.StringIO())
+        self.assertCountsRight()
+
+
+class DatabaseConfigTests(TestCase):
+    default_url = 'sqlite:////tmp/db.sqlite3'
+
+    def config(self, **variables):
+        with mock.patch.dict('os.environ', variables, clear=True):
+            return database_config(environ.Env(), self.default_url)
+
+    def test_sqlite_is_tuned_for_concurrent_access(self):
+        config = self.config()
+        self.assertEqual(config['NAME'], '/tmp/db.sqlite3')
+        self.assertEqual(config['OPTIONS']['timeout'], 5.0)
+        self.assertEqual(config['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertIn('journal_mode=WAL', config['OPTIONS']['init_command'])
+        self.assertNotIn('init_command', self.config(SQLITE_WAL='false')['OPTIONS'])
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA busy_timeout')
+                self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_postgres_keeps_connections(self):
+        config = self.config(DATABASE_URL='postgres://chef:secret@db:5432/recipes', CONN_MAX_AGE='300')
+        self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(config['CONN_MAX_AGE'], 300)
+        self.assertTrue(config['CONN_HEALTH_CHECKS'])
+        self.assertNotIn('pool', config['OPTIONS'])
+
+    def test_postgres_pool(self):
+        config = self.config(
+            DATABASE_URL='postgres://chef:secret@db:5432/recipes', DATABASE_POOL='true', DATABASE_POOL_MAX_SIZE='20',
+        )
+        self.assertEqual(config['OPTIONS']['pool'], {'min_size': 2, 'max_size': 20, 'timeout': 10.0})
+        # Django refuses persistent connections together with a pool
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTests(TestCase):
+    """Which database a request reads from; nothing here queries a replica."""
+
+    def setUp(self):
+        clear_caches()
+        self.factory = RequestFactory()
+        self.used = []
+
+        def view(request):
+            self.used.append((router.db_for_read(Recipe), router.db_for_write(Recipe)))
+            return HttpResponse(status=400 if request.GET.get('fail') else 200)
+        self.middleware = replicas.ReplicaRoutingMiddleware(view)
+
+    def test_reads_of_safe_requests_go_to_a_replica(self):
+        self.middleware(self.factory.get('/api/recipes/'))
+        self.middleware(self.factory.post('/api/recipes/'))
+        self.assertEqual(self.used, [('replica1', 'default'), ('default', 'default')])
+        # Outside a request, everything is on the primary
+        self.assertEqual(router.db_for_read(Recipe), 'default')
+
+    def test_writing_pins_the_client_to_the_primary(self):
+        response = self.middleware(self.factory.post('/api/recipes/', HTTP_AUTHORIZATION='Token abc'))
+        self.assertEqual(response.cookies[replicas.PIN_COOKIE]['max-age'], 10)
+        self.middleware(self.factory.get('/api/recipes/', HTTP_AUTHORIZATION='Token abc'))
+        self.middleware(self.factory.get('/api/recipes/', HTTP_AUTHORIZATION='Token other'))
+        self.factory.cookies[replicas.PIN_COOKIE] = '1'
+        self.middleware(self.factory.get('/api/recipes/'))
+        self.assertEqual([used[0] for used in self.used], ['default', 'default', 'replica1', 'default'])
+
+        # A write that failed changed nothing, so there is nothing to read back
+        self.factory.cookies.clear()
+        response = self.middleware(self.factory.post('/api/recipes/?fail=1', HTTP_AUTHORIZATION='Token xyz'))
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+        self.assertFalse(replicas.is_pinned(self.factory.get('/', HTTP_AUTHORIZATION='Token xyz')))
+
+    def test_async_requests_stay_async(self):
+        async def view(request):
+            self.used.append((router.db_for_read(Recipe), router.db_for_write(Recipe)))
+            return HttpResponse()
+        middleware = replicas.ReplicaRoutingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        response = async_to_sync(middleware)(self.factory.post('/api/recipes/', HTTP_AUTHORIZATION='Token abc'))
+        self.assertEqual(response.cookies[replicas.PIN_COOKIE]['max-age'], 10)
+        async_to_sync(middleware)(self.factory.get('/api/recipes/', HTTP_AUTHORIZATION='Token abc'))
+        async_to_sync(middleware)(self.factory.get('/api/recipes/'))
+        self.assertEqual([used[0] for used in self.used], ['default', 'default', 'replica1'])
+
+    def test_login_pins_the_new_token(self):
+        User.objects.create_user(username='chef', password='secret-pass-123')
+        response = self.client.post(reverse('api_token_auth'), {'username': 'chef', 'password': 'secret-pass-123'})
+        token = response.data['data']['token']
+        self.assertTrue(replicas.is_pinned(self.factory.get('/', HTTP_AUTHORIZATION=f'Token {token}')))
+
+
+@unittest.skipUnless(similar.available(), "needs NumPy")
+class SimilarRecipeTests(TestCase):
+    def setUp(self):
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir, ignore_errors=True)
+        overrides = override_settings(RECIPE_SIMILAR_INDEX_DIR=index_dir, RECIPE_SIMILAR_DIMENSIONS=1024)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pasta = make_recipe(self.author, 0, title="Tomato Basil Spaghetti",
+                                     ingredients="spaghetti, tomatoes, basil, garlic, olive oil")
+            self.penne = make_recipe(self.author, 1, title="Penne with Tomato Sauce",
+                                     ingredients="penne, tomatoes, garlic, basil, parmesan")
+            self.curry = make_recipe(self.author, 2, title="Green Curry", cuisine='Thai',
+                                     ingredients="chicken, coconut milk, green curry paste, basil, rice")
+            self.secret = make_recipe(self.author, 3, title="Secret Tomato Spaghetti", is_public=False,
+                                      ingredients="spaghetti, tomatoes, basil, garlic")
+            for index in range(4, 10):
+                make_recipe(self.author, index)
+        # The word weights come from a full build, as after `manage.py rebuild_similar_index`
+        similar.rebuild()
+
+    def similar(self, recipe, **params):
+        response = self.client.get(reverse('recipe-similar', args=[recipe.pk]), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_most_similar_public_recipes_first(self):
+        results = self.similar(self.pasta, limit=3)
+        self.assertEqual([result['id'] for result in results][:1], [self.penne.pk])
+        self.assertEqual(len(results), 3)
+        ids = [result['id'] for result in results]
+        self.assertNotIn(self.pasta.pk, ids)
+        self.assertNotIn(self.secret.pk, ids)
+        similarities = [result['similarity'] for result in results]
+        self.assertEqual(similarities, sorted(similarities, reverse=True))
+        self.assertNotIn('ingredients', results[0])
+
+    def test_index_follows_edits_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.curry.title = "Spaghetti Pomodoro"
+            self.curry.cuisine = 'Italian'
+            self.curry.ingredients = "spaghetti, tomatoes, basil, garlic, olive oil"
+            self.curry.save()
+        self.assertEqual(self.similar(self.pasta, limit=1)[0]['id'], self.curry.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.curry.delete()
+        self.assertNotIn(self.curry.pk, [result['id'] for result in self.similar(self.pasta)])
+        self.assertEqual(similar.get_index().row_of(self.curry.pk), None)
+
+    def test_bulk_import_grows_the_index_and_rebuild_agrees(self):
+        token = Token.objects.create(user=self.author)
+        body = '\n'.join(json.dumps({
+            'title': f"Tomato Spaghetti {index}", 'description': 'x', 'instructions': 'x',
+            'ingredients': "spaghetti, tomatoes, basil", 'preparation_time': 1, 'cooking_time': 1,
+            'servings': 1, 'difficulty': 'easy', 'category': 'Dinner', 'cuisine': 'Italian',
+        }) for index in range(80))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.generic('POST', reverse('recipe-import'), body, content_type='application/x-ndjson',
+                                           HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response.status_code, 201)
+        self.assertGreaterEqual(similar.get_index().capacity, 90)
+        self.assertEqual(len(self.similar(self.pasta, limit=50)), 50)
+
+        call_command('rebuild_similar_index', stdout=io.StringIO())
+        index = similar.get_index()
+        self.assertEqual(int((index.ids != 0).sum()), Recipe.objects.count())
+        # The imports differ by a number, which doesn't count
+        imported = Recipe.objects.get(title="Tomato Spaghetti 0")
+        nearest = self.similar(imported, limit=1)[0]
+        self.assertTrue(nearest['title'].startswith("Tomato Spaghetti"))
+        self.assertAlmostEqual(nearest['similarity'], 1.0, places=5)
+
+    def test_shortlist_finds_what_a_full_scan_does(self):
+        index = similar.get_index()
+        vector = index.vector(similar.features(self.pasta))
+        full = index.search(vector, 3, exclude=(self.pasta.pk,))
+        with mock.patch.object(similar, 'SHORTLIST', 4):
+            rows = index.shortlist(vector, 4)
+            self.assertEqual(len(rows), 4)
+            self.assertIn(index.row_of(self.penne.pk), rows)
+            self.assertEqual(index.search(vector, 3, exclude=(self.pasta.pk,)), full)
+
+
+@override_settings(FEED_FANOUT_MAX_FOLLOWERS=2, FEED_TIMELINE_LENGTH=5, REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK, 'PAGE_SIZE': 3,
+})
+class HomeFeedTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.reader = User.objects.create_user(username='reader', password='secret-pass-123')
+        self.chef = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.stranger = User.objects.create_user(username='stranger', password='secret-pass-123')
+        self.client = APIClient()
+        self.token = Token.objects.create(user=self.reader)
+        authentication.remember(self.token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def post_recipe(self, author, index, **fields):
+        client = APIClient()
+        client.force_authenticate(author)
+        data = {
+            'title': f"Recipe {index}", 'description': 'x', 'ingredients': 'eggs', 'instructions': 'x',
+            'preparation_time': 1, 'cooking_time': 1, 'servings': 1, 'difficulty': 'easy',
+            'category': 'Dinner', 'cuisine': 'Thai', **fields,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('recipe-list-create'), data)
+        self.assertEqual(response.status_code, 201)
+        return response.data['data']['id']
+
+    def feed(self, **params):
+        response = self.client.get(reverse('home-feed'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_follow_backfills_and_new_recipes_are_pushed(self):
+        old = make_recipe(self.chef, 0)
+        make_recipe(self.chef, 1, is_public=False)
+        make_recipe(self.stranger, 2)
+        response = self.client.post(reverse('user-follow', args=['chef']))
+        self.assertEqual((response.status_code, response.data['follower_count']), (201, 1))
+        self.assertEqual(self.client.post(reverse('user-follow', args=['chef'])).status_code, 200)
+        self.assertEqual([recipe['id'] for recipe in self.feed()['results']], [old.pk])
+
+        new = self.post_recipe(self.chef, 3)
+        timelines.push_recipes([make_recipe(self.chef, 4, is_public=False)])
+        self.post_recipe(self.stranger, 5)
+        results = self.feed()['results']
+        self.assertEqual([recipe['id'] for recipe in results], [new, old.pk])
+        self.assertNotIn('ingredients', results[0])
+
+        self.client.delete(reverse('user-follow', args=['chef']))
+        self.assertEqual(self.feed()['results'], [])
+        self.assertEqual(User.objects.get(pk=self.chef.pk).follower_count, 0)
+
+    def test_pages_and_trimming(self):
+        timelines.follow(self.reader, self.chef)
+        posted = [self.post_recipe(self.chef, index) for index in range(7)]
+        self.assertEqual(HomeTimeline.objects.get(user=self.reader).recipe_ids, posted[::-1][:5])
+
+        first = self.feed()
+        self.assertEqual([recipe['id'] for recipe in first['results']], posted[::-1][:3])
+        second = self.client.get(first['next']).data
+        self.assertEqual([recipe['id'] for recipe in second['results']], posted[::-1][3:5])
+        self.assertIsNone(second['next'])
+
+        Recipe.objects.filter(pk=posted[-1]).delete()
+        self.assertEqual([recipe['id'] for recipe in self.feed()['results']], posted[::-1][1:3])
+
+    def test_authors_with_many_followers_are_pulled(self):
+        fans = [User.objects.create_user(username=f'fan{index}', password='x') for index in range(2)]
+        for fan in fans:
+            timelines.follow(fan, self.chef)
+        early = self.post_recipe(self.chef, 0)
+        timelines.follow(self.reader, self.chef)
+        # Three followers: past the limit, so nobody's row gets the next one
+        late = self.post_recipe(self.chef, 1)
+        self.assertNotIn(late, HomeTimeline.objects.get(user=fans[0]).recipe_ids)
+        self.assertEqual(HomeTimeline.objects.get(user=fans[0]).pulled_authors, [self.chef.pk])
+        self.assertEqual([recipe['id'] for recipe in self.feed()['results']], [late, early])
+
+        timelines.unfollow(fans[1], self.chef)
+        self.assertEqual(HomeTimeline.objects.get(user=fans[0]).pulled_authors, [])
+        self.assertEqual(HomeTimeline.objects.get(user=fans[0]).recipe_ids, [late, early])
+
+    def test_feed_queries_dont_grow_with_follows(self):
+        timelines.follow(self.reader, self.chef)
+        self.post_recipe(self.chef, 0)
+        with self.assertNumQueries(2):
+            self.feed()
+        for index in range(5):
+            author = User.objects.create_user(username=f'author{index}', password='x')
+            timelines.follow(self.reader, author)
+            self.post_recipe(author, 10 + index)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(self.feed()['results']), 3)
+
+    def test_cant_follow_yourself_or_nobody(self):
+        self.assertEqual(self.client.post(reverse('user-follow', args=['reader'])).status_code, 400)
+        self.assertEqual(self.client.post(reverse('user-follow', args=['nobody'])).status_code, 404)
+        self.assertEqual(APIClient().get(reverse('home-feed')).status_code, 401)
+
+
+@override_settings(RECIPE_STATS_FLUSH_SECONDS=10, TRENDING_HALF_LIFE_HOURS=24, TRENDING_ENGAGEMENT_WEIGHT=5)
+class PopularityTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.soup = make_recipe(self.author, 0)
+        self.stew = make_recipe(self.author, 1)
+        self.secret = make_recipe(self.author, 2, is_public=False)
+        self.client = APIClient()
+
+    def flush(self):
+        # Every period counted so far has ended a minute from now
+        return popularity.flush(until=time.time() + 60)
+
+    def test_views_are_counted_without_writing(self):
+        url = reverse('recipe-detail', args=[self.soup.pk])
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(3):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+        self.assertFalse(RecipeStats.objects.exists())
+
+        token = Token.objects.create(user=self.author)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        engage = reverse('recipe-engagement', args=[self.soup.pk])
+        self.assertEqual(self.client.post(engage, {'kind': 'cook'}).status_code, 202)
+        self.assertEqual(self.client.post(engage, {'kind': 'eat'}).status_code, 400)
+        # Cooking it again today doesn't count twice, saving it does count
+        self.assertEqual(self.client.post(engage, {'kind': 'cook'}).status_code, 202)
+        self.assertEqual(self.client.post(engage, {'kind': 'save'}).status_code, 202)
+
+        self.assertEqual(self.flush(), 1)
+        stats = RecipeStats.objects.get(recipe=self.soup)
+        self.assertEqual((stats.views, stats.engagements, stats.score), (3, 2, 13))
+        # Flushed counts are gone from the cache
+        self.assertEqual(self.flush(), 0)
+        call_command('recipe_stats_worker', '--once', stdout=io.StringIO())
+
+    def test_reads_dont_fail_when_counting_does(self):
+        broken = mock.Mock()
+        for method in ('incr', 'add', 'set'):
+            getattr(broken, method).side_effect = ConnectionError("cache is down")
+            setattr(broken, f'a{method}', mock.AsyncMock(side_effect=ConnectionError("cache is down")))
+        url = reverse('recipe-detail', args=[self.soup.pk])
+        with mock.patch.object(popularity, 'get_cache', return_value=broken), \
+                self.assertLogs('recipes.popularity', 'ERROR') as logs:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            async_to_sync(popularity.arecord)(self.soup.pk)
+        self.assertEqual(len(logs.records), 3)
+        for record in logs.records:
+            self.assertIn('cache is down', str(record.exc_info[1]))
+
+    def test_engagements_only_count_for_visible_recipes_and_are_throttled(self):
+        critic = User.objects.create_user(username='critic', password='secret-pass-123')
+        self.client.force_authenticate(critic)
+        for pk in (self.secret.pk, 987654):
+            response = self.client.post(reverse('recipe-engagement', args=[pk]), {'kind': 'save'})
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.flush(), 0)
+        # The author can engage with their own private recipe
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.post(reverse('recipe-engagement', args=[self.secret.pk]), {'kind': 'cook'}).status_code, 202)
+
+        with mock.patch.object(ScopedRateThrottle, 'THROTTLE_RATES', {'engagements': '2/minute'}):
+            self.client.force_authenticate(User.objects.create_user(username='fan', password='secret-pass-123'))
+            engage = reverse('recipe-engagement', args=[self.soup.pk])
+            statuses = [self.client.post(engage, {'kind': kind}).status_code for kind in popularity.ENGAGEMENTS]
+        self.assertEqual(statuses, [202, 202, 429])
+
+    def test_counts_for_deleted_recipes_are_dropped(self):
+        popularity.record(self.stew.pk)
+        self.stew.delete()
+        self.assertEqual(self.flush(), 0)
+
+    def test_scores_decay_and_trending_is_materialized(self):
+        then = timezone.now() - datetime.timedelta(days=2)
+        popularity.apply_counts({self.soup.pk: {'view': 10, 'engagement': 0}}, now=then)
+        popularity.apply_counts({self.secret.pk: {'view': 100, 'engagement': 0}}, now=then)
+        now = timezone.now()
+        popularity.apply_counts({self.stew.pk: {'view': 4, 'engagement': 0}}, now=now)
+
+        self.assertEqual(popularity.refresh_trending(now), 2)
+        response = self.client.get(reverse('recipe-trending'))
+        self.assertEqual([recipe['id'] for recipe in response.data], [self.stew.pk, self.soup.pk])
+        self.assertNotIn('ingredients', response.data[0])
+
+        # Two half-lives later the old views are worth a quarter, and the new ones add on
+        popularity.apply_counts({self.soup.pk: {'view': 2, 'engagement': 0}}, now=now)
+        self.assertAlmostEqual(RecipeStats.objects.get(recipe=self.soup).score, 4.5, places=3)
+        popularity.refresh_trending(now)
+        response = self.client.get(reverse('recipe-trending'))
+        self.assertEqual([recipe['id'] for recipe in response.data], [self.soup.pk, self.stew.pk])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_SERVE='django', MEDIA_CACHE_MAX_AGE=31536000, MEDIA_MUTABLE_MAX_AGE=3600)
+class MediaServingTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.recipe = make_recipe(self.author, 0)
+        self.name = self.attach(self.recipe, make_image('soup.png'))
+        self.content = default_storage.open(self.name).read()
+        self.client = APIClient()
+
+    def attach(self, recipe, upload):
+        blob = images.store_upload(upload)
+        Recipe.objects.filter(pk=recipe.pk).update(image=blob.name)
+        images.generate_variants(recipe.pk, blob.name)
+        return blob.name
+
+    def url(self, name):
+        return settings.MEDIA_URL + name
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_public_photos_are_cached_for_good(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url(self.name))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        # Shared caches have to give it up once the recipe is made private
+        self.assertEqual(set(response['Cache-Control'].split(', ')),
+                         {'public', 'max-age=31536000', 's-maxage=3600', 'immutable'})
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+        response = self.client.get(self.url(self.name), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('immutable', response['Cache-Control'])
+
+        variant = Recipe.objects.get(pk=self.recipe.pk).image_variants['formats']['webp']['8']
+        response = self.client.get(self.url(variant))
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_ranges(self):
+        size = len(self.content)
+        response = self.client.get(self.url(self.name), HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 0-9/{size}')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(response), self.content[:10])
+
+        response = self.client.get(self.url(self.name), HTTP_RANGE='bytes=-5')
+        self.assertEqual(self.body(response), self.content[-5:])
+        response = self.client.get(self.url(self.name), HTTP_RANGE=f'bytes=10-{size * 2}')
+        self.assertEqual(self.body(response), self.content[10:])
+
+        response = self.client.get(self.url(self.name), HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{size}'))
+
+        # Several ranges, or a range of a version the client no longer has: the whole file
+        for headers in ({'HTTP_RANGE': 'bytes=0-1,5-6'}, {'HTTP_RANGE': 'bytes=0-1', 'HTTP_IF_RANGE': '"stale"'}):
+            response = self.client.get(self.url(self.name), **headers)
+            self.assertEqual((response.status_code, self.body(response)), (200, self.content))
+        etag = response['ETag']
+        response = self.client.get(self.url(self.name), HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+    def test_private_photos_are_only_for_their_author(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_public=False)
+        url = self.url(self.name)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        stranger = Token.objects.create(user=User.objects.create_user(username='stranger', password='secret-pass-123'))
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Token {stranger.key}').status_code, 404)
+
+        token = Token.objects.create(user=self.author)
+        response = self.client.get(url, HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response['Cache-Control'].split(', ')), {'private', 'max-age=3600'})
+        self.assertIn('Authorization', response['Vary'])
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        # Shared with a public recipe, it's public
+        make_recipe(None, 1, image=self.name)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_authors_get_signed_urls_for_private_photos(self):
+        # What the frontend does: fetch the recipe with its token, then hand the URLs to an <img>,
+        # which sends no Authorization header
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_public=False)
+        token = Token.objects.create(user=self.author)
+        authenticated = APIClient()
+        authenticated.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        detail = authenticated.get(reverse('recipe-detail', args=[self.recipe.pk])).json()
+        listed = authenticated.get(reverse('my-recipes')).json()['results'][0]
+        self.assertEqual((listed['image'], listed['image_variants']), (detail['image'], detail['image_variants']))
+        thumbnail = detail['image_variants']['thumbnail']
+        for url in (detail['image'], thumbnail):
+            self.assertIn('signature=', url)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(set(response['Cache-Control'].split(', ')), {'private', 'max-age=3600'})
+        self.assertEqual(self.body(self.client.get(detail['image'])), self.content)
+
+        # A signature is for one file, and only until it expires
+        photo_query = detail['image'].split('?')[1]
+        self.assertEqual(self.client.get(f"{thumbnail.split('?')[0]}?{photo_query}").status_code, 404)
+        with mock.patch('recipes.media.time.time', return_value=time.time() + 3 * settings.MEDIA_SIGNED_URL_MAX_AGE):
+            self.assertEqual(self.client.get(detail['image']).status_code, 404)
+        # Other people don't get one, and nobody does for a public photo
+        stranger = Token.objects.create(user=User.objects.create_user(username='stranger', password='secret-pass-123'))
+        response = self.client.get(reverse('recipe-detail', args=[self.recipe.pk]), HTTP_AUTHORIZATION=f'Token {stranger.key}')
+        self.assertNotIn('signature=', response.json()['image'])
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_public=True)
+        self.assertNotIn('signature=', authenticated.get(reverse('recipe-detail', args=[self.recipe.pk])).json()['image'])
+
+    def test_signed_urls_expire_with_the_etag(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_public=False)
+        token = Token.objects.create(user=self.author)
+        url = reverse('recipe-detail', args=[self.recipe.pk])
+        first = self.client.get(url, HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = self.client.get(url, HTTP_AUTHORIZATION=f'Token {token.key}', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        later = time.time() + settings.MEDIA_SIGNED_URL_MAX_AGE
+        with mock.patch('recipes.media.time.time', return_value=later):
+            response = self.client.get(url, HTTP_AUTHORIZATION=f'Token {token.key}', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.json()['image'], first.json()['image'])
+
+    def test_only_recipe_images_are_served(self):
+        unused = default_storage.save('recipe_images/unused.png', make_image())
+        for name in (unused, 'recipe_images/../../db.sqlite3', 'recipe_images/variants/nothing_320w.jpg', 'other.txt'):
+            self.assertEqual(self.client.get(self.url(name)).status_code, 404, name)
+
+    def test_photos_named_the_old_way_are_revalidated(self):
+        legacy = make_recipe(self.author, 2)
+        name = default_storage.save('recipe_images/old photo.png', make_image())
+        Recipe.objects.filter(pk=legacy.pk).update(image=name)
+        variants = images.generate_variants(legacy.pk, name)
+        response = self.client.get(self.url(name))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(self.client.get(self.url(variants['formats']['jpeg']['8'])).status_code, 200)
+
+    def test_offloading(self):
+        with override_settings(MEDIA_SERVE='x-accel-redirect', MEDIA_ACCEL_PREFIX='/protected-media/'):
+            response = self.client.get(self.url(self.name))
+            self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+            self.assertEqual(response.content, b'')
+            self.assertIn('immutable', response['Cache-Control'])
+        with override_settings(MEDIA_SERVE='x-sendfile'):
+            response = self.client.get(self.url(self.name))
+            self.assertEqual(response['X-Sendfile'], default_storage.path(self.name))
+        with override_settings(MEDIA_SERVE='off'):
+            self.assertEqual(self.client.get(self.url(self.name)).status_code, 404)
@@ -0,0 +1,205 @@
+"""
+Home feeds: the newest public recipes by the authors a user follows.
+
+Working a feed out when it's read - "recipes whose author is one of these N people,
+newest first" - costs more the more people you follow, and everybody reads their feed
+far more often than anybody posts. So feeds are materialized instead: each user has a
+HomeTimeline row holding the ids of the recipes in their feed, newest first and at most
+FEED_TIMELINE_LENGTH long. Posting a recipe pushes its id into the row of every follower
+of the author (fan-out on write, ``push_recipes``, after the transaction commits), and
+reading a feed is one primary-key lookup plus one query for the recipes on the page,
+however many people the reader follows.
+
+Pushing costs a row update per follower, which is fine for most authors and not for
+the few with very many followers. Authors with more than FEED_FANOUT_MAX_FOLLOWERS
+aren't pushed at all: each of their followers has them in ``pulled_authors``, and the
+feed reads their newest recipes as it's read (fan-out on read), merged in by id. When
+an author crosses the line one way or the other, their followers' rows are switched
+over (``_start_pulling``, ``_stop_pulling``) by the follow or unfollow that did it, while
+it holds the author's row locked (``_lock_authors``).
+
+Following someone backfills your feed with their newest recipes; unfollowing takes them
+out again. A recipe that's deleted or made private later stays in the rows and is left
+out when the feed is read, and a recipe made public after it was posted is only in the
+feeds of people who follow its author from then on.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from users.models import CustomUser, Follow
+from .models import HomeTimeline, Recipe
+
+# Followers are updated this many rows at a time
+CHUNK_SIZE = 500
+
+
+def get_timeline_length():
+    return getattr(settings, 'FEED_TIMELINE_LENGTH', 500)
+
+
+def get_fanout_limit():
+    return getattr(settings, 'FEED_FANOUT_MAX_FOLLOWERS', 1000)
+
+
+def is_pulled(follower_count):
+    """Whether an author with this many followers is read with the feed rather than pushed to it."""
+    return follower_count > get_fanout_limit()
+
+
+def merge(*id_lists, length=None):
+    """Recipe ids from several newest-first lists as one, newest first, without repeats."""
+    merged = sorted({recipe_id for ids in id_lists for recipe_id in ids}, reverse=True)
+    return merged if length is None else merged[:length]
+
+
+def newest_recipe_ids(author_ids, limit, before=None):
+    queryset = Recipe.objects.filter(author_id__in=author_ids, is_public=True)
+    if before is not None:
+        queryset = queryset.filter(id__lt=before)
+    # Ids go up as recipes are posted; created_at is the order the author index has them in
+    return list(queryset.order_by('-created_at', '-id').values_list('id', flat=True)[:limit])
+
+
+def _update_timelines(user_ids, change):
+    """
+    Apply ``change`` (a function that updates a HomeTimeline in place) to the rows of these
+    users, creating the ones that don't exist yet. Rows are locked while they're changed, so
+    two authors posting at once don't lose each other's recipes.
+    """
+    user_ids = sorted(set(user_ids))
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        chunk = user_ids[start:start + CHUNK_SIZE]
+        with transaction.atomic():
+            HomeTimeline.objects.bulk_create([HomeTimeline(user_id=user_id) for user_id in chunk], ignore_conflicts=True)
+            timelines = list(HomeTimeline.objects.select_for_update().filter(user_id__in=chunk).order_by('pk'))
+            for timeline in timelines:
+                change(timeline)
+            HomeTimeline.objects.bulk_update(timelines, ['recipe_ids', 'pulled_authors'])
+
+
+def follower_ids(author_id):
+    return list(Follow.objects.filter(followee_id=author_id).values_list('follower_id', flat=True))
+
+
+# --- Posting ---------------------------------------------------------------------------
+
+def push_recipes(recipes):
+    """Put new public recipes into the feeds of their authors' followers (the pushed authors' ones)."""
+    by_author = {}
+    for recipe in recipes:
+        if recipe.pk is not None and recipe.is_public:
+            by_author.setdefault(recipe.author_id, []).append(recipe.pk)
+    if not by_author:
+        return
+    # Waits for a follow or unfollow of these authors that's switching their followers over,
+    # so a recipe is either pushed here or in the backfill that switch does, never neither
+    with transaction.atomic():
+        counts = dict(_lock_authors(by_author).values_list('pk', 'follower_count'))
+    length = get_timeline_length()
+    for author_id, recipe_ids in by_author.items():
+        if not counts.get(author_id) or is_pulled(counts[author_id]):
+            continue
+        new_ids = sorted(recipe_ids, reverse=True)
+
+        def add(timeline):
+            timeline.recipe_ids = merge(new_ids, timeline.recipe_ids, length=length)
+        _update_timelines(follower_ids(author_id), add)
+
+
+# --- Following -------------------------------------------------------------------------
+
+def _lock_authors(author_ids):
+    """
+    Lock the authors' rows. Follows, unfollows and pushes of one author take turns on it,
+    so each of them sees the follower count the one before left behind, and exactly one
+    follow or unfollow sees the count cross FEED_FANOUT_MAX_FOLLOWERS and switches the
+    followers over. (no_key: new recipes and follows only need the row to exist.)
+    """
+    return CustomUser.objects.select_for_update(no_key=True).filter(pk__in=author_ids).order_by('pk')
+
+
+def follow(user, author):
+    """``user`` follows ``author``. Returns False if they already did."""
+    try:
+        with transaction.atomic():
+            count = _lock_authors([author.pk]).values_list('follower_count', flat=True).get() + 1
+            Follow.objects.create(follower=user, followee=author)
+            CustomUser.objects.filter(pk=author.pk).update(follower_count=count)
+            if is_pulled(count) and not is_pulled(count - 1):
+                # Just crossed the line: everybody (the new follower too) reads them from now on
+                _start_pulling(author.pk)
+            elif is_pulled(count):
+                _update_timelines([user.pk], lambda timeline: _add_pulled(timeline, author.pk))
+            else:
+                backfill = newest_recipe_ids([author.pk], get_timeline_length())
+                length = get_timeline_length()
+
+                def add(timeline):
+                    timeline.recipe_ids = merge(backfill, timeline.recipe_ids, length=length)
+                _update_timelines([user.pk], add)
+    except IntegrityError:
+        return False
+    return True
+
+
+def unfollow(user, author):
+    """``user`` stops following ``author``. Returns False if they didn't."""
+    with transaction.atomic():
+        count = _lock_authors([author.pk]).values_list('follower_count', flat=True).get()
+        deleted, _ = Follow.objects.filter(follower=user, followee=author).delete()
+        if not deleted:
+            return False
+        count -= 1
+        CustomUser.objects.filter(pk=author.pk).update(follower_count=count)
+
+        timeline = HomeTimeline.objects.filter(user=user).only('recipe_ids').first()
+        theirs = set()
+        if timeline is not None and timeline.recipe_ids:
+            theirs = set(Recipe.objects.filter(pk__in=timeline.recipe_ids, author=author).values_list('pk', flat=True))
+
+        def remove(timeline):
+            timeline.recipe_ids = [recipe_id for recipe_id in timeline.recipe_ids if recipe_id not in theirs]
+            timeline.pulled_authors = [author_id for author_id in timeline.pulled_authors if author_id != author.pk]
+        _update_timelines([user.pk], remove)
+
+        if is_pulled(count + 1) and not is_pulled(count):
+            _stop_pulling(author.pk)
+    return True
+
+
+def _add_pulled(timeline, author_id):
+    if author_id not in timeline.pulled_authors:
+        timeline.pulled_authors = [*timeline.pulled_authors, author_id]
+
+
+def _start_pulling(author_id):
+    _update_timelines(follower_ids(author_id), lambda timeline: _add_pulled(timeline, author_id))
+
+
+def _stop_pulling(author_id):
+    # Their followers' rows don't have what they posted while they were pulled: push it now
+    backfill = newest_recipe_ids([author_id], get_timeline_length())
+    length = get_timeline_length()
+
+    def push(timeline):
+        timeline.pulled_authors = [pulled for pulled in timeline.pulled_authors if pulled != author_id]
+        timeline.recipe_ids = merge(backfill, timeline.recipe_ids, length=length)
+    _update_timelines(follower_ids(author_id), push)
+
+
+# --- Reading ---------------------------------------------------------------------------
+
+def feed_ids(user, limit, before=None):
+    """
+    The ids of the next ``limit`` recipes in ``user``'s feed, newest first, older than the
+    recipe ``before`` if given - and whether there are more after those.
+    """
+    timeline = HomeTimeline.objects.filter(user=user).first()
+    if timeline is None:
+        return [], False
+    ids = [recipe_id for recipe_id in timeline.recipe_ids if before is None or recipe_id < before]
+    if timeline.pulled_authors:
+        ids = merge(ids, newest_recipe_ids(timeline.pulled_authors, limit + 1, before))
+    return ids[:limit], len(ids) > limit
+
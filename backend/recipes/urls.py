@@ -1,19 +1,47 @@
 from django.urls import path
-from .views import RecipeListCreateView, RecipeDetailView, CurrentUserRecipeListView, PublicUserRecipeListView, RecipeImageUploadView
+from culinary_connect.async_views import select_view
+from .views import RecipeListCreateView, RecipeDetailView, CurrentUserRecipeListView, PublicUserRecipeListView, RecipeImageUploadView, PantryRecipeListView, RecipeImportView, RecipeExportView, RecipeFacetView, RecipeSimilarView, FollowView, HomeFeedView, TrendingRecipeListView, RecipeEngagementView
+from .views import AsyncRecipeListCreateView, AsyncRecipeDetailView, AsyncPublicUserRecipeListView
 
 # URL patterns for recipe-related API endpoints
 urlpatterns = [
-    # List all recipes or create a new recipe
-    path('recipes/', RecipeListCreateView.as_view(), name='recipe-list-create'),
+    # List all recipes or create a new recipe. The busiest read routes can be served by their
+    # async views instead, see ASYNC_VIEWS in settings.py
+    path('recipes/', select_view('recipe-list-create', RecipeListCreateView, AsyncRecipeListCreateView), name='recipe-list-create'),
+
+    # Find recipes you can make with the ingredients you have on hand
+    path('recipes/pantry/', PantryRecipeListView.as_view(), name='recipe-pantry'),
+
+    # Recipe counts per category, cuisine and difficulty, for the same filters as the list
+    path('recipes/facets/', RecipeFacetView.as_view(), name='recipe-facets'),
+
+    # The most popular public recipes lately
+    path('recipes/trending/', TrendingRecipeListView.as_view(), name='recipe-trending'),
+
+    # Bulk import (NDJSON or CSV) and streaming export of your recipes
+    path('recipes/import/', RecipeImportView.as_view(), name='recipe-import'),
+    path('recipes/export/', RecipeExportView.as_view(), name='recipe-export'),
 
     # Retrieve, update, or delete a specific recipe
-    path('recipes/<int:pk>/', RecipeDetailView.as_view(), name='recipe-detail'),
+    path('recipes/<int:pk>/', select_view('recipe-detail', RecipeDetailView, AsyncRecipeDetailView), name='recipe-detail'),
 
     # List recipes created by the current authenticated user
     path('my-recipes/', CurrentUserRecipeListView.as_view(), name='my-recipes'),
 
     # List public recipes for a specific user
-    path('users/<str:username>/public-recipes/', PublicUserRecipeListView.as_view(), name='public-user-recipes'),
+    path('users/<str:username>/public-recipes/', select_view('public-user-recipes', PublicUserRecipeListView, AsyncPublicUserRecipeListView), name='public-user-recipes'),
+
+    # Follow an author (POST), stop following them (DELETE)
+    path('users/<str:username>/follow/', FollowView.as_view(), name='user-follow'),
+
+    # The newest recipes by the people you follow
+    path('feed/', HomeFeedView.as_view(), name='home-feed'),
+
+    # Saved, shared or cooked it: counts towards trending
+    path('recipes/<int:pk>/engagements/', RecipeEngagementView.as_view(), name='recipe-engagement'),
+
+    # Recipes like this one
+    path('recipes/<int:pk>/similar/', RecipeSimilarView.as_view(), name='recipe-similar'),
 
     # Upload an image for a specific recipe
     path('recipes/<int:pk>/upload-image/', RecipeImageUploadView.as_view(), name='recipe-image-upload'),
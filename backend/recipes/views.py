@@ -1,16 +1,41 @@
-from django.shortcuts import get_object_or_404
+import logging
+
+from django.shortcuts import aget_object_or_404, get_object_or_404
 from rest_framework import generics, status, permissions, filters
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import Recipe
-from .serializers import RecipeSerializer
+from .serializers import RecipeSerializer, PantryRecipeSerializer, RecipeRowSerializer, SimilarRecipeSerializer
+from . import ingredients
+from .filters import RecipeSearchFilter
+from .pagination import RecipeFeedPagination
+from . import images
+from . import response_cache
+from . import bulk
+from . import fieldsets
+from . import facets
+from . import similar
+from . import timelines
+from . import popularity
+from . import media
+from .renderers import CSVRenderer, NDJSONRenderer
 from django.contrib.auth import get_user_model
 from rest_framework.views import APIView
-from django.core.files.base import ContentFile
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.throttling import ScopedRateThrottle
+from rest_framework.utils.urls import replace_query_param
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.db import transaction
 from django.core.exceptions import SuspiciousOperation
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from culinary_connect.conditional import ConditionalGetMixin, make_etag, set_validators
+from culinary_connect.async_views import AsyncListModelMixin, AsyncRetrieveModelMixin, AsyncViewMixin
+from culinary_connect.caching import cache_call
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
@@ -20,30 +45,229 @@ class IsAuthorOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-        return obj.author == request.user
+        # Comparing ids means we don't have to load the author just to check ownership
+        return obj.author_id == request.user.pk
+
+# Anonymous readers all get the same answer, so we keep it around instead of cooking it
+# again for every visitor. Each view says which parts of the catalog its response depends on
+# (see recipes/response_cache.py) and is refreshed as soon as one of them changes.
+class CachedResponseMixin:
+    def get_cache_scopes(self):
+        return ['all']
+
+    def get_response_key(self, request):
+        if not hasattr(self, '_response_key'):
+            self._response_key = response_cache.response_key(request, self.get_cache_scopes())
+        return self._response_key
+
+    async def aget_response_key(self, request):
+        if not hasattr(self, '_response_key'):
+            self._response_key = await response_cache.aresponse_key(request, self.get_cache_scopes())
+        return self._response_key
+
+    def cached_validators(self, request, compute):
+        # The validators live next to the response, under the same versioned key, so a
+        # visitor revalidating a cached page costs no queries at all
+        if not response_cache.should_cache(request):
+            return compute()
+        key = f'{self.get_response_key(request)}:validators'
+        validators = response_cache.get_cache().get(key)
+        if validators is None:
+            validators = compute()
+            response_cache.get_cache().set(key, validators)
+        return validators
+
+    async def acached_validators(self, request, acompute):
+        if not response_cache.should_cache(request):
+            return await acompute()
+        key = f'{await self.aget_response_key(request)}:validators'
+        cache = response_cache.get_cache()
+        validators = await cache_call(cache, 'get', key)
+        if validators is None:
+            validators = await acompute()
+            await cache_call(cache, 'set', key, validators)
+        return validators
+
+    def get(self, request, *args, **kwargs):
+        if not response_cache.should_cache(request):
+            return super().get(request, *args, **kwargs)
+
+        key = self.get_response_key(request)
+        data = response_cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response_cache.store(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    async def aget(self, request, *args, **kwargs):
+        if not response_cache.should_cache(request):
+            return await super().aget(request, *args, **kwargs)
+
+        key = await self.aget_response_key(request)
+        data = await response_cache.aget(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = await super().aget(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            await response_cache.astore(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+# Recipe lists are by far the most served thing we have, and a page of them spent more time
+# in serializer fields than in the database. So the list views read plain rows and turn them
+# into JSON with RecipeRowSerializer, which gives the same output as RecipeSerializer for a
+# fraction of the work (see recipes/serializers.py). Creating recipes is untouched.
+class RecipeRowListMixin:
+    row_serializer_class = RecipeRowSerializer
+
+    def get_row_serializer(self, rows, fields=None):
+        return self.row_serializer_class(rows, context=self.get_serializer_context(), fields=fields)
+
+    def get_page_rows(self):
+        """
+        The rows of the page being served, and the queryset they're from. Read once per
+        request: the list's ETag goes by them too (see list_validators), and a 304 only
+        costs reading them.
+        """
+        if not hasattr(self, '_page_rows'):
+            queryset = self.row_serializer_class.rows(self.filter_queryset(self.get_queryset()), self.get_field_selection())
+            self._page_rows = queryset, self.paginate_queryset(queryset)
+        return self._page_rows
+
+    async def aget_page_rows(self):
+        if not hasattr(self, '_page_rows'):
+            queryset = self.row_serializer_class.rows(
+                await self.afilter_queryset(await self.aget_queryset()), self.get_field_selection()
+            )
+            self._page_rows = queryset, await self.apaginate_queryset(queryset)
+        return self._page_rows
+
+    def list(self, request, *args, **kwargs):
+        fields = self.get_field_selection()
+        queryset, page = self.get_page_rows()
+        if page is not None:
+            return self.get_paginated_response(self.get_row_serializer(page, fields).data)
+        return Response(self.get_row_serializer(queryset, fields).data)
+
+    async def alist(self, request, *args, **kwargs):
+        fields = self.get_field_selection()
+        queryset, page = await self.aget_page_rows()
+        if page is not None:
+            return self.get_paginated_response(self.get_row_serializer(page, fields).data)
+        return Response(self.get_row_serializer([row async for row in queryset], fields).data)
+
+# Recipes are big and a card needs a fraction of one, so reads take ?fields= and ?omit=
+# (see recipes/fieldsets.py). Detail pages send everything unless asked otherwise, the
+# lists send a summary. Whatever is left out isn't read from the database either.
+class SparseFieldsetMixin:
+    default_fields = None
+
+    def get_field_selection(self):
+        # Writes answer with the whole recipe, whatever the query string says
+        if self.request.method not in permissions.SAFE_METHODS:
+            return None
+        serializer_fields = fieldsets.get_serializer_fields(self.get_serializer_class())
+        return fieldsets.select_fields(self.request, list(serializer_fields), self.default_fields)
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_field_selection())
+        return super().get_serializer(*args, **kwargs)
+
+    def select_columns(self, queryset):
+        fields = self.get_field_selection()
+        if fields is None:
+            return queryset
+        return fieldsets.only(queryset, self.get_serializer_class(), fields)
+
+# ETags and Last-Modified dates for recipes, so clients can ask "has this changed?" and
+# get an empty 304 back when it hasn't. A recipe's validators come from its updated_at
+# (plus the author's name, which is part of the page); a list's ETag from the id and
+# updated_at of every recipe on the page being served, plus the response cache's version
+# tokens for the list (recipes/response_cache.py), which change with any recipe in it - so
+# a recipe deleted two pages on, which changes the count, changes the ETag too. Nothing
+# counts or scans the whole list for it. Lists get no Last-Modified: deleting a recipe
+# changes the list without moving any date, so If-Modified-Since alone would keep
+# answering 304. JSON and the browsable API render differently, so the
+# format is part of the ETag too. Signed-in users can be sent signed photo URLs, which
+# expire (recipes/media.py): their ETags change when the signatures would.
+def recipe_validators(request, pk, updated_at, author_username, fields=None):
+    if updated_at is None:
+        return None, None
+    parts = ['recipe', pk, updated_at.isoformat(), author_username, request.accepted_renderer.format]
+    if fields is not None:
+        # A sparse fieldset is a different representation; the full one keeps its old ETag
+        parts.append(fields)
+    if media.signing_user_id(request) is not None:
+        parts.append(media.signature_expiry())
+    return make_etag(*parts), updated_at
+
+
+def list_validators(view, request):
+    queryset, page = view.get_page_rows()
+    versions = response_cache.get_versions(view.get_cache_scopes())
+    return _list_validators(request, versions, page if page is not None else queryset)
+
+
+async def alist_validators(view, request):
+    queryset, page = await view.aget_page_rows()
+    versions = await response_cache.aget_versions(view.get_cache_scopes())
+    return _list_validators(request, versions, page if page is not None else [row async for row in queryset])
+
+
+def _list_validators(request, versions, rows):
+    etag = make_etag(
+        'recipes', request.get_host(), request.path, response_cache.normalized_params(request), versions,
+        [(row.id, row.updated_at.isoformat()) for row in rows], request.accepted_renderer.format,
+        media.signature_expiry() if media.signing_user_id(request) is not None else None
+    )
+    return etag, None
+
 
 # This view is doing a lot of heavy lifting. It's like the Swiss Army knife for recipes.
 # It handles listing all recipes and creating new ones. Plus, it's got all those fancy
-# filtering and searching capabilities. Pretty cool, right?
-class RecipeListCreateView(generics.ListCreateAPIView):
-    queryset = Recipe.objects.all()
+# filtering and searching capabilities. Searching goes through our own search index
+# (see recipes/search.py), so it stays quick no matter how big the cookbook gets.
+class RecipeListCreateView(ConditionalGetMixin, CachedResponseMixin, RecipeRowListMixin, SparseFieldsetMixin,
+                           generics.ListCreateAPIView):
+    queryset = Recipe.objects.with_author()
     serializer_class = RecipeSerializer
+    default_fields = fieldsets.SUMMARY_FIELDS
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, RecipeSearchFilter, filters.OrderingFilter]
     filterset_fields = ['category', 'cuisine', 'difficulty']
     search_fields = ['title', 'description', 'ingredients']
     ordering_fields = ['created_at', 'updated_at', 'title']
+    pagination_class = RecipeFeedPagination
     parser_classes = (MultiPartParser, FormParser)
 
+    def get_validators(self, request):
+        return self.cached_validators(request, lambda: list_validators(self, request))
+
     # This method is like a helper in the kitchen. It takes care of saving the recipe
     # and deals with the image if there is one. Neat and tidy!
+    # The image is streamed to storage as-is; the resized versions are made in the background.
+    # Once it's saved for good, the recipe goes out to the home feeds of the author's
+    # followers (see recipes/timelines.py).
     def perform_create(self, serializer):
         image = self.request.data.get('image')
         if image:
-            file_name = default_storage.save(f"recipe_images/{image.name}", ContentFile(image.read()))
-            serializer.save(author=self.request.user, image=file_name)
+            with transaction.atomic():
+                blob = images.store_upload(image)
+                recipe = serializer.save(author=self.request.user, image=blob.name, image_variants=blob.variants)
+            if not blob.variants:
+                images.schedule_variants(recipe.pk, blob.name)
         else:
-            serializer.save(author=self.request.user)
+            recipe = serializer.save(author=self.request.user)
+        transaction.on_commit(lambda: timelines.push_recipes([recipe]), robust=True)
 
     # This create method is like a strict chef. It checks if we have all the ingredients
     # (fields) before starting to cook (create the recipe). No half-baked recipes allowed!
@@ -56,11 +280,7 @@ class RecipeListCreateView(generics.ListCreateAPIView):
                 "errors": serializer.errors
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        required_fields = ['title', 'description', 'ingredients', 'instructions', 
-                           'preparation_time', 'cooking_time', 'servings', 
-                           'difficulty', 'category', 'cuisine']
-        
-        missing_fields = [field for field in required_fields if field not in request.data]
+        missing_fields = [field for field in bulk.REQUIRED_FIELDS if field not in request.data]
         
         if missing_fields:
             return Response({
@@ -77,6 +297,49 @@ class RecipeListCreateView(generics.ListCreateAPIView):
             "data": serializer.data
         }, status=status.HTTP_201_CREATED, headers=headers)
 
+# Moving a whole cookbook in at once: POST a stream of recipes, one JSON object per line
+# (Content-Type: application/x-ndjson) or a CSV file with a header row (text/csv). Recipes are
+# written in batches (see recipes/bulk.py) and the response says which lines didn't make it.
+class RecipeImportView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = []
+
+    def post(self, request):
+        fmt = bulk.format_for_content_type(request.content_type)
+        # Read the body line by line, so a big import never sits in memory all at once
+        stream = request.stream or []
+        report = bulk.import_rows(bulk.read_rows(stream, fmt), request.user)
+
+        if report.created or not report.failed:
+            return Response({
+                "status": "success",
+                "code": "IMPORT_COMPLETED_WITH_ERRORS" if report.failed else "IMPORT_COMPLETED",
+                "message": f"Imported {report.created} recipes, {report.failed} rows failed",
+                "data": report.as_dict()
+            }, status=status.HTTP_201_CREATED if report.created else status.HTTP_200_OK)
+        return Response({
+            "status": "error",
+            "code": "IMPORT_FAILED",
+            "message": "None of the rows could be imported",
+            "data": report.as_dict()
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+# ...and taking it back out again. Streams all of your recipes as NDJSON, or as CSV with
+# ?format=csv (or Accept: text/csv), in the same shape the import accepts.
+class RecipeExportView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+
+    def get(self, request):
+        fmt = request.accepted_renderer.format
+        queryset = Recipe.objects.filter(author=request.user)
+        response = StreamingHttpResponse(
+            bulk.export_chunks(queryset, fmt),
+            content_type=f'{request.accepted_renderer.media_type}; charset=utf-8'
+        )
+        response['Content-Disposition'] = f'attachment; filename="recipes.{fmt}"'
+        return response
+
 # This view is like the food photographer of our app. It handles uploading
 # and attaching images to our recipes. Making them look delicious!
 class RecipeImageUploadView(APIView):
@@ -84,17 +347,31 @@ class RecipeImageUploadView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAuthorOrReadOnly]
 
     def post(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
+        # All we need here is who owns the recipe and its current image,
+        # so there's no point hauling the whole recipe text out of the database.
+        recipe = get_object_or_404(
+            Recipe.objects.only('id', 'author_id', 'image', 'image_variants', 'updated_at'), pk=pk
+        )
         self.check_object_permissions(request, recipe)
         
         image = request.data.get('image')
         if image:
             try:
-                file_name = default_storage.save(f"recipe_images/{image.name}", ContentFile(image.read()))
-                image_url = default_storage.url(file_name)
-                
-                recipe.image = file_name
-                recipe.save()
+                old_image, old_variants = recipe.image.name, recipe.image_variants
+                with transaction.atomic():
+                    blob = images.store_upload(image)
+                    recipe.image = blob.name
+                    recipe.image_variants = blob.variants
+                    recipe.save()
+                    # Let go of the photo this one replaces. If it's the very same photo,
+                    # this just gives back the extra reference we took above.
+                    if old_image:
+                        images.release_image(old_image, old_variants)
+                if not blob.variants:
+                    images.schedule_variants(recipe.pk, blob.name)
+                # Signed, in case the recipe is private: only its author uploads to it, and an
+                # <img> can't send their token (a public photo is served either way)
+                image_url = media.sign_url(default_storage.url(blob.name), blob.name)
                 
                 return Response({
                     "status": "success",
@@ -114,25 +391,68 @@ class RecipeImageUploadView(APIView):
 
 # This view is like a recipe manager. It can show you the recipe details,
 # let you tweak the recipe, or even throw it away if you don't like it anymore.
-class RecipeDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Recipe.objects.all()
+class RecipeDetailView(ConditionalGetMixin, CachedResponseMixin, SparseFieldsetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Recipe.objects.with_author()
     serializer_class = RecipeSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
     parser_classes = (MultiPartParser, FormParser)
 
+    def get_cache_scopes(self):
+        return [response_cache.recipe_scope(self.kwargs['pk'])]
+
+    # Every look at a recipe counts towards its popularity - in the cache, for the stats
+    # worker to write down later (see recipes/popularity.py), so reading stays a read.
+    # A 304 is somebody looking at it again too.
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            popularity.record(self.kwargs['pk'])
+        return response
+
+    async def aget(self, request, *args, **kwargs):
+        response = await super().aget(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            await popularity.arecord(self.kwargs['pk'])
+        return response
+
+    def get_validators(self, request):
+        def compute():
+            row = Recipe.objects.filter(pk=self.kwargs['pk']).values_list('updated_at', 'author__username').first()
+            return recipe_validators(request, self.kwargs['pk'], *row, self.get_field_selection()) if row else (None, None)
+        return self.cached_validators(request, compute)
+
+    def get_instance_validators(self, instance):
+        return recipe_validators(self.request, instance.pk, instance.updated_at, instance.author.username)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == 'DELETE':
+            # Deleting only needs the title for the response, the image to clean up,
+            # what goes into the ETag, for If-Match, and what the facet counts go by
+            return queryset.only(
+                'id', 'title', 'author_id', 'image', 'image_variants', 'updated_at', 'author__username',
+                *facets.KEY_FIELDS
+            )
+        return self.select_columns(queryset)
+
     def perform_update(self, serializer):
-        instance = self.get_object()
+        # update() already fetched (and permission-checked) the recipe, no need to do it twice
+        instance = serializer.instance
         image = self.request.data.get('image')
         
         if image:
             try:
-                # Delete the old image if it exists
-                if instance.image:
-                    default_storage.delete(instance.image.name)
-                
-                # Save the new image
-                file_name = default_storage.save(f"recipe_images/{image.name}", ContentFile(image.read()))
-                serializer.save(image=file_name)
+                old_image, old_variants = instance.image.name, instance.image_variants
+                with transaction.atomic():
+                    # Save the new image, the variants will follow from the background workers
+                    blob = images.store_upload(image)
+                    serializer.save(image=blob.name, image_variants=blob.variants)
+
+                    # Let go of the old image; it's only deleted if no other recipe shares it
+                    if old_image:
+                        images.release_image(old_image, old_variants)
+                if not blob.variants:
+                    images.schedule_variants(instance.pk, blob.name)
             except IOError as e:
                 # Handle file system errors
                 raise SuspiciousOperation(f"Error handling image file: {str(e)}")
@@ -143,6 +463,11 @@ class RecipeDetailView(generics.RetrieveUpdateDestroyAPIView):
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
+        # Somebody else edited the recipe since this client fetched it (If-Match)
+        failed = self.check_write_preconditions(request, *self.get_instance_validators(instance))
+        if failed:
+            return failed
+
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         if not serializer.is_valid():
             return Response({
@@ -159,24 +484,29 @@ class RecipeDetailView(generics.RetrieveUpdateDestroyAPIView):
                 "message": str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        return Response({
+        response = Response({
             "status": "success",
             "message": "Recipe updated successfully",
             "data": serializer.data
         })
+        # Hand back the new ETag, so the next edit can be conditional without a GET
+        return set_validators(response, *self.get_instance_validators(instance))
 
     # This method is for when you really messed up that recipe and just want to forget about it.
     # It's like throwing away a burnt cake, but don't worry, we'll clean up the image too!
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
+        failed = self.check_write_preconditions(request, *self.get_instance_validators(instance))
+        if failed:
+            return failed
         recipe_title = instance.title
         
         if instance.image:
             try:
-                default_storage.delete(instance.image.name)
-            except IOError as e:
-                # Log the error or handle it as appropriate for your application
-                print(f"Error deleting image for recipe '{recipe_title}': {str(e)}")
+                images.release_image(instance.image.name, instance.image_variants)
+            except IOError:
+                # The recipe goes anyway; a leftover file is only wasted space
+                logger.exception("Error deleting image for recipe '%s'", recipe_title)
         
         self.perform_destroy(instance)
         return Response({
@@ -186,28 +516,259 @@ class RecipeDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 # This view is like your personal cookbook. It shows all the recipes you've created.
 # Great for when you're feeling nostalgic or just can't remember what you cooked last week!
-class CurrentUserRecipeListView(generics.ListAPIView):
+class CurrentUserRecipeListView(ConditionalGetMixin, RecipeRowListMixin, SparseFieldsetMixin, generics.ListAPIView):
     serializer_class = RecipeSerializer
+    default_fields = fieldsets.SUMMARY_FIELDS
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, RecipeSearchFilter, filters.OrderingFilter]
     filterset_fields = ['category', 'cuisine', 'difficulty']
     search_fields = ['title', 'description', 'ingredients']
     ordering_fields = ['created_at', 'updated_at', 'title']
+    pagination_class = RecipeFeedPagination
+
+    def get_cache_scopes(self):
+        # Nothing here is cached, but the ETag goes by the version of the author's recipes
+        return [response_cache.user_scope(self.request.user.username)]
+
+    def get_validators(self, request):
+        return list_validators(self, request)
 
     def get_queryset(self):
-        return Recipe.objects.filter(author=self.request.user)
+        return Recipe.objects.with_author().filter(author=self.request.user)
 
 # This view is like peeking into someone else's cookbook, but only the recipes they're willing to share.
 # It's a great way to discover new recipes from other users!
-class PublicUserRecipeListView(generics.ListAPIView):
+class PublicUserRecipeListView(ConditionalGetMixin, CachedResponseMixin, RecipeRowListMixin, SparseFieldsetMixin,
+                               generics.ListAPIView):
     serializer_class = RecipeSerializer
+    default_fields = fieldsets.SUMMARY_FIELDS
     permission_classes = [permissions.AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, RecipeSearchFilter, filters.OrderingFilter]
     filterset_fields = ['category', 'cuisine', 'difficulty']
     search_fields = ['title', 'description', 'ingredients']
     ordering_fields = ['created_at', 'updated_at', 'title']
+    pagination_class = RecipeFeedPagination
+
+    def get_cache_scopes(self):
+        return [response_cache.user_scope(self.kwargs['username'])]
+
+    def get_validators(self, request):
+        return self.cached_validators(request, lambda: list_validators(self, request))
+
+    def get_queryset(self):
+        # Looked up once per request, the ETag and the page both need it
+        if not hasattr(self, '_author'):
+            self._author = get_object_or_404(User.objects.only('id'), username=self.kwargs['username'])
+        return Recipe.objects.with_author().filter(author=self._author, is_public=True)
+
+# How many recipes there are per category, cuisine and difficulty, for a browse page's
+# sidebar. Takes the same filters and ?search= as the recipe list and counts what that list
+# would show, mostly from the precomputed counts in recipes/facets.py.
+class RecipeFacetView(CachedResponseMixin, generics.ListAPIView):
+    queryset = Recipe.objects.all()
+    permission_classes = [permissions.AllowAny]
+    filter_backends = [DjangoFilterBackend, RecipeSearchFilter]
+    filterset_fields = facets.DIMENSIONS
+    search_fields = ['title', 'description', 'ingredients']
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        # Filtering checks the parameters (an unknown difficulty is a 400) and runs the search
+        queryset = self.filter_queryset(self.get_queryset())
+        if RecipeSearchFilter().get_query(request).strip():
+            rows = facets.grouped_rows(queryset)
+        else:
+            filters = {field: request.query_params[field] for field in facets.DIMENSIONS if request.query_params.get(field)}
+            rows = facets.counted_rows(filters)
+        return Response(facets.summarize(rows))
+
+# This view answers the age-old question: "what can I cook with what's in my fridge?"
+# Pass your pantry as ?ingredients=chicken,garlic (or repeat the parameter) and you get
+# back public recipes that use them, the ones you can most fully cover first.
+class PantryRecipeListView(SparseFieldsetMixin, generics.ListAPIView):
+    serializer_class = PantryRecipeSerializer
+    permission_classes = [permissions.AllowAny]
+    default_fields = fieldsets.SUMMARY_FIELDS + ('matched_ingredients', 'total_ingredients', 'coverage')
+
+    def get_pantry_items(self):
+        items = []
+        for value in self.request.query_params.getlist('ingredients'):
+            items.extend(item.strip() for item in value.split(',') if item.strip())
+        return items
 
     def get_queryset(self):
-        username = self.kwargs['username']
-        user = get_object_or_404(User, username=username)
-        return Recipe.objects.filter(author=user, is_public=True)
\ No newline at end of file
+        return ingredients.pantry_recipes(
+            self.get_pantry_items(),
+            self.select_columns(Recipe.objects.with_author().filter(is_public=True))
+        )
+
+
+class SimilarIndexUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Similar recipes aren't available on this server."
+    default_code = 'similar_unavailable'
+
+
+# "If you liked this, try...": the public recipes closest to this one by title, ingredients,
+# category and cuisine, most similar first, each with its similarity from 0 to 1. The
+# neighbours come from a vector index (see recipes/similar.py); ?limit= says how many (10).
+class RecipeSimilarView(SparseFieldsetMixin, generics.ListAPIView):
+    serializer_class = SimilarRecipeSerializer
+    permission_classes = [permissions.AllowAny]
+    filter_backends = []
+    pagination_class = None
+    default_fields = fieldsets.SUMMARY_FIELDS + ('similarity',)
+    default_limit = 10
+    max_limit = 50
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        return min(max(limit, 1), self.max_limit)
+
+    def get_queryset(self):
+        if not similar.available():
+            raise SimilarIndexUnavailable()
+        recipe = get_object_or_404(Recipe.objects.only('id', *similar.FEATURE_FIELDS), pk=self.kwargs['pk'])
+        candidates = self.select_columns(Recipe.objects.with_author().filter(is_public=True))
+        return similar.similar_recipes(recipe, candidates, limit=self.get_limit())
+
+
+# What's hot right now: the public recipes with the most views and engagements lately,
+# recent ones counting for more. The list is worked out every TRENDING_REFRESH_SECONDS by
+# the stats worker (see recipes/popularity.py); this just reads it, in order.
+class TrendingRecipeListView(CachedResponseMixin, RecipeRowListMixin, SparseFieldsetMixin, generics.ListAPIView):
+    serializer_class = RecipeSerializer
+    default_fields = fieldsets.SUMMARY_FIELDS
+    permission_classes = [permissions.AllowAny]
+    filter_backends = []
+    pagination_class = None
+
+    def get_cache_scopes(self):
+        return ['all', popularity.TRENDING_SCOPE]
+
+    def get_queryset(self):
+        return Recipe.objects.with_author().filter(trending__isnull=False, is_public=True).order_by('trending__position')
+
+# Telling us you did something with a recipe - saved it, shared it, cooked it - counts for
+# more than a view when working out what's trending. Counted in the cache like views are,
+# but only for recipes you can see, once per person, recipe and kind for a while, and at
+# a throttled rate, so nobody can post a recipe (or a made-up id) up the trending list.
+class RecipeEngagementView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'engagements'
+
+    def post(self, request, pk):
+        kind = request.data.get('kind')
+        if kind not in popularity.ENGAGEMENTS:
+            return Response({
+                "status": "error",
+                "message": f"kind must be one of: {', '.join(popularity.ENGAGEMENTS)}",
+            }, status=status.HTTP_400_BAD_REQUEST)
+        get_object_or_404(Recipe.objects.filter(Q(is_public=True) | Q(author=request.user)).only('id'), pk=pk)
+        popularity.record_engagement(request.user.pk, pk, kind)
+        return Response(status=status.HTTP_202_ACCEPTED)
+
+
+# Following an author puts their public recipes in your home feed: POST to follow, DELETE
+# to stop, GET to see whether you do. The feed itself is kept up to date by
+# recipes/timelines.py, which is also where following backfills it.
+class FollowView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_author(self, username):
+        return get_object_or_404(User.objects.only('id', 'username', 'follower_count'), username=username, is_active=True)
+
+    def respond(self, author, following, status_code=status.HTTP_200_OK):
+        author.refresh_from_db(fields=['follower_count'])
+        return Response({
+            'username': author.username,
+            'following': following,
+            'follower_count': author.follower_count,
+        }, status=status_code)
+
+    def get(self, request, username):
+        author = self.get_author(username)
+        following = author.followers.filter(follower=request.user).exists()
+        return self.respond(author, following)
+
+    def post(self, request, username):
+        author = self.get_author(username)
+        if author.pk == request.user.pk:
+            return Response({
+                "status": "error",
+                "message": "You can't follow yourself",
+            }, status=status.HTTP_400_BAD_REQUEST)
+        created = timelines.follow(request.user, author)
+        return self.respond(author, True, status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    def delete(self, request, username):
+        author = self.get_author(username)
+        timelines.unfollow(request.user, author)
+        return self.respond(author, False)
+
+# Your home feed: the newest public recipes by the people you follow, newest first. It's read
+# from your materialized timeline (see recipes/timelines.py), so it costs the same however
+# many people you follow. The ``next`` link carries on from the last recipe with ?before=.
+class HomeFeedView(RecipeRowListMixin, SparseFieldsetMixin, generics.ListAPIView):
+    serializer_class = RecipeSerializer
+    default_fields = fieldsets.SUMMARY_FIELDS
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = []
+    pagination_class = None
+
+    def get_page_size(self):
+        return api_settings.PAGE_SIZE or 10
+
+    def get_before(self):
+        before = self.request.query_params.get('before')
+        if before is None:
+            return None
+        try:
+            return int(before)
+        except ValueError:
+            raise ValidationError({'before': "A recipe id."})
+
+    def list(self, request, *args, **kwargs):
+        ids, has_more = timelines.feed_ids(request.user, self.get_page_size(), self.get_before())
+        fields = self.get_field_selection()
+        rows = {}
+        if ids:
+            queryset = Recipe.objects.with_author().filter(pk__in=ids, is_public=True)
+            rows = {row.id: row for row in self.row_serializer_class.rows(queryset, fields)}
+        # Recipes deleted or made private since they were posted drop out here
+        page = [rows[recipe_id] for recipe_id in ids if recipe_id in rows]
+        next_link = None
+        if has_more:
+            next_link = replace_query_param(request.build_absolute_uri(), 'before', ids[-1])
+        return Response({'next': next_link, 'results': self.get_row_serializer(page, fields).data})
+
+
+# The hot read endpoints again, answered on the event loop with the async ORM when the app
+# runs under ASGI (see culinary_connect/async_views.py). They're the views above in every
+# other way - same filters, cache, ETags and bytes on the wire - and writes still go to them.
+# Which routes use these is up to the ASYNC_VIEWS setting.
+class AsyncRecipeListCreateView(AsyncViewMixin, RecipeListCreateView, AsyncListModelMixin):
+    async def aget_validators(self, request):
+        return await self.acached_validators(request, lambda: alist_validators(self, request))
+
+
+class AsyncRecipeDetailView(AsyncViewMixin, RecipeDetailView, AsyncRetrieveModelMixin):
+    async def aget_validators(self, request):
+        async def compute():
+            row = await Recipe.objects.filter(pk=self.kwargs['pk']).values_list('updated_at', 'author__username').afirst()
+            return recipe_validators(request, self.kwargs['pk'], *row, self.get_field_selection()) if row else (None, None)
+        return await self.acached_validators(request, compute)
+
+
+class AsyncPublicUserRecipeListView(AsyncViewMixin, PublicUserRecipeListView, AsyncListModelMixin):
+    async def aget_validators(self, request):
+        return await self.acached_validators(request, lambda: alist_validators(self, request))
+
+    async def aget_queryset(self):
+        if not hasattr(self, '_author'):
+            self._author = await aget_object_or_404(User.objects.only('id'), username=self.kwargs['username'])
+        return self.get_queryset()
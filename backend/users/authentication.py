@@ -0,0 +1,331 @@
+"""
+Token authentication without a database round trip on every request.
+
+DRF's TokenAuthentication looks the token and its user up on every single API
+call. Tokens hardly ever change, so ``CachedTokenAuthentication`` remembers
+token -> (token, user) for ``TOKEN_AUTH_CACHE_TIMEOUT`` seconds:
+
+* By default in the Django cache named by ``TOKEN_AUTH_CACHE_ALIAS`` (``default``),
+  which every worker shares once CACHE_URL points at Redis or memcached.
+* Or, with ``TOKEN_AUTH_CACHE_ALIAS`` empty, in a small LRU inside each process
+  (``TOKEN_AUTH_CACHE_MAX_SIZE`` entries).
+
+Logging out, deleting an account, reactivating it or saving the user drops the
+entries straight away. In a shared cache that's immediate for every worker; the
+in-process LRU only hears about it in the worker that handled the request, and
+the others keep accepting the token until their entry expires. That's why it's
+not the default, and only fit for a single process.
+
+The shared cache never gets the password hash: entries hold the token's key and
+the user's other columns as plain values (see _pack()), and the user comes back
+with ``password`` deferred, so saving it leaves the hash alone and checking a
+password loads it from the database.
+
+Hits, misses, evictions and invalidations are counted in the ``/metrics`` registry
+(``token_auth_cache_events_total``).
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from culinary_connect.caching import cache_call
+from monitoring import metrics
+
+KEY_PREFIX = 'users:auth:token'
+USER_PREFIX = 'users:auth:user'
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # token key -> (expires at, token, user)
+_user_keys = {}            # user pk -> token keys, to invalidate by user
+
+cache_events = metrics.counter(
+    'token_auth_cache_events_total', 'API token cache lookups (hit, miss), evictions and invalidations.', ('event',))
+EVENTS = {'hits': 'hit', 'misses': 'miss', 'evictions': 'eviction', 'invalidations': 'invalidation'}
+
+
+def get_timeout():
+    return getattr(settings, 'TOKEN_AUTH_CACHE_TIMEOUT', 60)
+
+
+def get_max_size():
+    return getattr(settings, 'TOKEN_AUTH_CACHE_MAX_SIZE', 10000)
+
+
+def get_shared_cache():
+    alias = getattr(settings, 'TOKEN_AUTH_CACHE_ALIAS', 'default')
+    return caches[alias] if alias else None
+
+
+def _count(stat, amount=1):
+    cache_events.inc(amount, event=EVENTS[stat])
+
+
+def stats():
+    """Hit/miss counters for this process, plus the hit rate and the size of the in-process LRU."""
+    snapshot = {stat: cache_events.get(event=event) for stat, event in EVENTS.items()}
+    with _lock:
+        snapshot['size'] = len(_entries)
+    lookups = snapshot['hits'] + snapshot['misses']
+    snapshot['hit_rate'] = snapshot['hits'] / lookups if lookups else 0.0
+    return snapshot
+
+
+def reset_stats():
+    cache_events.clear()
+
+
+def clear():
+    """Forget every token this process knows about."""
+    with _lock:
+        _entries.clear()
+        _user_keys.clear()
+
+
+def _forget_locally(key):
+    # Callers hold _lock
+    entry = _entries.pop(key, None)
+    if entry is not None:
+        keys = _user_keys.get(entry[2].pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del _user_keys[entry[2].pk]
+
+
+def _lookup(key):
+    shared = get_shared_cache()
+    if shared is not None:
+        return _unpack(shared.get(f'{KEY_PREFIX}:{key}'))
+    return _lookup_locally(key)
+
+
+async def _alookup(key):
+    shared = get_shared_cache()
+    if shared is not None:
+        return _unpack(await cache_call(shared, 'get', f'{KEY_PREFIX}:{key}'))
+    return _lookup_locally(key)
+
+
+def _lookup_locally(key):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            _forget_locally(key)
+            return None
+        _entries.move_to_end(key)
+        return entry[1], entry[2]
+
+
+def _cached_fields(user):
+    # Everything but the password hash, which nobody who can read the cache should get
+    return [field.attname for field in user._meta.concrete_fields if field.attname != 'password']
+
+
+def _pack(token, user):
+    """A token and its user as plain values for the shared cache, without the password."""
+    fields = _cached_fields(user)
+    return token.key, token.created, user._state.db, fields, [getattr(user, field) for field in fields]
+
+
+def _unpack(entry):
+    if entry is None:
+        return None
+    key, created, db, fields, values = entry
+    # Built the way a query would, so the password is a deferred field
+    user = get_user_model().from_db(db, fields, values)
+    token = Token.from_db(db, ['key', 'user_id', 'created'], [key, user.pk, created])
+    token.user = user
+    return token, user
+
+
+def _shared_entries(token, user):
+    return {
+        f'{KEY_PREFIX}:{token.key}': _pack(token, user),
+        f'{USER_PREFIX}:{user.pk}': token.key,
+    }
+
+
+def remember(token, user=None):
+    """Cache a token (and its user) so the next requests using it skip the database."""
+    user = user or token.user
+    shared = get_shared_cache()
+    if shared is not None:
+        shared.set_many(_shared_entries(token, user), timeout=get_timeout())
+        return
+    _remember_locally(token, user)
+
+
+async def aremember(token, user):
+    shared = get_shared_cache()
+    if shared is not None:
+        await cache_call(shared, 'set_many', _shared_entries(token, user), timeout=get_timeout())
+        return
+    _remember_locally(token, user)
+
+
+def _remember_locally(token, user):
+    evicted = 0
+    with _lock:
+        _forget_locally(token.key)
+        _entries[token.key] = (time.monotonic() + get_timeout(), token, user)
+        _user_keys.setdefault(user.pk, set()).add(token.key)
+        while len(_entries) > get_max_size():
+            _forget_locally(next(iter(_entries)))
+            evicted += 1
+    if evicted:
+        _count('evictions', evicted)
+
+
+def invalidate_token(key):
+    shared = get_shared_cache()
+    if shared is not None:
+        shared.delete(f'{KEY_PREFIX}:{key}')
+    with _lock:
+        _forget_locally(key)
+    _count('invalidations')
+
+
+def invalidate_user(user_pk):
+    """Drop every cached token of a user, e.g. because the user was saved or deactivated."""
+    shared = get_shared_cache()
+    if shared is not None:
+        key = shared.get(f'{USER_PREFIX}:{user_pk}')
+        if key:
+            shared.delete_many([f'{KEY_PREFIX}:{key}', f'{USER_PREFIX}:{user_pk}'])
+    with _lock:
+        for key in list(_user_keys.get(user_pk, ())):
+            _forget_locally(key)
+    _count('invalidations')
+
+
+def get_token_for_user(user):
+    """
+    The user's token, created if they don't have one yet. Logging in again with a
+    token we've already cached doesn't touch the database.
+    """
+    shared = get_shared_cache()
+    if shared is not None:
+        key = shared.get(f'{USER_PREFIX}:{user.pk}')
+    else:
+        with _lock:
+            key = next(iter(_user_keys.get(user.pk, ())), None)
+    cached = _lookup(key) if key else None
+    if cached is not None:
+        return cached[0]
+
+    token, created = Token.objects.get_or_create(user=user)
+    remember(token, user)
+    return token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication backed by the token cache above. ``aauthenticate()`` is the
+    same for async views (culinary_connect/async_views.py): a cached token costs
+    nothing, a new one a single async query.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = _lookup(key)
+        if cached is None:
+            _count('misses')
+            user, token = super().authenticate_credentials(key)
+            remember(*self._copies(token, user))
+            return user, token
+
+        _count('hits')
+        return self._from_cache(*cached)
+
+    async def aauthenticate(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return None
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        cached = await _alookup(key)
+        if cached is None:
+            _count('misses')
+            model = self.get_model()
+            try:
+                token = await model.objects.select_related('user').aget(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+            await aremember(*self._copies(token, token.user))
+            return token.user, token
+
+        _count('hits')
+        return self._from_cache(*cached)
+
+    def get_key(self, request):
+        """The token from the Authorization header, checked the way authenticate() does."""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+        elif len(auth) > 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain spaces.'))
+        try:
+            return auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid token header. Token string should not contain invalid characters.')
+            )
+
+    def _copies(self, token, user):
+        cached_user = copy.copy(user)
+        cached_token = copy.copy(token)
+        cached_token.user = cached_user
+        return cached_token, cached_user
+
+    def _from_cache(self, token, user):
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        # Hand out copies: views are free to modify request.user, and the
+        # cached instance is shared with every other request using this token
+        token, user = self._copies(token, user)
+        return user, token
+
+
+def request_user(request):
+    """
+    The user behind a plain Django request, for code that runs outside DRF's views
+    (middleware, plain views): from the session, or else from its API token - the same
+    cached lookup DRF makes when the request gets to a view.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    if request.headers.get('Authorization'):
+        try:
+            authenticated = CachedTokenAuthentication().authenticate(request)
+        except exceptions.AuthenticationFailed:
+            return None
+        return authenticated[0] if authenticated else None
+    return None
+
+
+class AsyncSessionAuthentication(SessionAuthentication):
+    """SessionAuthentication that async views can await, through request.auser()."""
+
+    async def aauthenticate(self, request):
+        auser = getattr(request._request, 'auser', None)
+        user = await auser() if auser is not None else None
+        if not user or not user.is_active:
+            return None
+        self.enforce_csrf(request)
+        return (user, None)
@@ -7,6 +7,42 @@ from django.db import models
 class CustomUser(AbstractUser):
     bio = models.TextField(max_length=500, blank=True)
     date_of_birth = models.DateField(null=True, blank=True)
-    
+    # Kept by recipes/timelines.py as people follow and unfollow; it decides whether a
+    # new recipe is pushed to every follower's feed or read from the author's own list
+    follower_count = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember the username we loaded, so a rename can still find what was cached
+        # under the old one (recipes/signals.py)
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_username = dict(zip(field_names, values)).get('username')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_username = self.username
+
+    def __str__(self):
+        return self.username
+
+
+# "follower follows followee": the followee's public recipes show up in the follower's
+# home feed (see recipes/timelines.py). The unique constraint's index answers "whom do I
+# follow"; the second one answers "who follows this author", for pushing new recipes.
+class Follow(models.Model):
+    follower = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='following')
+    followee = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='followers')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'followee'], name='unique_follow'),
+            models.CheckConstraint(condition=~models.Q(follower=models.F('followee')), name='no_self_follow'),
+        ]
+        indexes = [
+            models.Index(fields=['followee', 'follower'], name='follow_followee_idx'),
+        ]
+
     def __str__(self):
-        return self.username
\ No newline at end of file
+        return f"{self.follower_id} -> {self.followee_id}"
\ No newline at end of file
@@ -1,7 +1,8 @@
 from rest_framework import serializers
+from monitoring.instrumentation import TimedSerializerMixin
 from .models import CustomUser
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # Ensure password is write-only for security
     password = serializers.CharField(write_only=True)
 
@@ -22,7 +23,7 @@ class UserSerializer(serializers.ModelSerializer):
             instance.set_password(password)
         return super().update(instance, validated_data)
 
-class UserUpdateSerializer(serializers.ModelSerializer):
+class UserUpdateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         # Limit fields for user updates to prevent unintended changes
@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import authentication
+
+User = get_user_model()
+
+
+# The token cache holds a copy of the user, so any change to the user - a profile
+# edit, deactivation on account deletion, reactivation on sign-up - has to drop it.
+@receiver(post_save, sender=User, dispatch_uid='users_forget_cached_tokens_on_save')
+@receiver(post_delete, sender=User, dispatch_uid='users_forget_cached_tokens_on_delete')
+def forget_cached_tokens(sender, instance, raw=False, **kwargs):
+    if not raw:
+        authentication.invalidate_user(instance.pk)
+
+
+# Logging out deletes the token, and a deleted token must stop working right away
+@receiver(post_delete, sender=Token, dispatch_uid='users_forget_deleted_token')
+def forget_deleted_token(sender, instance, **kwargs):
+    authentication.invalidate_token(instance.key)
@@ -0,0 +1,12 @@
+from rest_framework.authtoken.models import Token
+
+from jobs.queue import task
+
+
+@task
+def delete_tokens(user_id):
+    """
+    Delete the API tokens of a deactivated account. Deactivating already stops them
+    working; this just tidies up. If the account was reactivated meanwhile, they stay.
+    """
+    Token.objects.filter(user_id=user_id, user__is_active=False).delete()
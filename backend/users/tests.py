@@ -1,3 +1,207 @@
-from django.test import TestCase
+import pickle
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import include, path, reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from jobs import queue
+from monitoring import metrics
+from . import authentication
+from .views import AsyncUserDetailView
+
+User = get_user_model()
+
+# The profile served by its async view, for AsyncProfileViewTests (ROOT_URLCONF=__name__)
+urlpatterns = [
+    path('api/users/profile/', AsyncUserDetailView.as_view()),
+    path('api/users/', include('users.urls')),
+]
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+    authentication.clear()
+
+
+class UserQueryCountTests(TestCase):
+    """
+    Pin down how many queries each account endpoint runs, so an accidental
+    extra lookup shows up as a failing test rather than as a slow login page.
+    """
+
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create_user(username='chef', password='secret-pass-123', email='chef@example.com')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+
+    def authenticate(self):
+        # Measure the steady state, where the token comes out of the token cache
+        authentication.remember(self.token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_register(self):
+        data = {'username': 'newcook', 'password': 'secret-pass-123', 'email': 'new@example.com'}
+        # unique username check, existing user lookup, insert user, insert token
+        with self.assertNumQueries(4):
+            response = self.client.post(reverse('register'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_login(self):
+        data = {'username': 'chef', 'password': 'secret-pass-123'}
+        # user lookup, token get_or_create
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('api_token_auth'), data, format='json')
+        self.assertEqual(response.status_code, 200)
+        # the token is cached now, only the password check is left
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse('api_token_auth'), data, format='json')
+        self.assertEqual(response.data['data']['token'], self.token.key)
+
+    def test_profile_retrieve(self):
+        self.authenticate()
+        # the token and its user come from the token cache
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('user-detail'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_revalidation(self):
+        self.authenticate()
+        etag = self.client.get(reverse('user-detail'))['ETag']
+        self.assertEqual(self.client.get(reverse('user-detail'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        response = self.client.patch(reverse('user-detail'), {'bio': "I cook."}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(reverse('user-detail'), {'bio': "I bake."}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+
+    def test_profile_update(self):
+        self.authenticate()
+        # update, the user's recipes (to refresh cached recipe responses)
+        with self.assertNumQueries(2):
+            response = self.client.patch(reverse('user-detail'), {'bio': "I cook."}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_delete(self):
+        self.authenticate()
+        # deactivate, then queue the job that deletes the tokens
+        with self.assertNumQueries(2):
+            response = self.client.delete(reverse('user-delete'))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(reverse('user-detail')).status_code, 401)
+        self.assertTrue(Token.objects.filter(user=self.user).exists())
+        queue.run_pending()
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+
+    def test_logout(self):
+        self.authenticate()
+        # find and delete the token
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('logout'))
+        self.assertEqual(response.status_code, 200)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        authentication.reset_stats()
+        self.user = User.objects.create_user(username='chef', password='secret-pass-123')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_only_the_first_request_looks_the_token_up(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse('user-detail'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('user-detail'))
+        stats = authentication.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertIn('token_auth_cache_events_total{event="hit"} 1', metrics.exposition())
+        # Kept where every worker sees it, and sees it go
+        self.assertIsNotNone(caches['default'].get(f'{authentication.KEY_PREFIX}:{self.token.key}'))
+        self.assertEqual(authentication.stats()['size'], 0)
+
+    def test_logged_out_token_stops_working(self):
+        self.client.get(reverse('user-detail'))
+        self.assertEqual(self.client.post(reverse('logout')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('user-detail')).status_code, 401)
+
+    def test_deleted_account_token_stops_working(self):
+        self.client.get(reverse('user-detail'))
+        self.assertEqual(self.client.delete(reverse('user-delete')).status_code, 204)
+        self.assertEqual(self.client.get(reverse('user-detail')).status_code, 401)
+
+    def test_profile_edits_are_not_hidden_by_the_cache(self):
+        self.client.get(reverse('user-detail'))
+        self.client.patch(reverse('user-detail'), {'bio': "I cook."}, format='json')
+        self.assertEqual(self.client.get(reverse('user-detail')).data['data']['bio'], "I cook.")
+
+    def test_password_hash_stays_out_of_the_shared_cache(self):
+        self.client.get(reverse('user-detail'))
+        entry = caches['default'].get(f'{authentication.KEY_PREFIX}:{self.token.key}')
+        self.assertNotIn(self.user.password, pickle.dumps(entry).decode('latin-1'))
+
+        user, token = authentication.CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertEqual((user.pk, user.username, token.key, token.user_id), (self.user.pk, 'chef', self.token.key, self.user.pk))
+        self.assertEqual(user.get_deferred_fields(), {'password'})
+        # Saving the cached user leaves the password alone, checking it loads it
+        user.bio = "I cook."
+        user.save()
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('secret-pass-123'))
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password('secret-pass-123'))
+
+    @override_settings(TOKEN_AUTH_CACHE_MAX_SIZE=1, TOKEN_AUTH_CACHE_ALIAS=None)
+    def test_cache_is_bounded(self):
+        other = User.objects.create_user(username='critic', password='secret-pass-123')
+        authentication.remember(self.token)
+        authentication.remember(Token.objects.create(user=other))
+        self.assertEqual(authentication.stats()['size'], 1)
+        self.assertEqual(authentication.stats()['evictions'], 1)
+
+
+class AsyncProfileViewTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create_user(username='chef', password='secret-pass-123', bio="Soups.")
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_same_response_as_the_sync_view(self):
+        expected = self.client.get('/api/users/profile/')
+        with override_settings(ROOT_URLCONF=__name__):
+            actual = self.client.get('/api/users/profile/')
+        self.assertEqual(actual.status_code, 200)
+        self.assertEqual(actual.content, expected.content)
+        self.assertEqual(actual['ETag'], expected['ETag'])
+
+    @override_settings(ROOT_URLCONF=__name__)
+    def test_token_is_looked_up_once(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/users/profile/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/profile/')
+        self.assertEqual(response.json()['data']['bio'], "Soups.")
+
+        # Edits go through the sync view and still show up straight away
+        self.client.patch('/api/users/profile/', {'bio': "Stews."}, format='json')
+        self.assertEqual(self.client.get('/api/users/profile/').json()['data']['bio'], "Stews.")
+
+    @override_settings(ROOT_URLCONF=__name__, TOKEN_AUTH_CACHE_ALIAS='default')
+    def test_rejected_tokens(self):
+        self.client.get('/api/users/profile/')
+        self.client.post('/api/users/logout/')
+        response = self.client.get('/api/users/profile/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'detail': 'Invalid token.'})
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+        self.client.credentials()
+        self.assertEqual(self.client.get('/api/users/profile/').status_code, 401)
@@ -1,12 +1,13 @@
 from django.urls import path
-from .views import RegisterView, UserDetailView, UserDeleteView, LogoutView
+from culinary_connect.async_views import select_view
+from .views import RegisterView, UserDetailView, AsyncUserDetailView, UserDeleteView, LogoutView
 
 urlpatterns = [
     # User registration endpoint
     path('register/', RegisterView.as_view(), name='register'),
 
     # Retrieve or update user profile
-    path('profile/', UserDetailView.as_view(), name='user-detail'),
+    path('profile/', select_view('user-detail', UserDetailView, AsyncUserDetailView), name='user-detail'),
 
     # Delete user account
     path('delete/', UserDeleteView.as_view(), name='user-delete'),
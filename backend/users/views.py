@@ -7,6 +7,11 @@ from rest_framework.authtoken.models import Token
 from .serializers import UserSerializer, UserUpdateSerializer
 from rest_framework.views import APIView 
 from django.contrib.auth import authenticate
+from .authentication import get_token_for_user
+from . import tasks
+from culinary_connect.conditional import ConditionalGetMixin, make_etag, set_validators
+from culinary_connect.async_views import AsyncRetrieveModelMixin, AsyncViewMixin
+from culinary_connect import replicas
 
 logger = logging.getLogger(__name__)
 
@@ -56,7 +61,7 @@ class RegisterView(generics.CreateAPIView):
         user.is_active = True
         user.set_password(validated_data['password'])
         user.save()
-        Token.objects.get_or_create(user=user)
+        get_token_for_user(user)
         return user
 
 class CustomObtainAuthToken(ObtainAuthToken):
@@ -68,7 +73,9 @@ class CustomObtainAuthToken(ObtainAuthToken):
         if serializer.is_valid():
             user = serializer.validated_data['user']
             logger.info(f"User authenticated: {user.username}, is_active: {user.is_active}")
-            token, created = Token.objects.get_or_create(user=user)
+            token = get_token_for_user(user)
+            # The token may be brand new: read it back from the primary until the replicas have it
+            replicas.pin_token(token)
             return Response({
                 "status": "success",
                 "code": "LOGIN_SUCCESSFUL",
@@ -89,9 +96,11 @@ class CustomObtainAuthToken(ObtainAuthToken):
                 "message": "Unable to log in with provided credentials"
             }, status=status.HTTP_400_BAD_REQUEST)
 
-class UserDetailView(generics.RetrieveUpdateAPIView):
+class UserDetailView(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     """
     Retrieve or update user profile information.
+    Users have no updated_at, so the ETag is a hash of the profile fields themselves;
+    authentication already loaded the user, so that costs no queries.
     """
     queryset = User.objects.all()
     serializer_class = UserUpdateSerializer
@@ -100,6 +109,11 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         return self.request.user
 
+    def get_validators(self, request):
+        user = self.request.user
+        values = [str(getattr(user, field)) for field in self.get_serializer_class().Meta.fields]
+        return make_etag('profile', user.pk, values, request.accepted_renderer.format), None
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance)
@@ -113,16 +127,20 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
+        failed = self.check_write_preconditions(request, *self.get_validators(request))
+        if failed:
+            return failed
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
 
-        return Response({
+        response = Response({
             "status": "success",
             "code": "PROFILE_UPDATED",
             "message": "User profile updated successfully",
             "data": serializer.data
         })
+        return set_validators(response, *self.get_validators(request))
 
 class UserDeleteView(generics.DestroyAPIView):
     """
@@ -137,8 +155,10 @@ class UserDeleteView(generics.DestroyAPIView):
     def perform_destroy(self, instance):
         logger.info(f"Deactivating user: {instance.username}")
         instance.is_active = False
-        instance.save()
-        Token.objects.filter(user=instance).delete()
+        instance.save(update_fields=['is_active'])
+        # Inactive users' tokens are refused already (and dropped from the token cache
+        # by the save), so the tokens themselves can go in the background
+        tasks.delete_tokens.enqueue(instance.pk, key=f'delete-tokens:{instance.pk}')
         return Response({
             "status": "success",
             "code": "ACCOUNT_DEACTIVATED",
@@ -152,9 +172,16 @@ class LogoutView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def post(self, request):
-        request.user.auth_token.delete()
+        # Deleting by user id skips loading the token row just to delete it
+        Token.objects.filter(user=request.user).delete()
         return Response({
             "status": "success",
             "code": "LOGOUT_SUCCESSFUL",
             "message": "User logged out successfully."
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        }, status=status.HTTP_200_OK)
+
+# UserDetailView for the event loop (see culinary_connect/async_views.py). Once the token
+# is authenticated there's nothing left to wait for: the profile is request.user.
+class AsyncUserDetailView(AsyncViewMixin, UserDetailView, AsyncRetrieveModelMixin):
+    async def aretrieve(self, request, *args, **kwargs):
+        return self.retrieve(request, *args, **kwargs)
@@ -33,9 +33,13 @@ export const logout = async () => {
   return response.data;
 };
 
+// List endpoints send a summary of each recipe by default; ask for just what a card shows.
+// The next/previous links carry the same ?fields= along.
+const CARD_FIELDS = "id,title,description,difficulty,preparation_time,image";
+
 export const getAllRecipes = async (url = null) => {
   try {
-    const response = await api.get(url || "/recipes/");
+    const response = await api.get(url || "/recipes/", url ? {} : { params: { fields: CARD_FIELDS } });
     return response.data;
   } catch (error) {
     console.error("Error fetching recipes:", error);
@@ -80,7 +84,7 @@ export const deleteRecipe = async (id) => {
 
 export const getUserRecipes = async (url = null) => {
   try {
-    const response = await api.get(url || "/my-recipes/");
+    const response = await api.get(url || "/my-recipes/", url ? {} : { params: { fields: CARD_FIELDS } });
     return response.data;
   } catch (error) {
     console.error("Error fetching user recipes:", error);